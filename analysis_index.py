@@ -0,0 +1,186 @@
+"""
+Persistent index of the analysis of every file in a library.
+
+Every file's analysis (see operations.analysis: loudness, true peak, noise floor and SNR,
+crest factor, reverberation time and echo delay) is stored in an SQLite file, one row per
+file, and kept while the file's size and modification time are unchanged. Batch runs given
+an index (batch.py --analysis-index) analyze each file once, skip the stages it does not
+need and tune the rest to it (see AudioProcessor.adapt); the index can also be built ahead
+of processing, and queried with SQL conditions on its columns.
+
+Usage:
+    python analysis_index.py library.sqlite --analyze INPUT_FOLDER --recursive --workers 4
+    python analysis_index.py library.sqlite --where "echo_delay_ms IS NOT NULL" --order-by echo_strength
+    python analysis_index.py library.sqlite --where "snr_db < ?" --parameter 15
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Bump when a change to operations.analysis alters its measurements, so files are analyzed again.
+ANALYSIS_VERSION = 1
+
+# Columns of the analysis, in the order of FileAnalyzer.measurements.
+COLUMNS = ("integrated_lufs", "true_peak_dbtp", "rms_db", "crest_factor_db", "noise_floor_db", "snr_db",
+           "rt60_seconds", "echo_delay_ms", "echo_strength", "duration_seconds", "sample_rate", "channels")
+
+_FILE_COLUMNS = ("path", "size", "mtime", "version", "analyzed")
+
+
+class AnalysisIndex:
+    """The analyses of a library's files in an SQLite file, safe to share between processes."""
+
+    def __init__(self, path):
+        """
+        Parameters:
+            path (str): SQLite file, created with its folder if missing.
+        """
+        self.path = path
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._db.execute(f"""CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY, size INTEGER, mtime REAL, version INTEGER, analyzed REAL,
+            {", ".join(f"{column} REAL" for column in COLUMNS)})""")
+
+    def close(self):
+        self._db.close()
+
+    def get(self, filepath):
+        """Returns the stored analysis of a file, or None when it is missing, stale or outdated."""
+        path = os.path.abspath(filepath)
+        with self._lock:
+            row = self._db.execute(f"SELECT size, mtime, version, {', '.join(COLUMNS)} FROM files WHERE path = ?",
+                                   (path,)).fetchone()
+        if row is None or tuple(row[:3]) != (os.path.getsize(path), os.path.getmtime(path), ANALYSIS_VERSION):
+            return None
+        return self._analysis(row[3:])
+
+    def put(self, filepath, analysis):
+        """Stores the analysis of a file, as of its current size and modification time."""
+        path = os.path.abspath(filepath)
+        values = (path, os.path.getsize(path), os.path.getmtime(path), ANALYSIS_VERSION, time.time())
+        values += tuple(analysis[column] for column in COLUMNS)
+        columns = _FILE_COLUMNS + COLUMNS
+        with self._lock:
+            self._db.execute(f"INSERT OR REPLACE INTO files ({', '.join(columns)}) "
+                             f"VALUES ({', '.join('?' * len(columns))})", values)
+
+    def query(self, where=None, parameters=(), order_by=None, limit=None):
+        """
+        Returns the indexed files matching an SQL condition on the columns, as dicts of the
+        analysis with the file's path, e.g. query("snr_db < ? AND echo_delay_ms IS NOT NULL", (15,)).
+
+        Parameters:
+            where (str, optional): SQL condition; every file without one.
+            parameters (tuple): Values for the condition's ? placeholders.
+            order_by (str, optional): Column (optionally followed by DESC) to sort by; default: path.
+            limit (int, optional): Return at most this many files.
+        """
+        sql = f"SELECT path, {', '.join(COLUMNS)} FROM files WHERE version = ?"
+        if where:
+            sql += f" AND ({where})"
+        sql += f" ORDER BY {order_by or 'path'}"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        with self._lock:
+            rows = self._db.execute(sql, (ANALYSIS_VERSION,) + tuple(parameters)).fetchall()
+        return [dict(self._analysis(row[1:]), path=row[0]) for row in rows]
+
+    @staticmethod
+    def _analysis(values):
+        analysis = dict(zip(COLUMNS, values))
+        analysis["sample_rate"], analysis["channels"] = int(analysis["sample_rate"]), int(analysis["channels"])
+        return analysis
+
+
+def analyze_file(filepath):
+    """Analyzes a file block by block (see AudioProcessor.file_analysis)."""
+    from processing import AudioProcessor
+    return AudioProcessor().file_analysis(filepath)
+
+
+def build_index(index, files, workers=1, log=None):
+    """
+    Analyzes the files missing from an index, or changed since, and stores their analyses.
+
+    Parameters:
+        index (AnalysisIndex): The index.
+        files (list): Audio file paths.
+        workers (int): Files analyzed at once, each in a worker process when more than 1.
+        log (callable, optional): Called with a line for every file analyzed or failed.
+
+    Returns:
+        int: The number of files analyzed.
+    """
+    stale = [path for path in files if index.get(path) is None]
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 and len(stale) > 1 else None
+    try:
+        futures = [pool.submit(analyze_file, path) if pool else None for path in stale]
+        analyzed = 0
+        for path, future in zip(stale, futures):
+            try:
+                analysis = future.result() if future else analyze_file(path)
+            except Exception as e:
+                if log:
+                    log(f"{path}: failed ({type(e).__name__}: {e})")
+                continue
+            if analysis is None:
+                continue
+            index.put(path, analysis)
+            analyzed += 1
+            if log:
+                log(f"{path}: {analysis['integrated_lufs']:.1f} LUFS, noise floor {analysis['noise_floor_db']:.1f} dBFS"
+                    + (f", echo at {analysis['echo_delay_ms']:.0f} ms" if analysis["echo_delay_ms"] else ""))
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return analyzed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build and query the analysis index of a library of audio files.")
+    parser.add_argument("index", help="Index file (SQLite), created if missing.")
+    parser.add_argument("--analyze", default=None, metavar="FOLDER",
+                        help="First analyze the audio files of this folder that are new or changed.")
+    parser.add_argument("--recursive", action="store_true", help="With --analyze, also analyze subfolders.")
+    parser.add_argument("--workers", type=int, default=1, help="Files analyzed at once (default: 1).")
+    parser.add_argument("--where", default=None,
+                        help=f"SQL condition on the columns to list the matching files: {', '.join(COLUMNS)}.")
+    parser.add_argument("--parameter", action="append", type=float, default=[],
+                        help="Value of the next ? placeholder of --where (repeatable).")
+    parser.add_argument("--order-by", default=None, help="Column to sort the files by, optionally with DESC.")
+    parser.add_argument("--limit", type=int, default=None, help="List at most this many files.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    index = AnalysisIndex(args.index)
+    try:
+        if args.analyze:
+            from batch import discover_files
+            files = discover_files(args.analyze, args.recursive, exclude=[args.index])
+            analyzed = build_index(index, files, args.workers, log=lambda line: print(line, file=sys.stderr))
+            print(f"{analyzed} of {len(files)} files analyzed.", file=sys.stderr)
+            if args.where is None and args.order_by is None:
+                return 0
+        try:
+            files = index.query(args.where, args.parameter, args.order_by, args.limit)
+        except sqlite3.Error as e:
+            print(f"Invalid query: {e}", file=sys.stderr)
+            return 1
+        print(json.dumps(files, indent=2))
+        return 0
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
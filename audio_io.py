@@ -0,0 +1,305 @@
+"""
+Native audio file reading and writing.
+
+Files libsndfile understands (WAV, FLAC, OGG/Vorbis, AIFF, ...) are decoded
+straight into one float32 buffer without going through pydub/ffmpeg.
+Uncompressed 16/32-bit PCM and float WAV data is memory-mapped rather than
+read, and converted block by block, so the only full-length allocation is
+the result.
+
+Mono audio is a 1D array; multichannel audio keeps its channels as a
+(channels, samples) array, and is only downmixed when asked to.
+"""
+import contextlib
+import os
+import struct
+import uuid
+import numpy as np
+import soundfile as sf
+
+# Output sample formats accepted by write_audio.
+SUBTYPES = ("PCM_16", "PCM_24", "FLOAT")
+
+# Frames converted or downmixed at a time.
+BLOCK_FRAMES = 1 << 18
+
+_WAVE_FORMAT_PCM = 1
+_WAVE_FORMAT_IEEE_FLOAT = 3
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# (format tag, bits per sample) -> (stored dtype, scale to [-1, 1])
+_MAPPABLE = {
+    (_WAVE_FORMAT_PCM, 16): (np.dtype("<i2"), 1.0 / 2 ** 15),
+    (_WAVE_FORMAT_PCM, 32): (np.dtype("<i4"), 1.0 / 2 ** 31),
+    (_WAVE_FORMAT_IEEE_FLOAT, 32): (np.dtype("<f4"), 1.0),
+    (_WAVE_FORMAT_IEEE_FLOAT, 64): (np.dtype("<f8"), 1.0),
+}
+
+
+def _wav_layout(filepath):
+    """
+    Locates the sample data of a plain RIFF/WAVE file.
+
+    Returns:
+        tuple: (data offset, frames, channels, sample rate, stored dtype, scale), or None when
+            the file is not a WAV file or its sample format can't be memory-mapped (e.g. 24-bit).
+    """
+    file_size = os.path.getsize(filepath)
+    with open(filepath, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            return None
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, chunk_size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+            if chunk_id == b"fmt ":
+                body = f.read(chunk_size)
+                if len(body) < 16:
+                    return None
+                tag, channels, sample_rate, _, block_align, bits = struct.unpack("<HHIIHH", body[:16])
+                if tag == _WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                    tag = struct.unpack("<H", body[24:26])[0]  # first two bytes of the sub-format GUID
+                fmt = (tag, channels, sample_rate, block_align, bits)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    return None
+                tag, channels, sample_rate, block_align, bits = fmt
+                if (tag, bits) not in _MAPPABLE or channels < 1 or block_align != channels * bits // 8:
+                    return None
+                offset = f.tell()
+                # Writers that stream to disk may leave the size unset; trust the file length then.
+                available = file_size - offset
+                size = available if chunk_size in (0, 0xFFFFFFFF) else min(chunk_size, available)
+                dtype, scale = _MAPPABLE[(tag, bits)]
+                return offset, size // block_align, channels, sample_rate, dtype, scale
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)  # chunks are word-aligned
+
+
+def _convert_into(out, frames_source, channels, scale):
+    """
+    Fills out, a (channels, frames) array, with the scaled, de-interleaved frames_source(start, stop),
+    block by block.
+    """
+    for start in range(0, out.shape[1], BLOCK_FRAMES):
+        stop = min(start + BLOCK_FRAMES, out.shape[1])
+        np.multiply(frames_source(start, stop).T, scale, out=out[:, start:stop], casting="unsafe")
+    return out
+
+
+def _downmix_into(out, frames_source, channels, scale):
+    """
+    Fills out with the scaled channel average of frames_source(start, stop), block by block.
+    """
+    for start in range(0, len(out), BLOCK_FRAMES):
+        stop = min(start + BLOCK_FRAMES, len(out))
+        block = frames_source(start, stop)
+        target = out[start:stop]
+        # Accumulating channel columns is several times faster than a sum over axis 1.
+        np.copyto(target, block[:, 0], casting="unsafe")
+        for channel in range(1, channels):
+            target += block[:, channel]
+        if scale != 1.0 or channels > 1:
+            target *= scale / channels
+    return out
+
+
+def _empty(frames, channels, mono):
+    # 1D for mono audio (or a downmix), (channels, frames) otherwise.
+    if mono or channels == 1:
+        return np.empty(frames, dtype=np.float32)
+    return np.empty((channels, frames), dtype=np.float32)
+
+
+def _fill(out, frames_source, channels, scale):
+    if out.ndim == 1:
+        return _downmix_into(out, frames_source, channels, scale)
+    return _convert_into(out, frames_source, channels, scale)
+
+
+def read_audio(filepath, mono=False):
+    """
+    Reads an audio file as float32 in [-1, 1], scaled for its own sample format.
+
+    Mono 32-bit float WAV is returned as a copy-on-write memory map of the file; other
+    mappable WAV data is converted from a memory map without reading it into memory first.
+
+    Parameters:
+        filepath (str): File to read.
+        mono (bool): Downmix multichannel audio to one channel (the channel average).
+
+    Returns:
+        tuple: (audio_data, sample_rate), or None if libsndfile can't read the file
+            (the caller then falls back to pydub). audio_data is 1D for mono audio and
+            (channels, samples) otherwise.
+    """
+    layout = _wav_layout(filepath)
+    if layout is not None:
+        offset, frames, channels, sample_rate, dtype, scale = layout
+        if frames == 0:
+            return _empty(0, channels, mono), sample_rate
+        mapped = np.memmap(filepath, dtype=dtype, mode="c", offset=offset, shape=(frames, channels))
+        # Windows locks mapped files, which would stop the output replacing its own input.
+        if channels == 1 and dtype == np.float32 and os.name != "nt":
+            return mapped.reshape(-1), sample_rate
+        out = _empty(frames, channels, mono)
+        return _fill(out, lambda start, stop: mapped[start:stop], channels, scale), sample_rate
+
+    try:
+        source = sf.SoundFile(filepath)
+    except (RuntimeError, TypeError):
+        return None
+    with source:
+        channels = source.channels
+        buffer = np.empty((BLOCK_FRAMES, channels), dtype=np.float32)
+
+        def read_frames(start, stop):
+            # libsndfile scales integer formats to [-1, 1] itself.
+            return source.read(stop - start, dtype="float32", always_2d=True, out=buffer[:stop - start])
+
+        if source.frames > 0 and source.seekable():
+            out = _empty(source.frames, channels, mono)
+            return _fill(out, read_frames, channels, 1.0), source.samplerate
+
+        # Length unknown up front: collect blocks.
+        blocks = []
+        while True:
+            block = source.read(BLOCK_FRAMES, dtype="float32", always_2d=True)
+            if not len(block):
+                break
+            blocks.append(_fill(_empty(len(block), channels, mono), lambda start, stop: block[start:stop],
+                                channels, 1.0))
+        if not blocks:
+            return _empty(0, channels, mono), source.samplerate
+        return np.concatenate(blocks, axis=-1), source.samplerate
+
+
+def output_format(filepath, subtype="PCM_16"):
+    """
+    Returns the (format, subtype) libsndfile writes filepath with: the container named by its
+    extension (WAV for an unknown one), and subtype, or the container's default subtype when it
+    cannot hold subtype (e.g. FLOAT in FLAC, or anything but Vorbis in OGG).
+    """
+    extension = os.path.splitext(filepath)[1][1:].upper()
+    file_format = extension if extension in sf.available_formats() else "WAV"
+    if not sf.check_format(file_format, subtype):
+        subtype = sf.default_subtype(file_format)
+    return file_format, subtype
+
+
+def partial_path(filepath):
+    """Temporary path next to filepath, unique among processes and hosts writing to its folder."""
+    return f"{filepath}.{uuid.uuid4().hex[:12]}.part"
+
+
+@contextlib.contextmanager
+def atomic_output(filepath):
+    """
+    Context manager yielding a temporary path to write filepath's contents to. The finished
+    file is moved over filepath, so readers never see a partial file; on an exception it
+    is removed instead.
+    """
+    temp_path = partial_path(filepath)
+    try:
+        yield temp_path
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, filepath)
+
+
+class AudioWriter:
+    """
+    Audio file written block by block, in the container its extension names (see output_format).
+
+    Each block is scaled, clipped and quantized through one preallocated buffer, so
+    writing never makes a full-length integer copy. The file is written next to its
+    final path and moved over it by close(), so overwriting a file that is still
+    memory-mapped by read_audio leaves the mapping intact. Use as a context manager;
+    on an exception the partial file is removed.
+    """
+
+    def __init__(self, filepath, sample_rate, subtype="PCM_16", block_size=BLOCK_FRAMES, channels=1):
+        """
+        Parameters:
+            filepath (str): Output path.
+            sample_rate (int): Sample rate of the audio.
+            subtype (str): "PCM_16", "PCM_24" or "FLOAT" (32-bit float), if the container can hold it.
+            block_size (int): Frames quantized at a time; longer writes are split.
+            channels (int): Channel count. Blocks of multichannel audio are (channels, frames) arrays.
+        """
+        if subtype not in SUBTYPES:
+            raise ValueError(f"Unsupported output format: {subtype}")
+        file_format, subtype = output_format(filepath, subtype)
+        if subtype == "PCM_16":
+            self._scale, dtype, self._limits = 2 ** 15, np.int16, (-2 ** 15, 2 ** 15 - 1)
+        elif subtype == "PCM_24":
+            # libsndfile stores the top 24 bits of int32 samples.
+            self._scale, dtype, self._limits = 2 ** 31, np.int32, (-2 ** 31, 2 ** 31 - 1)
+        else:
+            # Float, or a compressed subtype (Vorbis, MP3) libsndfile encodes from floats.
+            self._scale, dtype, self._limits = None, np.float32, None
+        # Interleaved (frames, channels) scratch buffers, the layout libsndfile writes.
+        shape = (block_size,) if channels == 1 else (block_size, channels)
+        self._work = np.empty(shape, dtype=np.float64)
+        self._converted = np.empty(shape, dtype=dtype)
+        self.filepath = filepath
+        self._temp_path = partial_path(filepath)
+        self._sink = sf.SoundFile(self._temp_path, "w", samplerate=sample_rate, channels=channels,
+                                  subtype=subtype, format=file_format)
+
+    def write(self, audio_data):
+        """Appends samples in [-1, 1]; integer formats clip out-of-range samples."""
+        size = len(self._work)
+        for start in range(0, audio_data.shape[-1], size):
+            # Transposing a (channels, frames) block interleaves it as it is copied.
+            block = audio_data[..., start:start + size].T
+            n = len(block)
+            if self._scale is None:
+                self._converted[:n] = block
+            else:
+                np.multiply(block, self._scale, out=self._work[:n])
+                np.clip(self._work[:n], *self._limits, out=self._work[:n])
+                self._converted[:n] = self._work[:n]
+            self._sink.write(self._converted[:n])
+
+    def close(self):
+        """Finishes the file and moves it to its final path."""
+        self._sink.close()
+        os.replace(self._temp_path, self.filepath)
+
+    def abort(self):
+        """Discards the partial file."""
+        self._sink.close()
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_audio(filepath, audio_data, sample_rate, subtype="PCM_16"):
+    """
+    Writes audio in [-1, 1] through an AudioWriter, in the container of filepath's extension
+    and keeping its channel count.
+
+    Parameters:
+        filepath (str): Output path.
+        audio_data (np.ndarray): Normalized samples, 1D for mono or (channels, samples).
+        sample_rate (int): Sample rate of the audio.
+        subtype (str): "PCM_16", "PCM_24" or "FLOAT" (32-bit float), if the container can hold it.
+    """
+    frames = audio_data.shape[-1]
+    channels = 1 if audio_data.ndim == 1 else audio_data.shape[0]
+    with AudioWriter(filepath, sample_rate, subtype, min(BLOCK_FRAMES, max(1, frames)), channels) as writer:
+        writer.write(audio_data)
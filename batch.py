@@ -0,0 +1,667 @@
+"""
+Headless batch processing.
+
+Processes every audio file in a folder on a pool of worker processes, applying
+the selected operations in the same order as the GUI, and writes a JSON summary.
+
+With a job manifest (see manifest.py), any number of batch processes, on one host or
+on several hosts sharing the folders, split the files between them, and a rerun only
+processes the files that are new, changed, failed or missing their output.
+
+With an analysis index (see analysis_index.py), every file is analyzed once, and the
+stages it does not need (Volume Normalization on a file already at the target loudness,
+Echo Reduction without an echo, Noise Reduction below a quiet noise floor) are skipped,
+while Echo Reduction is tuned to the file's echo delay.
+
+Usage:
+    python batch.py INPUT_FOLDER OUTPUT_FOLDER --noise --reverb --normalize --workers 8
+    python batch.py INPUT_FOLDER OUTPUT_FOLDER --noise --recursive --manifest jobs.sqlite
+    python batch.py INPUT_FOLDER OUTPUT_FOLDER --echo --normalize --analysis-index library.sqlite
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import multiprocessing
+
+from manifest import DEFAULT_LEASE, progress_line, settings_key, worker_name
+from telemetry import stage_totals, write_report
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".flac", ".ogg")
+
+# Rough peak working set of one file, as a multiple of its decoded float32 size.
+MEMORY_OVERHEAD = 8
+
+# Compression ratio assumed for formats whose decoded length can't be read cheaply.
+COMPRESSED_EXPANSION = 12
+
+# Working set of one file in streaming mode, which does not grow with the file length.
+STREAMING_MEMORY = 256 * 1024 ** 2
+
+# Seconds between progress lines from the manifest.
+PROGRESS_INTERVAL = 30.0
+
+# Environment variables that keep numerical libraries to one thread per worker process.
+_SINGLE_THREAD_ENV = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+_worker_processor = None
+_worker_index = None
+
+
+class FileTimeout(Exception):
+    """Raised inside a worker when a file exceeds its time limit."""
+
+
+def _on_alarm(signum, frame):
+    raise FileTimeout()
+
+
+def _init_worker(cache_dir=None, cache_size=None, profile_stage=None, profile_dir=None, parameters=None,
+                 channel_workers=None, arena=True, activity_gate=None, analysis_index=None, trace_memory=False):
+    """Creates the AudioProcessor reused for every file handled by this worker process."""
+    global _worker_processor, _worker_index
+    from processing import AudioProcessor
+    from operations.arena import BufferArena
+    from telemetry import Telemetry
+    cache = None
+    if cache_dir:
+        from cache import DEFAULT_MAX_BYTES, ResultCache
+        cache = ResultCache(cache_dir, cache_size or DEFAULT_MAX_BYTES)
+    telemetry = Telemetry(trace_memory=trace_memory, profile_stage=profile_stage, profile_dir=profile_dir)
+    # One arena per worker, so the buffers of a file are reused for the next.
+    _worker_processor = AudioProcessor(cache=cache, telemetry=telemetry, parameters=parameters,
+                                       channel_workers=channel_workers, arena=BufferArena() if arena else None,
+                                       activity_gate=activity_gate)
+    if analysis_index:
+        from analysis_index import AnalysisIndex
+        _worker_index = AnalysisIndex(analysis_index)
+    if hasattr(signal, "SIGALRM"):
+        signal.signal(signal.SIGALRM, _on_alarm)
+
+
+def process_file(in_file, out_file, operations, timeout=None, streaming=False, subtype="PCM_16",
+                 file_report=None, normalization="exact", skip_unneeded=True, tune=True):
+    """
+    Processes one file inside a worker process.
+
+    Parameters:
+        in_file (str): Path of the audio file to process.
+        out_file (str): Path the processed audio is written to.
+        operations (list): Operation names; they are applied in OPERATION_ORDER.
+        timeout (float, optional): Seconds after which the file is abandoned (POSIX only).
+        streaming (bool): Process block by block instead of loading the whole file.
+        subtype (str): Output sample format, "PCM_16", "PCM_24" or "FLOAT".
+        file_report (str, optional): "json" or "csv": also write this file's stage records next
+            to its output, as OUTPUT.telemetry.json or OUTPUT.telemetry.csv.
+        normalization (str): "exact" or "lookahead" Volume Normalization in streaming mode.
+        skip_unneeded (bool): With the worker's analysis index, skip the operations the file does
+            not need (see AudioProcessor.adapt).
+        tune (bool): With the worker's analysis index, tune parameters to the file.
+
+    Returns:
+        dict: Per-file record for the batch summary. "stages" maps each stage to its wall time;
+            "telemetry" holds the full stage records (see telemetry.Telemetry). With an analysis
+            index, "skipped" maps the skipped operations to the reason and "tuned" holds the
+            tuned parameters by operation.
+    """
+    from processing import sort_operations
+
+    processor = _worker_processor
+    record = {"input": in_file, "output": out_file, "status": "ok", "error": None, "stages": {}}
+    telemetry = processor.telemetry
+    telemetry.clear()
+    cache = processor.cache
+    if cache is not None:
+        before = (cache.hits, cache.misses, cache.bytes_saved)
+    start = time.perf_counter()
+    use_alarm = bool(timeout) and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        operations, tuned = sort_operations(operations), {}
+        if _worker_index is not None and (skip_unneeded or tune):
+            # An "analyze" stage, unless the index already has this file.
+            analysis = processor.file_analysis(in_file, _worker_index)
+            if analysis is not None:
+                operations, skipped, tuned = processor.adapt(operations, analysis, skip_unneeded, tune)
+                record.update(skipped=skipped, tuned=tuned)
+        with processor.with_parameters(tuned):
+            if streaming:
+                import soundfile as sf
+                info = sf.info(in_file)
+                record["audio_seconds"] = info.frames / info.samplerate
+                processor.process_file_streaming(in_file, out_file, operations, subtype=subtype,
+                                                 normalization=normalization)
+                return record
+
+            # With a cache, "decode" may instead load the furthest cached stage of this file.
+            remaining = processor.load_cached(in_file, operations)
+            record["audio_seconds"] = processor.audio_data.shape[-1] / processor.sample_rate
+
+            # Stages are the planned steps; fused steps appear as e.g. "Volume Normalization + Volume
+            # Compression", and a final pointwise step that also writes the output ends in "+ encode".
+            processor.process_operations(remaining, output_path=out_file, subtype=subtype)
+    except FileTimeout:
+        record["status"] = "timeout"
+        record["error"] = f"Exceeded {timeout} s"
+    except Exception as e:
+        record["status"] = "failed"
+        record["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        # Release the decoded buffer before the worker picks up the next file, or keep it in the
+        # arena for reuse.
+        if processor.arena is not None:
+            processor.arena.give_back(processor.audio_data)
+        processor.audio_data = None
+        record["seconds"] = time.perf_counter() - start
+        record["stages"] = {r["stage"]: r["wall_seconds"] for r in telemetry.records}
+        record["telemetry"] = list(telemetry.records)
+        if file_report and record["status"] == "ok":
+            write_report(f"{out_file}.telemetry.{file_report}", telemetry.records)
+        if record["status"] == "ok" and record.get("audio_seconds"):
+            record["realtime_factor"] = record["audio_seconds"] / record["seconds"]
+        if cache is not None:
+            after = (cache.hits, cache.misses, cache.bytes_saved)
+            record["cache"] = dict(zip(("hits", "misses", "bytes_saved"), (b - a for a, b in zip(before, after))))
+    return record
+
+
+def discover_files(input_folder, recursive=False, exclude=()):
+    """
+    Returns the audio files in input_folder, sorted by path.
+
+    Parameters:
+        input_folder (str): Folder to look in.
+        recursive (bool): Also look in its subfolders, at any depth.
+        exclude (iterable): Folders not to look in, e.g. an output folder inside input_folder.
+    """
+    if not recursive:
+        return sorted(
+            os.path.join(input_folder, f) for f in os.listdir(input_folder)
+            if f.lower().endswith(AUDIO_EXTENSIONS)
+        )
+    excluded = {os.path.realpath(folder) for folder in exclude}
+    files = []
+    for folder, subfolders, names in os.walk(input_folder):
+        subfolders[:] = [name for name in subfolders
+                         if os.path.realpath(os.path.join(folder, name)) not in excluded]
+        files += [os.path.join(folder, name) for name in names if name.lower().endswith(AUDIO_EXTENSIONS)]
+    return sorted(files)
+
+
+def job_id(path, input_folder):
+    """Manifest job id of an input file: its path relative to input_folder, with "/" separators."""
+    return os.path.relpath(path, input_folder).replace(os.sep, "/")
+
+
+def run_settings_key(operations, parameters=None, activity_gate=None, **options):
+    """
+    Settings key of a run for its manifest (see manifest.settings_key): the operations with the
+    parameters they run with, the activity gate's settings, and any other options given.
+    """
+    from processing import AudioProcessor
+    processor = AudioProcessor(parameters=parameters, activity_gate=activity_gate, channel_workers=1)
+    return settings_key(dict(options, operations=processor.settings(operations)))
+
+
+def output_file(path, output_folder, input_folder=None):
+    """
+    Output path of an input file: in output_folder under its file name, or with input_folder
+    under its path relative to input_folder, so subfolders are mirrored.
+    """
+    if input_folder is None:
+        return os.path.join(output_folder, os.path.basename(path))
+    return os.path.join(output_folder, *job_id(path, input_folder).split("/"))
+
+
+def estimate_memory(path, streaming=False):
+    """
+    Estimates the peak memory, in bytes, needed to process one file.
+    """
+    if streaming:
+        return STREAMING_MEMORY
+    decoded = None
+    try:
+        import soundfile as sf
+        info = sf.info(path)
+        decoded = info.frames * info.channels * 4
+    except Exception:
+        pass
+    if decoded is None:
+        decoded = os.path.getsize(path) * COMPRESSED_EXPANSION
+    return decoded * MEMORY_OVERHEAD
+
+
+def total_memory():
+    """Returns physical memory in bytes, or None if it can't be determined."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def renew_leases(manifest, claimed, worker, lease, stop, log=None):
+    """
+    Heartbeat loop, run on its own thread: renews worker's leases on the job ids in the set
+    claimed every third of a lease, until the event stop is set.
+    """
+    while not stop.wait(lease / 3):
+        jobs = claimed.copy()
+        try:
+            lost = jobs - manifest.heartbeat(jobs, worker, lease)
+        except Exception as e:
+            # e.g. the shared storage is briefly unavailable; the next heartbeat retries.
+            if log:
+                log(f"Heartbeat failed: {type(e).__name__}: {e}")
+            continue
+        if lost and log:
+            log(f"Lease lost to another worker: {', '.join(sorted(lost))}")
+
+
+def run_batch(files, output_folder, operations, workers=None, memory_limit=None, timeout=None, log=None,
+              streaming=False, cache_dir=None, cache_size=None, subtype="PCM_16", profile_stage=None,
+              profile_dir=None, file_report=None, normalization="exact", parameters=None, channel_workers=None,
+              arena=True, activity_gate=None, input_folder=None, manifest=None, lease=DEFAULT_LEASE,
+              analysis_index=None, skip_unneeded=True, tune=True, trace_memory=False):
+    """
+    Processes files on a process pool.
+
+    A file is only handed to a worker when the estimated memory of all files in flight,
+    including it, fits in memory_limit. A file larger than the limit still runs, alone.
+
+    With a manifest, files are claimed from it one at a time instead, and their leases are
+    renewed by a heartbeat thread while they run. Every finished file is checkpointed as
+    done or failed; files still claimed when the run stops (e.g. on Ctrl+C) are given back.
+    Once nothing is left to claim, the run waits while other workers hold leases, so it
+    takes over the files of any worker that dies.
+
+    Parameters:
+        files (list): Input file paths; ignored with a manifest.
+        output_folder (str): Folder the outputs are written to, keeping their file names, or
+            with input_folder their paths relative to it. Outputs are written to a temporary
+            name and renamed into place once complete.
+        operations (list): Operation names to apply.
+        workers (int, optional): Number of worker processes (default: CPU count).
+        memory_limit (int, optional): Byte budget for files in flight (default: 75% of RAM).
+        timeout (float, optional): Per-file time limit in seconds.
+        log (callable, optional): Called with a status line whenever a file finishes.
+        streaming (bool): Process files block by block (see AudioProcessor.process_file_streaming).
+            Streaming runs do not use the cache.
+        cache_dir (str, optional): ResultCache folder shared by the workers; no caching if not given.
+        cache_size (int, optional): Size cap of the cache in bytes.
+        subtype (str): Output sample format, "PCM_16", "PCM_24" or "FLOAT".
+        profile_stage (str, optional): Run this stage (e.g. "Reverb Reduction" or "decode") under
+            cProfile in every file, writing FILE.STAGE.prof files to profile_dir.
+        profile_dir (str, optional): Folder for the profiles (default: the output folder).
+        trace_memory (bool): Record the peak memory of every stage with tracemalloc, which
+            slows processing down about twofold.
+        file_report (str, optional): "json" or "csv" to write a stage report next to every output.
+        normalization (str): "exact" or "lookahead" Volume Normalization in streaming mode (see
+            AudioProcessor.process_file_streaming).
+        parameters (dict, optional): Operation parameter overrides for every file, e.g. a shared
+            noise profile (see AudioProcessor).
+        channel_workers (int, optional): Channels of a multichannel file each worker processes at
+            once (default: the CPUs left over per worker, at least 1). Raise it, with fewer
+            workers, for a few long multichannel recordings.
+        arena (bool): Give every worker a BufferArena, so the steps of every file write into
+            float32 buffers reused from step to step and from file to file.
+        activity_gate (ActivityGate, optional): Run Echo Reduction, Reverb Reduction and Volume
+            Compression on the active segments of every file only (see AudioProcessor).
+        input_folder (str, optional): Folder the files were discovered in; required with a manifest,
+            whose job ids are paths relative to it.
+        manifest (SQLiteManifest or DirectoryManifest, optional): Job manifest to claim files from.
+        lease (float): Seconds a claimed file stays leased to this run without a heartbeat.
+        analysis_index (str, optional): AnalysisIndex file shared by the workers. Files missing
+            from it, or changed since, are analyzed in a first, block-by-block pass.
+        skip_unneeded (bool): With analysis_index, skip the operations a file does not need.
+        tune (bool): With analysis_index, tune operation parameters (the echo delay) to every file.
+
+    Returns:
+        dict: Batch summary with one record per file, totals, and per-stage totals over all files;
+            with a manifest, also the manifest's stats() after the run; with an analysis index,
+            how often every operation was skipped.
+    """
+    workers = workers or os.cpu_count() or 1
+    channel_workers = channel_workers or max(1, (os.cpu_count() or 1) // workers)
+    if memory_limit is None:
+        ram = total_memory()
+        memory_limit = int(ram * 0.75) if ram else float("inf")
+
+    # Workers are spawned fresh so the single-thread settings take effect in them.
+    for name in _SINGLE_THREAD_ENV:
+        os.environ.setdefault(name, "1")
+    context = multiprocessing.get_context("spawn")
+
+    started = time.time()
+    # (path, estimated memory, manifest job id) of the files to run, next file last.
+    queue = [] if manifest is not None else [(path, estimate_memory(path, streaming), None) for path in files]
+    queue.reverse()
+    records = []
+    in_flight = {}
+    in_flight_bytes = 0
+    worker = worker_name()
+    claimed = set()
+    reported = time.time()
+
+    def claim():
+        # The next file from the manifest, or None when there is nothing left to claim.
+        while True:
+            job = manifest.claim(worker, lease)
+            if job is None:
+                return None
+            path = os.path.join(input_folder, *job.id.split("/"))
+            if not os.path.exists(path):
+                manifest.fail(job.id, worker, "Input file missing")
+                continue
+            claimed.add(job.id)
+            return path, estimate_memory(path, streaming), job.id
+
+    if manifest is not None:
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=renew_leases, args=(manifest, claimed, worker, lease, stop, log),
+                                     daemon=True)
+        heartbeat.start()
+    waiting = None
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(cache_dir, cache_size, profile_stage, profile_dir or output_folder,
+                                           parameters, channel_workers, arena, activity_gate,
+                                           analysis_index, trace_memory)) as pool:
+            while True:
+                # Admit files while there is a free worker and the memory budget allows it.
+                while len(in_flight) < workers:
+                    if waiting is None:
+                        waiting = queue.pop() if queue else claim() if manifest is not None else None
+                    if waiting is None:
+                        break
+                    path, needed, job = waiting
+                    if in_flight and in_flight_bytes + needed > memory_limit:
+                        break
+                    waiting = None
+                    out_file = output_file(path, output_folder, input_folder)
+                    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+                    future = pool.submit(process_file, path, out_file, operations, timeout, streaming, subtype,
+                                         file_report, normalization, skip_unneeded, tune)
+                    in_flight[future] = (path, needed, job)
+                    in_flight_bytes += needed
+
+                if not in_flight:
+                    if manifest is None or not manifest.stats()["running"]:
+                        break
+                    # Files leased to other workers come back if those workers stop renewing them.
+                    time.sleep(lease / 4)
+                    continue
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, needed, job = in_flight.pop(future)
+                    in_flight_bytes -= needed
+                    try:
+                        record = future.result()
+                    except Exception as e:
+                        # The worker process itself died (e.g. killed for running out of memory).
+                        record = {"input": path, "output": None, "status": "failed",
+                                  "error": f"{type(e).__name__}: {e}", "stages": {}}
+                    records.append(record)
+                    if job is not None:
+                        if record["status"] == "ok":
+                            manifest.complete(job, worker, record.get("seconds"), record.get("audio_seconds"))
+                        else:
+                            manifest.fail(job, worker, record["error"])
+                        claimed.discard(job)
+                    if log:
+                        log(f"{job or os.path.basename(path)}: {record['status']}"
+                            + (f" ({record['error']})" if record["error"] else ""))
+                        if manifest is not None and time.time() - reported >= PROGRESS_INTERVAL:
+                            reported = time.time()
+                            log(progress_line(manifest.stats()))
+    finally:
+        if manifest is not None:
+            stop.set()
+            heartbeat.join()
+            for job in list(claimed):
+                manifest.release(job, worker)
+
+    elapsed = time.time() - started
+    audio_seconds = sum(r.get("audio_seconds", 0.0) for r in records)
+    counts = {status: sum(r["status"] == status for r in records) for status in ("ok", "failed", "timeout")}
+    summary = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+        "workers": workers,
+        "channel_workers": channel_workers,
+        "arena": arena,
+        "activity_gate": activity_gate.settings() if activity_gate is not None else None,
+        "memory_limit": memory_limit if memory_limit != float("inf") else None,
+        "operations": operations,
+        "files": sorted(records, key=lambda r: r["input"]),
+        "totals": dict(counts, files=len(records), seconds=elapsed, audio_seconds=audio_seconds,
+                       realtime_factor=audio_seconds / elapsed if elapsed else None),
+        "stages": stage_totals([s for r in records for s in r.get("telemetry", [])]),
+    }
+    if manifest is not None:
+        summary["manifest"] = dict(manifest.stats(), path=manifest.path, worker=worker)
+    if analysis_index:
+        summary["analysis_index"] = {"path": analysis_index, "skipped": {
+            op: sum(op in r.get("skipped", {}) for r in records) for op in operations}}
+    if cache_dir and not streaming:
+        from cache import ResultCache
+        cache = ResultCache(cache_dir, cache_size) if cache_size else ResultCache(cache_dir)
+        stats = cache.stats()
+        for field in ("hits", "misses", "bytes_saved"):
+            stats[field] = sum(r.get("cache", {}).get(field, 0) for r in records)
+        summary["cache"] = stats
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Process a folder of audio files without the GUI.")
+    parser.add_argument("input_folder", help="Folder containing the audio files to process.")
+    parser.add_argument("output_folder", help="Folder the processed files are written to.")
+    parser.add_argument("--noise", action="store_true", help="Apply Noise Reduction.")
+    parser.add_argument("--echo", action="store_true", help="Apply Echo Reduction.")
+    parser.add_argument("--reverb", action="store_true", help="Apply Reverb Reduction.")
+    parser.add_argument("--normalize", action="store_true", help="Apply Volume Normalization.")
+    parser.add_argument("--compress", action="store_true", help="Apply Volume Compression.")
+    parser.add_argument("--recursive", action="store_true",
+                        help="Also process the files in subfolders; outputs mirror the subfolders.")
+    parser.add_argument("--manifest", default=None,
+                        help="Job manifest shared by every batch run over these folders, on this host or others: "
+                             "a .sqlite/.db file, or a folder for shared storage without reliable file locks. "
+                             "Runs split the files between them, and a rerun only processes the files that are "
+                             "new, changed, failed or missing their output. A run with other operations or "
+                             "settings than the manifest's last one processes every file again.")
+    parser.add_argument("--lease", type=float, default=DEFAULT_LEASE,
+                        help="With --manifest, seconds after which a file whose worker stopped renewing it is "
+                             "taken over by another (default: %(default)g).")
+    parser.add_argument("--status", action="store_true",
+                        help="Print the --manifest's progress and failures instead of processing.")
+    parser.add_argument("--analysis-index", default=None, metavar="FILE",
+                        help="Analysis index (SQLite) of the files, built as they are processed (see "
+                             "analysis_index.py): stages a file does not need are skipped, and Echo Reduction "
+                             "is tuned to its echo delay.")
+    parser.add_argument("--no-skip", action="store_true",
+                        help="With --analysis-index, run every selected stage on every file.")
+    parser.add_argument("--no-tune", action="store_true",
+                        help="With --analysis-index, keep the default parameters instead of tuning them.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    parser.add_argument("--channel-workers", type=int, default=None,
+                        help="Channels of a multichannel file processed in parallel by each worker "
+                             "(default: CPU count divided by --workers).")
+    parser.add_argument("--memory-limit", type=float, default=None,
+                        help="GB of estimated working memory allowed in flight (default: 75%% of RAM).")
+    parser.add_argument("--no-arena", action="store_true",
+                        help="Allocate every step's result anew instead of reusing buffers (uses more memory).")
+    parser.add_argument("--skip-silence", action="store_true",
+                        help="Run Echo Reduction, Reverb Reduction and Volume Compression on the speech of "
+                             "every file only, treating the silences cheaply (not in --streaming mode).")
+    parser.add_argument("--silence", choices=("attenuate", "fill", "keep"), default="attenuate",
+                        help="With --skip-silence, what happens to the silences: attenuated below the noise "
+                             "floor, filled with noise at that level, or kept as they are (default: attenuate).")
+    parser.add_argument("--timeout", type=float, default=None, help="Per-file time limit in seconds.")
+    parser.add_argument("--summary", default=None, help="Write the JSON summary here instead of stdout.")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Process each file block by block, so memory does not grow with file length.")
+    parser.add_argument("--noise-profile", default=None,
+                        help="Noise profile (.npz) to gate every file against, instead of estimating each "
+                             "file's noise; with --learn-noise-profile, where the learned profile is saved.")
+    parser.add_argument("--learn-noise-profile", default=None, metavar="FILE",
+                        help="Learn a noise profile from the quietest tenth of this recording (or all of it "
+                             "with --noise-only) and use it for every file.")
+    parser.add_argument("--noise-only", action="store_true",
+                        help="The --learn-noise-profile file contains only noise.")
+    parser.add_argument("--stationary-noise", action="store_true",
+                        help="Without a profile, gate each file against its own quietest frames (cheaper).")
+    parser.add_argument("--reverb-iterations", type=int, default=None,
+                        help="WPE iterations of Reverb Reduction (default: 3).")
+    parser.add_argument("--reverb-taps", type=int, default=None,
+                        help="WPE filter taps of Reverb Reduction, in STFT frames (default: 10).")
+    parser.add_argument("--reverb-memory", type=float, default=None,
+                        help="GB of working memory Reverb Reduction may use per file; longer files are "
+                             "dereverberated in segments that fit (default: 1).")
+    parser.add_argument("--normalize-mode", choices=("exact", "lookahead"), default="exact",
+                        help="With --streaming: measure the loudness before normalizing (exact), or normalize "
+                             "in the same pass with a 3 s lookahead (lookahead).")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Cache stage results here and reuse them on later runs (off by default).")
+    parser.add_argument("--cache-size", type=float, default=None, help="Cache size cap in GB (default: 2).")
+    parser.add_argument("--report", default=None,
+                        help="Write every file's stage timings, CPU time, realtime factor and, with "
+                             "--trace-memory, peak memory here, as CSV if the name ends in .csv and JSON otherwise.")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Record the peak memory of every stage (with tracemalloc, which slows processing "
+                             "down about twofold, so realtime factors are lower).")
+    parser.add_argument("--file-reports", choices=("json", "csv"), default=None,
+                        help="Also write a stage report next to each output file.")
+    parser.add_argument("--profile-stage", default=None,
+                        help="Run this stage (an operation name, \"decode\" or \"encode\") under cProfile.")
+    parser.add_argument("--profile-dir", default=None, help="Folder for the .prof files (default: output folder).")
+    parser.add_argument("--subtype", choices=("PCM_16", "PCM_24", "FLOAT"), default="PCM_16",
+                        help="Output sample format: 16-bit or 24-bit PCM, or 32-bit float (default: PCM_16).")
+    return parser.parse_args(argv)
+
+
+def noise_parameters(args):
+    """Noise Reduction parameter overrides from the command line: a loaded or learned profile."""
+    from operations.noise_reduction import NoiseProfile
+    if args.learn_noise_profile:
+        from processing import AudioProcessor
+        reference = AudioProcessor()
+        reference.load_audio(args.learn_noise_profile)
+        profile = NoiseProfile.learn(reference.audio_data, reference.sample_rate,
+                                     quietest=None if args.noise_only else 0.1)
+        if args.noise_profile:
+            profile.save(args.noise_profile)
+        return {"noise_profile": profile}
+    if args.noise_profile:
+        return {"noise_profile": NoiseProfile.load(args.noise_profile)}
+    if args.stationary_noise:
+        return {"stationary": True}
+    return {}
+
+
+def reverb_parameters(args):
+    """Reverb Reduction parameter overrides from the command line."""
+    parameters = {}
+    if args.reverb_iterations:
+        parameters["iterations"] = args.reverb_iterations
+    if args.reverb_taps:
+        parameters["taps"] = args.reverb_taps
+    if args.reverb_memory:
+        parameters["max_memory"] = int(args.reverb_memory * 1024 ** 3)
+    return parameters
+
+
+def activity_gate(args):
+    """The ActivityGate for --skip-silence, or None."""
+    if not args.skip_silence:
+        return None
+    from operations.activity import ActivityGate
+    return ActivityGate(inactive=args.silence)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    flags = [
+        (args.noise, "Noise Reduction"),
+        (args.echo, "Echo Reduction"),
+        (args.reverb, "Reverb Reduction"),
+        (args.normalize, "Volume Normalization"),
+        (args.compress, "Volume Compression"),
+    ]
+    operations = [name for selected, name in flags if selected]
+
+    manifest = None
+    if args.manifest:
+        from manifest import open_manifest
+        manifest = open_manifest(args.manifest)
+    elif args.status:
+        print("--status needs --manifest.", file=sys.stderr)
+        return 1
+    if args.status:
+        print(json.dumps(dict(manifest.stats(), failures=manifest.failures()), indent=2))
+        return 0
+
+    files = discover_files(args.input_folder, args.recursive,
+                           exclude=[args.output_folder] + [path for path in (args.manifest, args.analysis_index)
+                                                           if path])
+    if not files:
+        print("No valid audio files found in the input folder.", file=sys.stderr)
+        return 1
+    os.makedirs(args.output_folder, exist_ok=True)
+    # Outputs mirror the subfolders of recursive runs and manifest jobs.
+    input_folder = args.input_folder if args.recursive or manifest is not None else None
+    parameters = {"Noise Reduction": noise_parameters(args), "Reverb Reduction": reverb_parameters(args)}
+    gate = activity_gate(args)
+    if manifest is not None:
+        key = run_settings_key(operations, parameters, gate, arena=not args.no_arena, streaming=args.streaming,
+                               subtype=args.subtype, normalization=args.normalize_mode,
+                               analysis=bool(args.analysis_index), skip_unneeded=not args.no_skip,
+                               tune=not args.no_tune)
+        try:
+            reset = manifest.use_settings(key)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            manifest.close()
+            return 1
+        if reset:
+            print(f"Settings changed since the manifest's last run: {reset} files will be processed again.",
+                  file=sys.stderr)
+        manifest.add([(job_id(path, args.input_folder), os.path.getsize(path), os.path.getmtime(path))
+                      for path in files])
+        manifest.requeue(lambda job: os.path.exists(os.path.join(args.output_folder, *job.split("/"))))
+
+    memory_limit = int(args.memory_limit * 1024 ** 3) if args.memory_limit else None
+    cache_size = int(args.cache_size * 1024 ** 3) if args.cache_size else None
+    summary = run_batch(files, args.output_folder, operations, args.workers, memory_limit, args.timeout,
+                        log=lambda line: print(line, file=sys.stderr), streaming=args.streaming,
+                        cache_dir=args.cache_dir, cache_size=cache_size, subtype=args.subtype,
+                        profile_stage=args.profile_stage, profile_dir=args.profile_dir,
+                        file_report=args.file_reports, normalization=args.normalize_mode,
+                        parameters=parameters, channel_workers=args.channel_workers, arena=not args.no_arena,
+                        activity_gate=gate, input_folder=input_folder, manifest=manifest,
+                        lease=args.lease, analysis_index=args.analysis_index, skip_unneeded=not args.no_skip,
+                        tune=not args.no_tune, trace_memory=args.trace_memory)
+    if manifest is not None:
+        manifest.close()
+    if args.report:
+        write_report(args.report, [s for r in summary["files"] for s in r.get("telemetry", [])])
+
+    text = json.dumps(summary, indent=2)
+    if args.summary:
+        with open(args.summary, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    if manifest is not None:
+        return 0 if not summary["manifest"]["failed"] else 2
+    return 0 if summary["totals"]["ok"] == len(files) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
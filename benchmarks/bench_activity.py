@@ -0,0 +1,99 @@
+"""
+Benchmark for activity-gated processing.
+
+Builds recordings of one fixed length whose share of speech varies (speech from the
+benchmark suite's synthetic recording, cut into bursts separated by room tone), and times
+each gated operation with and without an ActivityGate, as well as the activity detection
+itself. With the gate, run time should follow the duration of speech rather than that of
+the file.
+
+Usage:
+    python benchmarks/bench_activity.py
+    python benchmarks/bench_activity.py --seconds 120 --speech 0.1 0.5 1.0 --save activity.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_suite import make_input
+from processing import OPERATION_ORDER, OPERATIONS, AudioProcessor
+from operations.activity import ActivityGate
+
+GATED = [op for op in OPERATION_ORDER if OPERATIONS[op].gated]
+
+
+def make_recording(seconds, sample_rate, speech_fraction, burst_seconds=3.0, seed=0):
+    """
+    Synthetic recording of the given length: bursts of speech of burst_seconds, spread evenly,
+    making up speech_fraction of it, with room tone everywhere.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sample_rate)
+    speech = make_input(seconds, sample_rate, seed)
+    gate = np.zeros(n, dtype=np.float32)
+    bursts = max(1, round(seconds * speech_fraction / burst_seconds))
+    burst = int(min(burst_seconds, seconds * speech_fraction) * sample_rate)
+    for start in np.linspace(0, n - burst, bursts).astype(int):
+        gate[start:start + burst] = 1.0
+    return (speech * gate + 0.003 * rng.standard_normal(n)).astype(np.float32)
+
+
+def best_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def run_operation(audio_data, sample_rate, operation, gate):
+    processor = AudioProcessor(channel_workers=1, activity_gate=gate)
+    processor.audio_data, processor.sample_rate = audio_data.copy(), sample_rate
+    processor.process_operation(operation)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time gated operations against the share of speech.")
+    parser.add_argument("--seconds", type=float, default=60.0, help="Length of every recording (default: 60).")
+    parser.add_argument("--sample-rate", type=int, default=16000, help="Sample rate (default: 16000).")
+    parser.add_argument("--speech", nargs="+", type=float, default=[0.1, 0.25, 0.5, 1.0],
+                        help="Shares of speech to measure (default: 0.1 0.25 0.5 1.0).")
+    parser.add_argument("--operations", nargs="+", default=GATED, choices=GATED, metavar="OPERATION",
+                        help=f"Operations to time (default: {', '.join(GATED)}).")
+    parser.add_argument("--repeat", type=int, default=2, help="Timed runs per measurement; the fastest counts.")
+    parser.add_argument("--save", default=None, help="Write the results as JSON here.")
+    args = parser.parse_args(argv)
+
+    gate = ActivityGate()
+    results = []
+    for fraction in args.speech:
+        audio_data = make_recording(args.seconds, args.sample_rate, fraction)
+        detect_seconds = best_time(lambda: gate.detect(audio_data, args.sample_rate), args.repeat)
+        active = gate.detect(audio_data, args.sample_rate).active_fraction()
+        print(f"speech {fraction:.0%}: detected active {active:.0%}, detection {detect_seconds * 1000:.0f} ms")
+        for operation in args.operations:
+            # The first run also imports the operation's dependencies.
+            run_operation(audio_data[:args.sample_rate], args.sample_rate, operation, None)
+            full = best_time(lambda: run_operation(audio_data, args.sample_rate, operation, None), args.repeat)
+            gated = best_time(lambda: run_operation(audio_data, args.sample_rate, operation, gate), args.repeat)
+            results.append({"speech_fraction": fraction, "active_fraction": active, "operation": operation,
+                            "full_seconds": full, "gated_seconds": gated, "detect_seconds": detect_seconds})
+            print(f"  {operation:<22}full {full:7.2f} s   gated {gated:7.2f} s   ({gated / full:.0%})")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"seconds": args.seconds, "sample_rate": args.sample_rate, "results": results}, f, indent=2)
+        print(f"Results written to {args.save}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+Benchmark for the analysis index.
+
+Builds a small library of synthetic recordings (bench_suite.make_input: noise, room reverb
+and a 50 ms echo), half of them raw and half already processed by the full chain, as when
+a library is processed again. It times the analysis pass of every file, then runs the full
+chain over the library as a batch does, once on every file and once fitted to each file's
+analysis (see AudioProcessor.adapt), and reports the stages skipped and the time saved.
+
+Usage:
+    python benchmarks/bench_analysis.py
+    python benchmarks/bench_analysis.py --files 4 --seconds 120 --sample-rate 48000 --save analysis.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_io import write_audio
+from bench_suite import make_input
+from processing import OPERATION_ORDER, AudioProcessor, warm_up
+
+
+def process(processor, path, operations):
+    processor.load_audio(path)
+    processor.process_operations(operations)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the analysis pass and the stages it skips.")
+    parser.add_argument("--files", type=int, default=3, help="Raw recordings in the library (default: 3).")
+    parser.add_argument("--seconds", type=float, default=30.0, help="Length of every recording (default: 30).")
+    parser.add_argument("--sample-rate", type=int, default=16000, help="Sample rate (default: 16000).")
+    parser.add_argument("--save", default=None, help="Write the results as JSON here.")
+    args = parser.parse_args(argv)
+
+    warm_up()
+    folder = tempfile.mkdtemp(prefix="bench_analysis_")
+    processor = AudioProcessor(channel_workers=1)
+    try:
+        paths = []
+        for seed in range(args.files):
+            raw = os.path.join(folder, f"raw_{seed}.wav")
+            write_audio(raw, make_input(args.seconds, args.sample_rate, seed), args.sample_rate, "FLOAT")
+            processor.load_audio(raw)
+            processor.process_operations(OPERATION_ORDER, output_path=os.path.join(folder, f"processed_{seed}.wav"),
+                                         subtype="FLOAT")
+            paths += [raw, os.path.join(folder, f"processed_{seed}.wav")]
+
+        results = []
+        for path in paths:
+            started = time.perf_counter()
+            analysis = processor.file_analysis(path)
+            analyzed = time.perf_counter() - started
+
+            started = time.perf_counter()
+            process(processor, path, OPERATION_ORDER)
+            full = time.perf_counter() - started
+
+            started = time.perf_counter()
+            operations, skipped, tuned = processor.adapt(OPERATION_ORDER, processor.file_analysis(path))
+            with processor.with_parameters(tuned):
+                process(processor, path, operations)
+            adapted = time.perf_counter() - started
+
+            name = os.path.basename(path)
+            results.append({"file": name, "analysis": analysis, "analysis_seconds": analyzed,
+                            "full_seconds": full, "adapted_seconds": adapted, "skipped": skipped, "tuned": tuned})
+            print(f"{name:<16}analysis {analyzed:5.2f} s   full chain {full:6.2f} s   adapted {adapted:6.2f} s"
+                  f"   skipped: {', '.join(skipped) or '-'}")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    full = sum(r["full_seconds"] for r in results)
+    adapted = sum(r["adapted_seconds"] for r in results)
+    print(f"Library: full chain {full:.2f} s, adapted (analysis included) {adapted:.2f} s")
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"seconds": args.seconds, "sample_rate": args.sample_rate, "results": results}, f, indent=2)
+        print(f"Results written to {args.save}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
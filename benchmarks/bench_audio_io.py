@@ -0,0 +1,110 @@
+"""
+Benchmark for audio file loading.
+
+Decodes test files with the native loader (audio_io.read_audio) and with the
+previous pydub path, each in a fresh process, and reports decode time and the
+peak resident memory of that process.
+
+Usage:
+    python benchmarks/bench_audio_io.py --seconds 600 --sample-rate 48000
+    python benchmarks/bench_audio_io.py path/to/file.wav path/to/other.flac
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FORMATS = [("PCM_16", "wav"), ("PCM_24", "wav"), ("FLOAT", "wav"), ("PCM_16", "flac")]
+
+
+def load_native(path):
+    from audio_io import read_audio
+    audio_data, _ = read_audio(path)
+    return float(np.abs(audio_data).max())
+
+
+def load_pydub(path):
+    # The loader as it was: pydub decode, Python array, int array, float copy, 16-bit scaling.
+    from pydub import AudioSegment
+    audio = AudioSegment.from_file(path).set_channels(1)
+    audio_data = np.array(audio.get_array_of_samples()).astype(np.float32) / (2 ** 15)
+    return float(np.abs(audio_data).max())
+
+
+def run_child(loader, path):
+    """Runs one load in a new interpreter so its peak RSS is not shared with other runs."""
+    output = subprocess.run([sys.executable, __file__, "--child", loader, path],
+                            check=True, capture_output=True, text=True).stdout.split()
+    return float(output[0]), int(output[1])
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes."""
+    try:
+        # ru_maxrss survives exec on Linux (a child starts at its parent's peak); VmHWM does not.
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def child(loader, path):
+    import audio_io  # noqa: F401  (imports are not part of the decode time)
+    import pydub  # noqa: F401
+    baseline = peak_rss()
+    start = time.perf_counter()
+    {"native": load_native, "pydub": load_pydub}[loader](path)
+    elapsed = time.perf_counter() - start
+    print(elapsed, peak_rss() - baseline)
+
+
+def make_files(folder, seconds, sample_rate):
+    import soundfile as sf
+    rng = np.random.default_rng(0)
+    stereo = (0.1 * rng.standard_normal((int(seconds * sample_rate), 2))).astype(np.float32)
+    paths = []
+    for subtype, extension in FORMATS:
+        path = os.path.join(folder, f"test_{subtype.lower()}.{extension}")
+        sf.write(path, stereo, sample_rate, subtype=subtype)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark native and pydub audio loading.")
+    parser.add_argument("files", nargs="*", help="Files to load (default: generated stereo test files).")
+    parser.add_argument("--seconds", type=float, default=300.0, help="Length of the generated test files.")
+    parser.add_argument("--sample-rate", type=int, default=48000)
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    with tempfile.TemporaryDirectory() as folder:
+        files = args.files or make_files(folder, args.seconds, args.sample_rate)
+        print(f"{'file':<24}{'loader':<8}{'seconds':>10}{'peak MB':>10}")
+        for path in files:
+            for loader in ("pydub", "native"):
+                try:
+                    elapsed, peak = run_child(loader, path)
+                except subprocess.CalledProcessError:
+                    print(f"{os.path.basename(path):<24}{loader:<8}{'failed':>10}")
+                    continue
+                print(f"{os.path.basename(path):<24}{loader:<8}{elapsed:>10.3f}{peak / 1024 ** 2:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark for previews.
+
+Times a PreviewSession preview (excerpts, and a window) of every operation and of the full
+chain against rendering the whole recording, after warming up the imports as the GUI does.
+The preview should stay around a second whatever the length of the recording.
+
+Usage:
+    python benchmarks/bench_preview.py
+    python benchmarks/bench_preview.py --seconds 600 --sample-rate 48000 --save preview.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_activity import make_recording
+from processing import OPERATION_ORDER, AudioProcessor, warm_up
+from preview import PreviewSession
+
+CHAINS = [[op] for op in OPERATION_ORDER] + [list(OPERATION_ORDER)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time previews against full renders.")
+    parser.add_argument("--seconds", type=float, default=120.0, help="Length of the recording (default: 120).")
+    parser.add_argument("--sample-rate", type=int, default=16000, help="Sample rate (default: 16000).")
+    parser.add_argument("--window", type=float, default=5.0, help="Seconds of the previewed window (default: 5).")
+    parser.add_argument("--save", default=None, help="Write the results as JSON here.")
+    args = parser.parse_args(argv)
+
+    warm_up()
+    audio_data = make_recording(args.seconds, args.sample_rate, 0.5)
+    processor = AudioProcessor(channel_workers=1)
+    processor.audio_data, processor.sample_rate = audio_data, args.sample_rate
+    session = PreviewSession(processor)
+    middle = len(audio_data) // 2
+    window = (middle, middle + int(args.window * args.sample_rate))
+
+    results = []
+    for chain in CHAINS:
+        name = " + ".join(chain) if len(chain) == 1 else "full chain"
+        excerpts = session.preview(chain).seconds
+        windowed = session.preview(chain, window=window).seconds
+        session.restore()
+        started = time.perf_counter()
+        processor.process_operations(chain)
+        full = time.perf_counter() - started
+        results.append({"operations": chain, "excerpts_seconds": excerpts, "window_seconds": windowed,
+                        "full_seconds": full})
+        print(f"{name:<22}excerpts {excerpts:6.2f} s   window {windowed:6.2f} s   full {full:7.2f} s")
+    session.close()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"seconds": args.seconds, "sample_rate": args.sample_rate, "results": results}, f, indent=2)
+        print(f"Results written to {args.save}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+Benchmark for start-up cost.
+
+Every measurement runs in a fresh interpreter, as a batch worker or the GUI would start.
+
+- Import cost per module: `python -X importtime -c "import MODULE"`, reporting the module's
+  cumulative import time and its heaviest direct dependencies.
+- Cold start per operation: a process that imports processing and runs one operation on one
+  second of audio, split into interpreter start, import, and first run (which now includes
+  importing the operation's own dependencies).
+
+Results can be saved as JSON to compare later runs by hand.
+
+Usage:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --modules processing gui librosa --repeat 5 --save startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_MODULES = (
+    "processing", "gui", "batch", "server",
+    "operations.noise_reduction", "operations.echo_reduction", "operations.reverb_reduction",
+    "operations.volume_normalization", "operations.volume_compression",
+    "numpy", "scipy.signal", "soundfile", "pydub", "noisereduce", "librosa", "nara_wpe", "pyloudnorm",
+    "matplotlib.backends.backend_tkagg",
+)
+
+# Run in a fresh interpreter: import processing, then run one operation on a second of audio.
+_COLD_START = """
+import json, sys, time
+started = time.perf_counter()
+import numpy as np
+from processing import AudioProcessor
+imported = time.perf_counter()
+processor = AudioProcessor(channel_workers=1)
+processor.audio_data = (0.1 * np.random.default_rng(0).standard_normal(16000)).astype(np.float32)
+processor.sample_rate = 16000
+processor.process_operations(sys.argv[1:])
+done = time.perf_counter()
+print(json.dumps({"import_seconds": imported - started, "first_run_seconds": done - imported,
+                  "loaded_modules": len(sys.modules)}))
+"""
+
+
+def parse_importtime(text, module):
+    """
+    Reads -X importtime output.
+
+    Returns:
+        tuple: (cumulative seconds of module, [(dependency, cumulative seconds)] imported
+            directly by it, heaviest first).
+    """
+    total = None
+    children = []
+    for line in text.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            cumulative = int(fields[1]) / 1e6
+        except ValueError:
+            continue  # the header line
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        # Dependencies are reported before the module that imports them, one level deeper.
+        if depth == 1:
+            children.append((name, cumulative))
+        elif depth == 0:
+            if name == module:
+                total = cumulative
+                break
+            children = []
+    return total, sorted(children, key=lambda child: -child[1])
+
+
+def import_cost(module, repeat=3):
+    """
+    Returns:
+        dict: Median cumulative import time of module over repeat fresh interpreters, and its
+            heaviest direct dependencies (from the last run).
+    """
+    times = []
+    children = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT,
+                                capture_output=True, text=True)
+        if result.returncode:
+            return {"module": module, "error": result.stderr.strip().splitlines()[-1]}
+        total, children = parse_importtime(result.stderr, module)
+        if total is not None:
+            times.append(total)
+    if not times:
+        return {"module": module, "error": "already imported at start-up"}
+    return {"module": module, "import_seconds": statistics.median(times),
+            "heaviest": [{"module": name, "seconds": seconds} for name, seconds in children[:5]]}
+
+
+def cold_start(operation, repeat=3):
+    """
+    Returns:
+        dict: Median wall time of a fresh process running one operation, and of its parts.
+    """
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", _COLD_START, operation], cwd=ROOT,
+                                capture_output=True, text=True)
+        wall = time.perf_counter() - started
+        if result.returncode:
+            return {"operation": operation, "error": result.stderr.strip().splitlines()[-1]}
+        run = json.loads(result.stdout.strip().splitlines()[-1])
+        run["process_seconds"] = wall
+        runs.append(run)
+    summary = {"operation": operation}
+    for field in ("process_seconds", "import_seconds", "first_run_seconds", "loaded_modules"):
+        summary[field] = statistics.median(run[field] for run in runs)
+    return summary
+
+
+def main(argv=None):
+    from processing import OPERATION_ORDER
+    parser = argparse.ArgumentParser(description="Measure import cost per module and cold start per operation.")
+    parser.add_argument("--modules", nargs="+", default=list(DEFAULT_MODULES),
+                        help="Modules whose import cost is measured (default: the app's modules and "
+                             "their heavy dependencies).")
+    parser.add_argument("--operations", nargs="+", default=list(OPERATION_ORDER), choices=OPERATION_ORDER,
+                        metavar="OPERATION", help="Operations to cold-start (default: all).")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh processes per measurement; the median counts.")
+    parser.add_argument("--save", default=None, help="Write the results as JSON here.")
+    args = parser.parse_args(argv)
+
+    imports = []
+    print("Import cost (fresh interpreter):")
+    for module in args.modules:
+        record = import_cost(module, args.repeat)
+        imports.append(record)
+        if "error" in record:
+            print(f"  {module:<36}{record['error']}")
+            continue
+        heaviest = ", ".join(f"{d['module']} {d['seconds'] * 1000:.0f}" for d in record["heaviest"][:3])
+        print(f"  {module:<36}{record['import_seconds'] * 1000:>8.0f} ms   {heaviest}")
+
+    starts = []
+    print("\nCold start per operation (1 s of audio):")
+    for operation in args.operations:
+        record = cold_start(operation, args.repeat)
+        starts.append(record)
+        if "error" in record:
+            print(f"  {operation:<24}{record['error']}")
+            continue
+        print(f"  {operation:<24}{record['process_seconds'] * 1000:>8.0f} ms process"
+              f"{record['import_seconds'] * 1000:>8.0f} ms import{record['first_run_seconds'] * 1000:>8.0f} ms first run"
+              f"{record['loaded_modules']:>7} modules")
+
+    if args.save:
+        results = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0],
+                   "repeat": args.repeat, "imports": imports, "cold_starts": starts}
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.save}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
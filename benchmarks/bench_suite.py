@@ -0,0 +1,309 @@
+"""
+Benchmark suite for every operation, the full pipeline, file I/O and loudness metering.
+
+Each case runs on deterministic synthetic recordings (speech-like signal with
+room reverb, a delayed echo, background noise and loudness swings) at several
+lengths and sample rates. For every run it reports the realtime factor (audio
+seconds processed per wall-clock second) and the peak memory allocated while
+it ran, and for every case how its run time scales with input length (the
+exponent of a power-law fit, so 1.0 means linear).
+
+Results can be saved as a JSON baseline and later runs compared against it;
+compare mode exits with status 1 if any case got slower than the threshold.
+
+With --channels N the recordings have N channels (independent takes, like the
+microphones of a conference recording), and operations run through
+AudioProcessor so channels are processed in parallel. With --arena the processor
+runs in buffer-arena mode, and the peak memory of operations and the full chain is
+also given as a multiple of the input size.
+
+Usage:
+    python benchmarks/bench_suite.py                                  # print results
+    python benchmarks/bench_suite.py --save benchmarks/baseline.json  # record a baseline
+    python benchmarks/bench_suite.py --compare benchmarks/baseline.json --threshold 0.25
+    python benchmarks/bench_suite.py --cases "Volume Compression" --lengths 10 60 --sample-rates 48000
+    python benchmarks/bench_suite.py --cases "Full chain" --channels 8 --channel-workers 4
+    python benchmarks/bench_suite.py --cases "Full chain" --lengths 60 300 --arena
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from scipy.signal import fftconvolve, lfilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from processing import OPERATION_ORDER, OPERATIONS, AudioProcessor
+from operations.arena import BufferArena
+from operations.loudness import measure_loudness
+
+DEFAULT_LENGTHS = (5.0, 10.0, 20.0)
+DEFAULT_SAMPLE_RATES = (16000, 48000)
+FULL_CHAIN = "Full chain"
+IO_CASES = ("load_audio", "save_audio")
+ANALYSIS_CASES = ("loudness_meter",)
+
+
+def make_input(seconds, sample_rate, seed=0):
+    """
+    Synthetic recording with the problems every operation targets.
+
+    A voiced source with a wandering pitch and syllable-rate amplitude bursts
+    (with pauses) is shaped by two formant resonators, convolved with an
+    exponentially decaying room response, mixed with a 50 ms echo, scaled by a
+    slow loudness swing, and buried in pinkish noise.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sample_rate)
+    t = np.arange(n) / sample_rate
+
+    # Glottal-like pulse train: harmonics of a pitch contour between ~100 and ~180 Hz.
+    pitch = 140 + 40 * np.sin(2 * np.pi * 0.3 * t) + 10 * np.sin(2 * np.pi * 2.1 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 16))
+
+    # Syllables at ~4 Hz, with a pause of about half a second every couple of seconds.
+    syllables = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) ** 2
+    pauses = (np.sin(2 * np.pi * 0.4 * t + rng.uniform(0, 2 * np.pi)) > -0.7).astype(float)
+    speech = voiced * syllables * pauses
+
+    # Two formant resonators (two-pole filters) around 500 Hz and 1500 Hz.
+    for freq, bandwidth in ((500, 80), (1500, 120)):
+        r = np.exp(-np.pi * bandwidth / sample_rate)
+        theta = 2 * np.pi * freq / sample_rate
+        speech = lfilter([1 - r], [1, -2 * r * np.cos(theta), r ** 2], speech)
+    speech /= np.max(np.abs(speech)) + 1e-12
+
+    # Room reverb: noise with an exponential decay (RT60 of 0.5 s).
+    ir_length = int(0.5 * sample_rate)
+    decay = np.exp(-6.9 * np.arange(ir_length) / ir_length)
+    ir = rng.standard_normal(ir_length) * decay * 0.05
+    ir[0] = 1.0
+    signal = fftconvolve(speech, ir)[:n]
+
+    # Echo: an attenuated copy 50 ms later.
+    delay = int(0.05 * sample_rate)
+    signal[delay:] += 0.4 * signal[:-delay]
+
+    # Loudness swings between about -12 and -30 dB over a few seconds.
+    signal *= 10 ** ((-21 + 9 * np.sin(2 * np.pi * 0.15 * t)) / 20) / (np.max(np.abs(signal)) + 1e-12)
+
+    # Pinkish noise (white noise through a one-pole lowpass) about 25 dB below the speech.
+    noise = lfilter([1], [1, -0.95], rng.standard_normal(n))
+    noise *= 10 ** (-25 / 20) * np.std(signal) / (np.std(noise) + 1e-12)
+    return np.clip(signal + noise, -1, 1).astype(np.float32)
+
+
+def make_channels(seconds, sample_rate, channels):
+    """make_input for one channel, or a (channels, samples) stack of differently seeded takes."""
+    if channels == 1:
+        return make_input(seconds, sample_rate)
+    return np.stack([make_input(seconds, sample_rate, seed=c) for c in range(channels)])
+
+
+def run_case(case, audio_data, sample_rate, folder, processor=None):
+    """
+    Runs one case once; returns nothing, the caller times and measures it. Operations on
+    multichannel audio, and the full chain, run through processor (an AudioProcessor).
+    """
+    processor = processor or AudioProcessor()
+    if case in OPERATIONS and audio_data.ndim == 1 and processor.arena is None:
+        OPERATIONS[case].apply(audio_data, sample_rate)
+    elif case in OPERATIONS or case == FULL_CHAIN:
+        if processor.arena is not None:
+            # The processor works on its own copy, in a buffer the previous run gave back.
+            working = processor.arena.borrow(audio_data.shape, np.float32)
+            np.copyto(working, audio_data)
+            processor.audio_data, processor.sample_rate = working, sample_rate
+        else:
+            processor.audio_data, processor.sample_rate = audio_data, sample_rate
+        processor.process_operations([case] if case in OPERATIONS else OPERATION_ORDER)
+        if processor.arena is not None:
+            processor.arena.give_back(processor.audio_data)
+            processor.audio_data = None
+    elif case == "load_audio":
+        processor.load_audio(os.path.join(folder, "input.wav"))
+    elif case == "save_audio":
+        processor.audio_data, processor.sample_rate = audio_data, sample_rate
+        processor.save_audio(os.path.join(folder, "output.wav"))
+    elif case == "loudness_meter":
+        measure_loudness(audio_data, sample_rate).measurements()
+    else:
+        raise ValueError(f"Unknown benchmark case: {case}")
+
+
+def measure(case, audio_data, sample_rate, folder, repeat, processor=None):
+    """
+    Returns:
+        dict: Best wall-clock time over repeat runs, realtime factor and peak traced memory
+            (of this process; channel worker processes are not traced).
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run_case(case, audio_data, sample_rate, folder, processor)
+        times.append(time.perf_counter() - start)
+    # Memory is measured in a separate run, since tracing allocations slows them down.
+    tracemalloc.start()
+    run_case(case, audio_data, sample_rate, folder, processor)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    seconds = audio_data.shape[-1] / sample_rate
+    elapsed = min(times)
+    return {"seconds": elapsed, "realtime_factor": seconds / elapsed if elapsed else None,
+            "peak_mb": peak / 1024 ** 2}
+
+
+def scaling_exponent(lengths, times):
+    """Slope of log(time) against log(length): 1.0 for linear cost, 2.0 for quadratic."""
+    if len(lengths) < 2:
+        return None
+    slope, _ = np.polyfit(np.log(lengths), np.log(times), 1)
+    return float(slope)
+
+
+def run_suite(cases, lengths, sample_rates, repeat=3, log=None, channels=1, channel_workers=None, arena=False):
+    """
+    Runs every case at every length and sample rate.
+
+    Parameters:
+        channels (int): Channels of the synthetic recordings.
+        channel_workers (int, optional): Channels processed in parallel (see AudioProcessor).
+        arena (bool): Run operations and the full chain in buffer-arena mode.
+
+    Returns:
+        dict: {"meta": ..., "results": [one record per run], "scaling": {case: {rate: exponent}}}.
+    """
+    results = []
+    # One processor for the whole suite, so its channel worker processes start only once.
+    processor = AudioProcessor(channel_workers=channel_workers, arena=BufferArena() if arena else None)
+    with tempfile.TemporaryDirectory() as folder:
+        for sample_rate in sample_rates:
+            for length in lengths:
+                audio_data = make_channels(length, sample_rate, channels)
+                processor.audio_data, processor.sample_rate = audio_data, sample_rate
+                processor.save_audio(os.path.join(folder, "input.wav"))
+                for case in cases:
+                    record = {"case": case, "sample_rate": sample_rate, "length": length, "channels": channels}
+                    record.update(measure(case, audio_data, sample_rate, folder, repeat, processor))
+                    record["peak_input_ratio"] = record["peak_mb"] * 1024 ** 2 / audio_data.nbytes
+                    results.append(record)
+                    if log:
+                        log(format_record(record))
+    processor.close()
+
+    scaling = {}
+    for case in cases:
+        for sample_rate in sample_rates:
+            runs = [r for r in results if r["case"] == case and r["sample_rate"] == sample_rate]
+            exponent = scaling_exponent([r["length"] for r in runs], [r["seconds"] for r in runs])
+            scaling.setdefault(case, {})[str(sample_rate)] = exponent
+    meta = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "repeat": repeat,
+        "channels": channels,
+        "channel_workers": processor.channel_workers,
+        "arena": arena,
+    }
+    return {"meta": meta, "results": results, "scaling": scaling}
+
+
+def format_record(record):
+    return (f"{record['case']:<22}{record['sample_rate']:>7} Hz{record['length']:>7.0f} s"
+            f"{record['realtime_factor']:>10.1f}x realtime{record['peak_mb']:>9.1f} MB peak"
+            f"{record['peak_input_ratio']:>7.1f}x input")
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares run times with a baseline, matching runs by case, sample rate, length and channel count.
+
+    Returns:
+        list: (record, baseline record, slowdown ratio) for runs more than threshold slower.
+    """
+    def run_key(r):
+        return r["case"], r["sample_rate"], r["length"], r.get("channels", 1)
+
+    reference = {run_key(r): r for r in baseline["results"]}
+    regressions = []
+    for record in results["results"]:
+        base = reference.get(run_key(record))
+        if base is None or not base["seconds"]:
+            continue
+        ratio = record["seconds"] / base["seconds"]
+        if ratio > 1 + threshold:
+            regressions.append((record, base, ratio))
+    return regressions
+
+
+def main(argv=None):
+    all_cases = list(OPERATION_ORDER) + [FULL_CHAIN] + list(IO_CASES) + list(ANALYSIS_CASES)
+    parser = argparse.ArgumentParser(description="Benchmark every operation, the full chain and file I/O.")
+    parser.add_argument("--cases", nargs="+", default=all_cases, choices=all_cases, metavar="CASE",
+                        help=f"Cases to run (default: all of {', '.join(all_cases)}).")
+    parser.add_argument("--lengths", nargs="+", type=float, default=None,
+                        help=f"Input lengths in seconds (default: {DEFAULT_LENGTHS}, or the baseline's when comparing).")
+    parser.add_argument("--sample-rates", nargs="+", type=int, default=None,
+                        help=f"Sample rates (default: {DEFAULT_SAMPLE_RATES}, or the baseline's when comparing).")
+    parser.add_argument("--channels", type=int, default=1, help="Channels of the synthetic recordings (default: 1).")
+    parser.add_argument("--channel-workers", type=int, default=None,
+                        help="Channels processed in parallel (default: CPU count).")
+    parser.add_argument("--arena", action="store_true",
+                        help="Run operations and the full chain in buffer-arena mode (see AudioProcessor).")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per measurement; the fastest counts.")
+    parser.add_argument("--save", default=None, help="Write the results as a JSON baseline here.")
+    parser.add_argument("--compare", default=None, help="Baseline JSON to compare run times against.")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Flag runs more than this fraction slower than the baseline (default: 0.25).")
+    args = parser.parse_args(argv)
+
+    lengths, sample_rates = DEFAULT_LENGTHS, DEFAULT_SAMPLE_RATES
+    if args.compare:
+        # Measure what the baseline measured unless told otherwise.
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        lengths = sorted({r["length"] for r in baseline["results"]})
+        sample_rates = sorted({r["sample_rate"] for r in baseline["results"]})
+    lengths = args.lengths or lengths
+    sample_rates = args.sample_rates or sample_rates
+
+    results = run_suite(args.cases, lengths, sample_rates, args.repeat, log=print, channels=args.channels,
+                        channel_workers=args.channel_workers, arena=args.arena)
+
+    print("\nScaling with input length (1.0 = linear):")
+    for case, by_rate in results["scaling"].items():
+        exponents = ", ".join(f"{rate} Hz: {exp:.2f}" for rate, exp in by_rate.items() if exp is not None)
+        exponents = exponents or "needs two or more lengths"
+        print(f"  {case:<22}{exponents}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline written to {args.save}")
+
+    if args.compare:
+        regressions = compare(results, baseline, args.threshold)
+        if not regressions:
+            print(f"\nNo run is more than {args.threshold:.0%} slower than {args.compare}.")
+            return 0
+        print(f"\n{len(regressions)} run(s) more than {args.threshold:.0%} slower than {args.compare}:")
+        for record, base, ratio in regressions:
+            print(f"  {record['case']:<22}{record['sample_rate']:>7} Hz{record['length']:>7.0f} s"
+                  f"  {base['seconds']:.3f} s -> {record['seconds']:.3f} s ({ratio:.2f}x)")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""
+Benchmark for apply_volume_compression.
+
+Times the vectorized block engine against the per-sample reference and reports
+both as a multiple of realtime, plus the largest sample difference between them.
+
+Usage:
+    python benchmarks/bench_volume_compression.py --seconds 60 --sample-rate 48000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from operations.volume_compression import apply_volume_compression
+
+
+def make_signal(seconds, sample_rate, seed=0):
+    """Tone with a slow loudness swing plus a little noise, so the compressor works both sides of the knee."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    swing = 0.5 + 0.5 * np.sin(2 * np.pi * 0.25 * t)
+    signal = 0.8 * swing * np.sin(2 * np.pi * 220 * t) + 0.05 * rng.standard_normal(len(t))
+    return signal.astype(np.float32)
+
+
+def time_engine(audio_data, sample_rate, engine):
+    start = time.perf_counter()
+    output = apply_volume_compression(audio_data, sample_rate, engine=engine)
+    return output, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the volume compression engines.")
+    parser.add_argument("--seconds", type=float, default=60.0, help="Length of the block-engine test signal.")
+    parser.add_argument("--reference-seconds", type=float, default=5.0,
+                        help="Length of the excerpt also run through the slow reference engine.")
+    parser.add_argument("--sample-rate", type=int, default=48000)
+    args = parser.parse_args()
+
+    audio_data = make_signal(args.seconds, args.sample_rate)
+    excerpt = audio_data[:int(args.reference_seconds * args.sample_rate)]
+
+    _, block_time = time_engine(audio_data, args.sample_rate, "block")
+    block_excerpt, block_excerpt_time = time_engine(excerpt, args.sample_rate, "block")
+    reference, reference_time = time_engine(excerpt, args.sample_rate, "reference")
+
+    print(f"block engine:     {args.seconds:.1f} s in {block_time:.3f} s "
+          f"({args.seconds / block_time:.1f}x realtime)")
+    print(f"reference engine: {args.reference_seconds:.1f} s in {reference_time:.3f} s "
+          f"({args.reference_seconds / reference_time:.1f}x realtime)")
+    print(f"speedup on excerpt: {reference_time / block_excerpt_time:.1f}x")
+    print(f"max abs difference: {np.max(np.abs(block_excerpt - reference)):.3g}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Load-test client for the streaming server (server.py).
+
+Replays WAV files to the server at realtime rate, as a live source would, from one or more
+concurrent connections, and measures every frame's round trip: the time from sending a frame
+to receiving its processed samples. A frame the client could not send on time (because the
+server fell behind and stopped reading) counts as late.
+
+The report gives, per stream and over all streams, the round-trip percentiles, late frames,
+and the end-to-end latency: the server's frame and processing delay plus the 95th-percentile
+round trip.
+
+Usage:
+    python server.py --tcp 127.0.0.1:8765 --noise --echo --compress &
+    python benchmarks/replay_client.py speech.wav --tcp 127.0.0.1:8765 --clients 8
+    python benchmarks/replay_client.py a.wav b.wav --unix /tmp/audiopolish.sock --output-dir processed
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from server import FORMATS, _to_pcm
+
+
+def replay(path, address, family=socket.AF_INET, sample_format="f32", realtime=True, output_path=None):
+    """
+    Streams one file to the server and collects the processed result.
+
+    Parameters:
+        path (str): Audio file to replay.
+        address: (host, port), or the path of a Unix socket.
+        family: socket.AF_INET or socket.AF_UNIX.
+        sample_format (str): "f32" or "s16".
+        realtime (bool): Send at the file's realtime rate; otherwise as fast as the server reads.
+        output_path (str, optional): Where the processed audio is written (as float WAV).
+
+    Returns:
+        dict: The stream's settings and its round-trip and lateness measurements.
+    """
+    info = sf.info(path)
+    dtype = FORMATS[sample_format]
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.connect(address)
+        if family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        header = {"sample_rate": info.samplerate, "channels": info.channels, "format": sample_format}
+        sock.sendall(json.dumps(header).encode() + b"\n")
+        reader = sock.makefile("rb")
+        settings = json.loads(reader.readline() or b'{"error": "connection closed"}')
+        if "error" in settings:
+            raise RuntimeError(settings["error"])
+
+        frame = settings["frame_samples"]
+        frame_bytes = frame * info.channels * dtype.itemsize
+        sent = []
+        late = 0
+
+        def send():
+            nonlocal late
+            start = time.perf_counter()
+            with sf.SoundFile(path) as source:
+                for index, block in enumerate(source.blocks(blocksize=frame, dtype="float32", always_2d=True)):
+                    if realtime:
+                        due = start + index * frame / info.samplerate
+                        now = time.perf_counter()
+                        if now < due:
+                            time.sleep(due - now)
+                        elif now > due + frame / info.samplerate:
+                            late += 1
+                    sent.append(time.perf_counter())
+                    sock.sendall(_to_pcm(block.T, dtype))
+            sock.shutdown(socket.SHUT_WR)
+
+        sender = threading.Thread(target=send, daemon=True)
+        sender.start()
+
+        round_trips = []
+        sink = (sf.SoundFile(output_path, "w", samplerate=info.samplerate, channels=info.channels, subtype="FLOAT")
+                if output_path else None)
+        to_skip = settings["delay_samples"]
+        remaining = info.frames
+        try:
+            while True:
+                data = reader.read(frame_bytes)
+                if not data:
+                    break
+                if len(data) == frame_bytes and len(round_trips) < len(sent):
+                    round_trips.append(time.perf_counter() - sent[len(round_trips)])
+                if sink is not None:
+                    samples = np.frombuffer(data, dtype).reshape(-1, info.channels)
+                    samples = samples[min(to_skip, len(samples)):][:remaining]
+                    to_skip = max(0, to_skip - len(data) // (info.channels * dtype.itemsize))
+                    remaining -= len(samples)
+                    sink.write(samples / 32768.0 if dtype.kind == "i" else samples)
+        finally:
+            if sink is not None:
+                sink.close()
+        sender.join()
+
+    round_trips = np.array(round_trips) * 1000
+    p50, p95, p99 = np.percentile(round_trips, (50, 95, 99)) if len(round_trips) else (np.nan,) * 3
+    return dict(settings, file=path, frames=len(sent), late_frames=late,
+                round_trip_mean_ms=float(round_trips.mean()) if len(round_trips) else None,
+                round_trip_p50_ms=float(p50), round_trip_p95_ms=float(p95), round_trip_p99_ms=float(p99),
+                round_trip_max_ms=float(round_trips.max()) if len(round_trips) else None,
+                end_to_end_p95_ms=settings["latency_ms"] + float(p95))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay WAV files to the streaming server at realtime rate.")
+    parser.add_argument("files", nargs="+", help="Files to replay; with more clients than files they are reused.")
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument("--tcp", metavar="HOST:PORT", help="Server TCP address.")
+    where.add_argument("--unix", metavar="PATH", help="Server Unix socket.")
+    parser.add_argument("--clients", type=int, default=1, help="Concurrent streams (default: 1).")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="f32", help="Sample format (default: f32).")
+    parser.add_argument("--as-fast-as-possible", action="store_true",
+                        help="Send without waiting for realtime, to find the server's throughput.")
+    parser.add_argument("--output-dir", default=None, help="Write each stream's processed audio here.")
+    parser.add_argument("--summary", default=None, help="Write the JSON report here instead of stdout.")
+    args = parser.parse_args(argv)
+
+    if args.unix:
+        address, family = args.unix, socket.AF_UNIX
+    else:
+        host, _, port = args.tcp.rpartition(":")
+        address, family = (host or "127.0.0.1", int(port)), socket.AF_INET
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    results = [None] * args.clients
+
+    def client(index):
+        path = args.files[index % len(args.files)]
+        output_path = (os.path.join(args.output_dir, f"{index:03d}_{os.path.basename(path)}")
+                       if args.output_dir else None)
+        try:
+            results[index] = replay(path, address, family, args.format, not args.as_fast_as_possible, output_path)
+        except (OSError, RuntimeError) as e:
+            results[index] = {"file": path, "error": str(e)}
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    done = [r for r in results if "error" not in r]
+    totals = {"clients": args.clients, "failed": args.clients - len(done), "wall_seconds": wall}
+    if done:
+        totals.update(frames=sum(r["frames"] for r in done), late_frames=sum(r["late_frames"] for r in done),
+                      worst_round_trip_p95_ms=max(r["round_trip_p95_ms"] for r in done),
+                      worst_end_to_end_p95_ms=max(r["end_to_end_p95_ms"] for r in done))
+    text = json.dumps({"streams": results, "totals": totals}, indent=2)
+    if args.summary:
+        with open(args.summary, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0 if len(done) == args.clients else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
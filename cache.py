@@ -0,0 +1,228 @@
+"""
+On-disk cache of processing results.
+
+Every stage result is stored under a key that chains the content hash of the
+input file with each operation applied so far and all of its parameters:
+
+    key_0 = sha256(file bytes)
+    key_n = sha256(key_(n-1), operation_n, parameters_n)
+
+Re-running the same file with the same settings is therefore a lookup, and
+changing only a later stage reuses the results of every stage before it.
+Entries are evicted least-recently-used first once the cache exceeds its size cap.
+
+Small measurements of a result (such as its integrated loudness) can be stored
+under the same key, so a later run can skip the pass that measured them. They
+count towards the size cap and are evicted together with the result they belong to.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+
+# Bump when a change to an operation alters its output for the same parameters.
+CACHE_VERSION = 4
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "audiopolish")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+_ENTRY_SUFFIX = ".npz"
+_MEASUREMENT_SUFFIX = ".json"
+
+
+def file_key(filepath, chunk_size=1 << 20):
+    """Returns the SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def chain_key(previous_key, operation, parameters):
+    """
+    Returns the key of the result of applying an operation to the result stored under previous_key.
+
+    Parameters:
+        previous_key (str): Key of the input (file hash or previous stage).
+        operation (str): Operation name.
+        parameters (dict): Every parameter the operation's output depends on (JSON-serializable).
+    """
+    text = json.dumps([CACHE_VERSION, previous_key, operation, parameters], sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Folder of stage results, one .npz file per key, and their measurements, one .json
+    file per key, capped at max_bytes together.
+
+    Writes go through a temporary file and os.replace, so several batch workers
+    can share one cache folder. A hit refreshes the file's modification time; a key
+    was last used when the newer of its two files was, which is what eviction orders by.
+    """
+
+    def __init__(self, folder=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Parameters:
+            folder (str): Directory holding the entries; created if missing.
+            max_bytes (int): Size cap for all entries and measurements together.
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + _ENTRY_SUFFIX)
+
+    def contains(self, key):
+        """Checks for an entry without loading it or counting a hit or miss."""
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        """
+        Returns (audio_data, sample_rate) stored under key, or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                audio_data = data["audio"]
+                sample_rate = int(data["sample_rate"])
+            os.utime(path)
+        except (OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.bytes_saved += audio_data.nbytes
+        return audio_data, sample_rate
+
+    def put(self, key, audio_data, sample_rate):
+        """
+        Stores a stage result, then evicts old entries if the cache is over its cap.
+        Failing to write (e.g. a full disk) is not an error.
+        """
+        # Kept in its own dtype so a cached result is bit-identical to a recomputed one.
+        audio_data = np.asarray(audio_data)
+        if audio_data.nbytes > self.max_bytes:
+            return
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=self.folder)
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, audio=audio_data, sample_rate=np.int64(sample_rate))
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self.evict()
+
+    def get_measurements(self, key):
+        """
+        Returns the measurements stored for the audio under key, e.g. {"integrated_lufs": -23.1},
+        or an empty dict.
+        """
+        path = os.path.join(self.folder, key + _MEASUREMENT_SUFFIX)
+        try:
+            with open(path) as f:
+                measurements = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return {}
+        return measurements
+
+    def put_measurements(self, key, **values):
+        """
+        Adds measurements of the audio under key to those already stored, then evicts old
+        entries if the cache is over its cap.
+        """
+        measurements = self.get_measurements(key)
+        measurements.update(values)
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=self.folder)
+            with os.fdopen(fd, "w") as f:
+                json.dump(measurements, f)
+            os.replace(temp_path, os.path.join(self.folder, key + _MEASUREMENT_SUFFIX))
+        except OSError:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self.evict()
+
+    def _entries(self):
+        # (last use in ns, bytes, file names) of every key: its result and its measurements.
+        keys = {}
+        for name in os.listdir(self.folder):
+            if not name.endswith((_ENTRY_SUFFIX, _MEASUREMENT_SUFFIX)):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue  # removed by another worker
+            key = os.path.splitext(name)[0]
+            used, size, names = keys.get(key, (0, 0, []))
+            keys[key] = (max(used, stat.st_mtime_ns), size + stat.st_size, names + [name])
+        return list(keys.values())
+
+    def size(self):
+        """Total bytes held by the cache."""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Removes the least recently used keys, results and measurements, until the cache fits in max_bytes."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, names in entries:
+            if total <= self.max_bytes:
+                break
+            for name in names:
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                except OSError:
+                    pass
+            self.evictions += 1
+            total -= size
+
+    def clear(self):
+        """Removes every entry and every stored measurement."""
+        for _, _, names in self._entries():
+            for name in names:
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                except OSError:
+                    pass
+
+    def stats(self):
+        """
+        Returns:
+            dict: hits, misses, bytes_saved (decoded audio served from the cache instead of
+                being recomputed), evictions, the entries and measurements currently held and the
+                bytes of both, and max_bytes.
+        """
+        entries = self._entries()
+        names = [name for _, _, key_names in entries for name in key_names]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes_saved": self.bytes_saved,
+            "evictions": self.evictions,
+            "entries": sum(name.endswith(_ENTRY_SUFFIX) for name in names),
+            "measurements": sum(name.endswith(_MEASUREMENT_SUFFIX) for name in names),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+        }
+
+    def report(self):
+        """One-line summary of stats() for logs."""
+        s = self.stats()
+        lookups = s["hits"] + s["misses"]
+        rate = f"{100 * s['hits'] / lookups:.0f}%" if lookups else "n/a"
+        return (f"Cache: {s['hits']} hits, {s['misses']} misses ({rate} hit rate), "
+                f"{s['bytes_saved'] / 1024 ** 2:.1f} MB reused, {s['entries']} entries, "
+                f"{s['bytes'] / 1024 ** 2:.1f} of {s['max_bytes'] / 1024 ** 2:.0f} MB used")
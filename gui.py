@@ -1,17 +1,115 @@
 import os
 import sys
+import queue
+import threading
+import time
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import subprocess
-from processing import AudioProcessor
-import matplotlib
-matplotlib.use("TkAgg")
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from concurrent.futures import ThreadPoolExecutor
+from analysis_index import AnalysisIndex
+from batch import discover_files, job_id, output_file, renew_leases, run_settings_key
+from manifest import DEFAULT_LEASE, open_manifest, progress_line, worker_name
+from processing import AudioProcessor, ProcessingCancelled, sort_operations, start_warm_up
+from operations.activity import ActivityGate
+from operations.multichannel import channel_count, frame_count
+from preview import PreviewSession
+from waveform import WaveformPyramid
+from cache import ResultCache
+from telemetry import Telemetry, format_record
 from tkinter import ttk  # For progress bar
 
+# Job manifest kept in the output folder, so a rerun of a batch skips the files already done;
+# {key} is the run's settings key, so a run with other operations or settings starts afresh.
+MANIFEST_NAME = ".audiopolish-jobs-{key}.sqlite"
+
+# Analysis index kept in the output folder, so a rerun of a batch does not analyze the files again.
+ANALYSIS_INDEX_NAME = ".audiopolish-analysis.sqlite"
+
+# Imported by the warm-up thread along with the operations; matplotlib is not needed until the
+# first waveform is plotted.
+PLOTTING_MODULES = ("matplotlib.figure", "matplotlib.backends.backend_tkagg")
+
+class WaveformPlot:
+    """
+    Waveform drawn from a WaveformPyramid at the resolution of the canvas.
+
+    Scrolling over the plot zooms around the cursor and dragging pans; each redraw reads
+    only the pyramid level matching the visible range, or raw samples when zoomed all the way in.
+    """
+
+    def __init__(self, master, pyramid, audio_data, title, color):
+        self.pyramid = pyramid
+        self.audio_data = audio_data
+        self.color = color
+        self.fill = None
+        self.drag = None
+
+        import matplotlib
+        matplotlib.use("TkAgg")
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        fig = Figure(figsize=(4, 2.5), dpi=100)
+        self.ax = fig.add_subplot(111)
+        self.ax.set_title(title)
+        self.ax.set_xlabel("Samples")
+        self.ax.set_ylabel("Amplitude")
+        self.ax.set_ylim([-1, 1])
+        self.ax.set_xlim(0, max(1, pyramid.length))
+        self.canvas = FigureCanvasTkAgg(fig, master=master)
+        self.redraw()
+        self.ax.callbacks.connect("xlim_changed", lambda ax: self.redraw())
+        self.canvas.mpl_connect("scroll_event", self.on_scroll)
+        self.canvas.mpl_connect("button_press_event", self.on_press)
+        self.canvas.mpl_connect("button_release_event", self.on_release)
+        self.canvas.mpl_connect("motion_notify_event", self.on_motion)
+        self.canvas.draw()
+        self.canvas.get_tk_widget().pack(fill="both", expand=True)
+
+    def redraw(self):
+        start, stop = self.ax.get_xlim()
+        width = int(self.ax.get_window_extent().width)
+        x, mins, maxs = self.pyramid.view(start, stop, width, self.audio_data)
+        if self.fill is not None:
+            self.fill.remove()
+        self.fill = self.ax.fill_between(x, mins, maxs, color=self.color, linewidth=0.5)
+        self.canvas.draw_idle()
+
+    def set_range(self, start, stop):
+        span = min(stop - start, self.pyramid.length)
+        start = min(max(0, start), self.pyramid.length - span)
+        self.ax.set_xlim(start, start + max(span, 16))
+
+    def on_scroll(self, event):
+        if event.inaxes is not self.ax or event.xdata is None:
+            return
+        scale = 0.8 if event.button == "up" else 1.25
+        start, stop = self.ax.get_xlim()
+        self.set_range(event.xdata - (event.xdata - start) * scale, event.xdata + (stop - event.xdata) * scale)
+
+    def on_press(self, event):
+        if event.inaxes is self.ax:
+            self.drag = (event.x, self.ax.get_xlim())
+
+    def on_release(self, event):
+        self.drag = None
+
+    def on_motion(self, event):
+        if self.drag is None or event.x is None:
+            return
+        press_x, (start, stop) = self.drag
+        shift = (press_x - event.x) * (stop - start) / self.ax.get_window_extent().width
+        self.set_range(start + shift, stop + shift)
+
+
 class NoiseReducerGUI(tk.Tk):
-    def __init__(self, processor):
+    def __init__(self, processor, warm_up=True):
+        """
+        Parameters:
+            processor (AudioProcessor): Processes the audio.
+            warm_up (bool): Once the window is showing, import the operations and the plotting
+                library on a background thread, so the first run and plot start without waiting.
+        """
         super().__init__()
         self.title("Noise_Reducer")
         self.geometry("900x750")  # Increased size to accommodate all elements
@@ -27,6 +125,21 @@ class NoiseReducerGUI(tk.Tk):
         self.input_folder = ""    # For batch mode
         self.output_folder = ""   # For batch mode
 
+        # Previews of the loaded file (single file mode), and the one the processed plot shows.
+        self.preview_session = None
+        self.shown_preview = None
+
+        # Background processing
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.job = None
+        self.last_percent = None
+        self.poll_interval_ms = 100
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        if self.processor.telemetry is not None:
+            self.processor.telemetry.on_record = self.log_stage
+
         # --- Mode Selection ---
         mode_frame = tk.Frame(self)
         mode_frame.pack(pady=5)
@@ -93,10 +206,42 @@ class NoiseReducerGUI(tk.Tk):
         self.volume_comp_var = tk.BooleanVar(value=False)
         vol_comp_cb = tk.Checkbutton(op_frame, text="Volume Compression", variable=self.volume_comp_var)
         vol_comp_cb.grid(row=4, column=0, sticky="w", padx=10, pady=5)
+
+        # Echo, reverb and compression on the speech only; the silences are attenuated.
+        self.skip_silence_var = tk.BooleanVar(value=False)
+        skip_silence_cb = tk.Checkbutton(op_frame, text="Skip Silence", variable=self.skip_silence_var)
+        skip_silence_cb.grid(row=0, column=1, sticky="w", padx=10, pady=5)
+
+        # Batches analyze every file first, skip the ticked operations it does not need and tune
+        # Echo Reduction to its echo delay.
+        self.skip_unneeded_var = tk.BooleanVar(value=True)
+        skip_unneeded_cb = tk.Checkbutton(op_frame, text="Skip Unneeded (Batch)", variable=self.skip_unneeded_var)
+        skip_unneeded_cb.grid(row=3, column=1, sticky="w", padx=10, pady=5)
+
+        # Peak memory per stage in the log and report; tracing it slows processing down.
+        self.trace_memory_var = tk.BooleanVar(value=False)
+        trace_memory_cb = tk.Checkbutton(op_frame, text="Trace Memory", variable=self.trace_memory_var,
+                                         command=self.toggle_trace_memory)
+        trace_memory_cb.grid(row=4, column=1, sticky="w", padx=10, pady=5)
+
+        # Preview the ticked operations on the visible part of the original plot (zoom in to pick
+        # a window) or on excerpts of the file, and flip the processed plot between previews.
+        preview_btn = tk.Button(op_frame, text="Preview", command=self.preview_pipeline, width=10)
+        preview_btn.grid(row=1, column=1, sticky="w", padx=10, pady=5)
+        ab_btn = tk.Button(op_frame, text="A/B", command=self.toggle_ab, width=10)
+        ab_btn.grid(row=2, column=1, sticky="w", padx=10, pady=5)
         
-        # --- Process Pipeline Button ---
-        process_btn = tk.Button(self, text="Apply Selected Operations", command=self.process_pipeline, width=25, height=2)
-        process_btn.pack(pady=10)
+        # --- Process Pipeline / Cancel Buttons ---
+        button_frame = tk.Frame(self)
+        button_frame.pack(pady=10)
+        self.process_btn = tk.Button(button_frame, text="Apply Selected Operations", command=self.process_pipeline, width=25, height=2)
+        self.process_btn.grid(row=0, column=0, padx=5)
+        self.cancel_btn = tk.Button(button_frame, text="Cancel", command=self.cancel_job, width=10, height=2, state="disabled")
+        self.cancel_btn.grid(row=0, column=1, padx=5)
+        report_btn = tk.Button(button_frame, text="Export Report", command=self.export_report, width=12, height=2)
+        report_btn.grid(row=0, column=2, padx=5)
+        profile_btn = tk.Button(button_frame, text="Noise Profile...", command=self.choose_noise_profile, width=14, height=2)
+        profile_btn.grid(row=0, column=3, padx=5)
         
         # --- Log Section ---
         log_frame = tk.LabelFrame(self, text="Operation Log", width=850, height=150)
@@ -112,6 +257,10 @@ class NoiseReducerGUI(tk.Tk):
         self.progress_var = tk.DoubleVar()
         self.progress_bar = ttk.Progressbar(self, variable=self.progress_var, maximum=100)
         self.progress_bar.pack(pady=5, fill="x", padx=10)
+
+        if warm_up:
+            # Idle callbacks run once the window has been drawn.
+            self.after_idle(start_warm_up, None, PLOTTING_MODULES)
         
     def toggle_mode(self):
         if self.batch_var.get():
@@ -133,9 +282,18 @@ class NoiseReducerGUI(tk.Tk):
             self.input_path = path
             self.path_label.config(text=f"Loaded file: {self.input_path}")
             try:
+                if self.processor.telemetry is not None:
+                    self.processor.telemetry.clear()
                 self.processor.load_audio(self.input_path)
+                if self.preview_session is not None:
+                    self.preview_session.close()
+                # Keeps the loaded audio for previews, and to render it again with other settings.
+                self.preview_session = PreviewSession(self.processor)
+                self.shown_preview = None
                 self.plot_original_waveform()
-                self.add_log(f"{os.path.basename(self.input_path)}: Imported successfully")
+                channels = channel_count(self.processor.audio_data)
+                layout = f" ({channels} channels)" if channels > 1 else ""
+                self.add_log(f"{os.path.basename(self.input_path)}: Imported successfully{layout}")
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to load audio:\n{e}")
                 self.add_log(f"{os.path.basename(path)}: Import failed")
@@ -181,33 +339,33 @@ class NoiseReducerGUI(tk.Tk):
         else:
             messagebox.showwarning("Warning", "Output folder is not set.")
     
+    def current_pyramid(self):
+        return self.processor.pyramid or WaveformPyramid.from_array(self.processor.audio_data)
+    
     def plot_original_waveform(self):
         if self.canvas_original:
             self.canvas_original.get_tk_widget().destroy()
-        fig = Figure(figsize=(4, 2.5), dpi=100)
-        ax = fig.add_subplot(111)
-        ax.plot(self.processor.audio_data, color='blue')
-        ax.set_title("Original Audio")
-        ax.set_xlabel("Samples")
-        ax.set_ylabel("Amplitude")
-        ax.set_ylim([-1, 1])
-        self.canvas_original = FigureCanvasTkAgg(fig, master=self.vis_frame_original)
-        self.canvas_original.draw()
-        self.canvas_original.get_tk_widget().pack(fill="both", expand=True)
+        self.plot_original = WaveformPlot(self.vis_frame_original, self.current_pyramid(),
+                                          self.processor.audio_data, "Original Audio", 'blue')
+        self.canvas_original = self.plot_original.canvas
     
     def plot_processed_waveform(self):
         if self.canvas_processed:
             self.canvas_processed.get_tk_widget().destroy()
-        fig = Figure(figsize=(4, 2.5), dpi=100)
-        ax = fig.add_subplot(111)
-        ax.plot(self.processor.audio_data, color='green')
-        ax.set_title("Processed Audio")
-        ax.set_xlabel("Samples")
-        ax.set_ylabel("Amplitude")
-        ax.set_ylim([-1, 1])
-        self.canvas_processed = FigureCanvasTkAgg(fig, master=self.vis_frame_processed)
-        self.canvas_processed.draw()
-        self.canvas_processed.get_tk_widget().pack(fill="both", expand=True)
+        self.plot_processed = WaveformPlot(self.vis_frame_processed, self.current_pyramid(),
+                                           self.processor.audio_data, "Processed Audio", 'green')
+        self.canvas_processed = self.plot_processed.canvas
+        self.shown_preview = None
+    
+    def plot_preview(self, preview, title):
+        """Shows a Preview (its excerpts joined by short silences) in the processed plot."""
+        if self.canvas_processed:
+            self.canvas_processed.get_tk_widget().destroy()
+        audio = preview.audio()
+        self.plot_processed = WaveformPlot(self.vis_frame_processed, WaveformPyramid.from_array(audio), audio,
+                                           title, 'orange' if preview.operations else 'blue')
+        self.canvas_processed = self.plot_processed.canvas
+        self.shown_preview = preview
     
     def add_log(self, message):
         self.log_text.configure(state="normal")
@@ -215,92 +373,364 @@ class NoiseReducerGUI(tk.Tk):
         self.log_text.configure(state="disabled")
         self.log_text.see(tk.END)
     
+    def log_stage(self, record):
+        """Telemetry callback: logs a finished stage, from whichever thread ran it."""
+        if threading.current_thread() is threading.main_thread():
+            self.add_log(format_record(record))
+        else:
+            self.events.put(("log", format_record(record)))
+    
+    def export_report(self):
+        telemetry = self.processor.telemetry
+        if telemetry is None or not telemetry.records:
+            messagebox.showwarning("Warning", "Nothing has been processed yet.")
+            return
+        path = filedialog.asksaveasfilename(title="Save Stage Report", defaultextension=".json",
+                                            filetypes=[("JSON Files", "*.json"), ("CSV Files", "*.csv")])
+        if path:
+            telemetry.save(path)
+            self.add_log(f"Stage report saved: {path}")
+    
+    def choose_noise_profile(self):
+        """
+        Sets the noise profile Noise Reduction gates against, for single files and batches:
+        a saved .npz profile, or one learned from an audio file (a noise-only clip, or a take
+        whose quietest frames are noise).
+        """
+        from operations.noise_reduction import NoiseProfile
+        path = filedialog.askopenfilename(title="Select Noise Profile or Noise Clip",
+                                          filetypes=[("Noise Profiles", "*.npz"), ("Audio Files", "*.*")])
+        if not path:
+            return
+        try:
+            if path.lower().endswith(".npz"):
+                profile = NoiseProfile.load(path)
+            else:
+                noise_only = messagebox.askyesno("Noise Profile", "Is this clip noise only?\n"
+                                                 "Answer No to learn from its quietest frames.")
+                reference = AudioProcessor()
+                reference.load_audio(path)
+                profile = NoiseProfile.learn(reference.audio_data, reference.sample_rate,
+                                             quietest=None if noise_only else 0.1)
+                save_path = filedialog.asksaveasfilename(title="Save Noise Profile (optional)",
+                                                         defaultextension=".npz",
+                                                         filetypes=[("Noise Profiles", "*.npz")])
+                if save_path:
+                    profile.save(save_path)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to get a noise profile:\n{e}")
+            return
+        self.processor.parameters["Noise Reduction"] = {"noise_profile": profile}
+        self.add_log(f"Noise profile set from {os.path.basename(path)} ({profile.fingerprint})")
+    
+    def selected_operations(self):
+        ops = []
+        if self.noise_var.get():
+            ops.append("Noise Reduction")
+        if self.echo_var.get():
+            ops.append("Echo Reduction")
+        if self.reverb_var.get():
+            ops.append("Reverb Reduction")
+        if self.volume_norm_var.get():
+            ops.append("Volume Normalization")
+        if self.volume_comp_var.get():
+            ops.append("Volume Compression")
+        return sort_operations(ops)
+    
+    def preview_window(self):
+        """The visible range of the original plot when it is zoomed in, else None (excerpts are previewed)."""
+        if not self.canvas_original:
+            return None
+        start, stop = self.plot_original.ax.get_xlim()
+        if stop - start >= 0.99 * frame_count(self.processor.audio_data):
+            return None
+        return int(start), int(stop)
+    
+    def preview_pipeline(self):
+        if self.job is not None and not self.job.done():
+            return
+        if self.batch_var.get() or self.preview_session is None:
+            messagebox.showwarning("Warning", "Please import an audio file first.")
+            return
+        ops = self.selected_operations()
+        if not ops:
+            messagebox.showwarning("Warning", "No operations selected")
+            return
+        self.processor.activity_gate = ActivityGate() if self.skip_silence_var.get() else None
+        self.start_job(self.run_preview, ops, self.preview_window())
+    
+    def toggle_trace_memory(self):
+        if self.processor.telemetry is not None:
+            self.processor.telemetry.trace_memory = self.trace_memory_var.get()
+    
+    def toggle_ab(self):
+        """Flips the processed plot between the latest preview (B) and the one before it (A), or the original."""
+        session = self.preview_session
+        if session is None or not session.previews:
+            messagebox.showwarning("Warning", "Preview some operations first.")
+            return
+        latest = session.previews[-1]
+        if self.shown_preview is latest:
+            earlier = session.previews[-2] if len(session.previews) > 1 else None
+            # Previews of other ranges are compared with the original instead.
+            if earlier is None or earlier.ranges != latest.ranges:
+                earlier = session.original(latest)
+            self.plot_preview(earlier, "A: " + (" + ".join(earlier.operations) or "Original"))
+            self.add_log("A: " + earlier.describe())
+        else:
+            self.plot_preview(latest, "B: Preview")
+            self.add_log("B: " + latest.describe())
+    
     def process_pipeline(self):
+        if self.job is not None and not self.job.done():
+            return
+        ops = self.selected_operations()
+        self.processor.activity_gate = ActivityGate() if self.skip_silence_var.get() else None
         # Batch mode processing.
         if self.batch_var.get():
             if not self.input_folder or not self.output_folder:
                 messagebox.showwarning("Warning", "Please set both input and output folders for batch processing.")
                 return
-            audio_extensions = (".wav", ".mp3", ".flac", ".ogg")
-            files = [f for f in os.listdir(self.input_folder) if f.lower().endswith(audio_extensions)]
-            total_files = len(files)
-            if total_files == 0:
+            files = discover_files(self.input_folder, recursive=True, exclude=[self.output_folder])
+            if len(files) == 0:
                 messagebox.showwarning("Warning", "No valid audio files found in the input folder.")
                 return
-            for idx, filename in enumerate(files):
-                in_file = os.path.join(self.input_folder, filename)
-                out_file = os.path.join(self.output_folder, filename)
-                self.add_log(f"{filename}: Processing started")
-                try:
-                    proc = AudioProcessor()
-                    proc.load_audio(in_file)
-                    ops = []
-                    if self.noise_var.get():
-                        ops.append("Noise Reduction")
-                    if self.echo_var.get():
-                        ops.append("Echo Reduction")
-                    if self.reverb_var.get():
-                        ops.append("Reverb Reduction")
-                    if self.volume_norm_var.get():
-                        ops.append("Volume Normalization")
-                    if self.volume_comp_var.get():
-                        ops.append("Volume Compression")
-                    order_map = {
-                        "Noise Reduction": 1,
-                        "Echo Reduction": 2,
-                        "Reverb Reduction": 3,
-                        "Volume Normalization": 4,
-                        "Volume Compression": 5,
-                    }
-                    ops_sorted = sorted(ops, key=lambda op: order_map.get(op, 100))
-                    for op in ops_sorted:
-                        proc.process_operation(op)
-                        self.add_log(f"{filename}: {op} Successful")
-                    proc.save_audio(out_file)
-                    self.add_log(f"{filename}: Saved to output folder")
-                except Exception as e:
-                    self.add_log(f"{filename}: Processing failed: {e}")
-                # Update progress for batch mode
-                progress = ((idx + 1) / total_files) * 100
-                self.progress_var.set(progress)
-                self.update_idletasks()
-            messagebox.showinfo("Batch Processing", "Batch processing completed. Check log for details.")
-            self.progress_var.set(0)
+            self.start_job(self.run_batch, files, ops, self.input_folder, self.output_folder,
+                           self.skip_unneeded_var.get())
         else:
             # Single file mode.
-            filename = os.path.basename(self.input_path)
-            ops = []
-            if self.noise_var.get():
-                ops.append("Noise Reduction")
-            if self.echo_var.get():
-                ops.append("Echo Reduction")
-            if self.reverb_var.get():
-                ops.append("Reverb Reduction")
-            if self.volume_norm_var.get():
-                ops.append("Volume Normalization")
-            if self.volume_comp_var.get():
-                ops.append("Volume Compression")
+            if self.processor.audio_data is None:
+                messagebox.showwarning("Warning", "Please import an audio file first.")
+                return
             if not ops:
                 messagebox.showwarning("Warning", "No operations selected")
                 return
-            total_ops = len(ops)
-            for i, op in enumerate(ops):
-                self.processor.process_operation(op)
-                self.add_log(f"{filename}: {op} applied successfully")
-                progress = ((i + 1) / total_ops) * 100
-                self.progress_var.set(progress)
-                self.update_idletasks()
-            if self.output_path:
-                self.processor.save_audio(self.output_path)
-                self.add_log(f"{filename}: Saved to output file")
-                messagebox.showinfo("Success", "Operations applied and audio saved successfully")
-            else:
-                messagebox.showinfo("Success", "Operations applied successfully (no output file set)")
-            self.plot_processed_waveform()
+            self.start_job(self.run_single, os.path.basename(self.input_path), ops, self.output_path)
+    
+    # --- Background processing ---
+    # Jobs run on a single worker thread and never touch Tk directly: they post
+    # ("log" | "progress" | "done" | "cancelled" | "error", ...) events to a queue
+    # that the Tk event loop drains with after().
+    
+    def start_job(self, target, *args):
+        self.cancel_event.clear()
+        self.last_percent = None
+        self.process_btn.config(state="disabled")
+        self.cancel_btn.config(state="normal")
+        self.progress_var.set(0)
+        self.job = self.executor.submit(self.run_job, target, *args)
+        self.after(self.poll_interval_ms, self.poll_events)
+    
+    def cancel_job(self):
+        if self.job is not None and not self.job.done():
+            self.cancel_event.set()
+            self.cancel_btn.config(state="disabled")
+            self.add_log("Cancelling after the current block...")
+    
+    def on_close(self):
+        # Stop a running job at its next block instead of waiting for it to finish.
+        self.cancel_event.set()
+        self.executor.shutdown(wait=False)
+        if self.preview_session is not None:
+            self.preview_session.close()
+        self.processor.close()
+        self.destroy()
+    
+    def run_job(self, target, *args):
+        try:
+            target(*args)
+        except ProcessingCancelled:
+            self.events.put(("cancelled",))
+        except Exception as e:
+            self.events.put(("error", str(e)))
+        finally:
+            if self.processor.cache is not None:
+                self.events.put(("log", self.processor.cache.report()))
+    
+    def report_progress(self, fraction):
+        """Posts overall progress (0 to 1) and stops the job if Cancel was pressed."""
+        percent = round(fraction * 100, 1)
+        # Block-based operations report thousands of times; only post visible changes.
+        if percent != self.last_percent:
+            self.last_percent = percent
+            self.events.put(("progress", percent))
+        if self.cancel_event.is_set():
+            raise ProcessingCancelled()
+    
+    def operation_progress(self, start, span):
+        """Progress callback for one step covering [start, start + span) of the job."""
+        return lambda done, total: self.report_progress(start + span * done / max(total, 1))
+    
+    def run_preview(self, ops, window):
+        preview = self.preview_session.preview(
+            ops, window, progress=lambda done, total: self.report_progress(done / total),
+            partial=lambda partial: self.events.put(("preview", partial)))
+        self.events.put(("log", f"Preview: {preview.describe()}"))
+        self.events.put(("done", "preview", None))
+    
+    def run_single(self, filename, ops, output_path):
+        # Every render starts from the file as loaded, with the state warmed up by its previews.
+        session = self.preview_session
+        session.restore()
+        parameters = self.processor.parameters
+        self.processor.parameters = session.commit_parameters(ops)
+        steps = self.processor.plan(ops)
+        try:
+            for i, step in enumerate(steps):
+                self.report_progress(i / len(steps))
+                self.processor.run_step(step, progress=self.operation_progress(i / len(steps), 1 / len(steps)))
+                for op in step[1]:
+                    self.events.put(("log", f"{filename}: {op} applied successfully"))
+        except ProcessingCancelled:
+            # Leave the loaded audio as it was before this run.
+            session.restore()
+            raise
+        finally:
+            self.processor.parameters = parameters
+        if output_path:
+            self.processor.save_audio(output_path)
+            self.events.put(("log", f"{filename}: Saved to output file"))
+            self.events.put(("done", "single", "Operations applied and audio saved successfully"))
+        else:
+            self.events.put(("done", "single", "Operations applied successfully (no output file set)"))
+    
+    def run_batch(self, files, ops, input_folder, output_folder, adapt=False):
+        proc = AudioProcessor(cache=self.processor.cache, telemetry=self.processor.telemetry,
+                              parameters=self.processor.parameters,
+                              channel_workers=self.processor.channel_workers,
+                              activity_gate=self.processor.activity_gate)
+        if proc.telemetry is not None:
+            proc.telemetry.clear()
+        key = run_settings_key(ops, proc.parameters, proc.activity_gate, adapt=adapt)
+        manifest = open_manifest(os.path.join(output_folder, MANIFEST_NAME.format(key=key)))
+        index = AnalysisIndex(os.path.join(output_folder, ANALYSIS_INDEX_NAME)) if adapt else None
+        try:
+            self.process_files(proc, manifest, files, ops, input_folder, output_folder, index)
+        finally:
+            proc.close()
+            manifest.close()
+            if index is not None:
+                index.close()
+        self.events.put(("done", "batch", "Batch processing completed. Check log for details."))
+    
+    def process_files(self, proc, manifest, files, ops, input_folder, output_folder, index=None):
+        # Files are claimed from the manifest, so files done by an earlier run (or by a batch
+        # process sharing the output folder) are skipped, and an interrupted run can be resumed.
+        manifest.add([(job_id(path, input_folder), os.path.getsize(path), os.path.getmtime(path))
+                      for path in files])
+        manifest.requeue(lambda job: os.path.exists(os.path.join(output_folder, *job.split("/"))))
+        stats = manifest.stats()
+        total_files = max(stats["pending"] + stats["running"], 1)
+        if stats["done"]:
+            self.events.put(("log", f"Skipping {stats['done']} files already processed"))
+        worker = worker_name()
+        claimed = set()
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=renew_leases, args=(manifest, claimed, worker, DEFAULT_LEASE, stop),
+                                     daemon=True)
+        heartbeat.start()
+        try:
+            self.process_claimed(proc, manifest, worker, claimed, total_files, ops, input_folder, output_folder,
+                                 index)
+        finally:
+            stop.set()
+            heartbeat.join()
+            for job in list(claimed):
+                manifest.release(job, worker)
+        self.events.put(("log", progress_line(manifest.stats())))
+    
+    def process_claimed(self, proc, manifest, worker, claimed, total_files, ops, input_folder, output_folder,
+                        index=None):
+        idx = 0
+        while True:
+            job = manifest.claim(worker)
+            if job is None:
+                break
+            claimed.add(job.id)
+            filename = job.id
+            in_file = os.path.join(input_folder, *job.id.split("/"))
+            out_file = output_file(in_file, output_folder, input_folder)
+            os.makedirs(os.path.dirname(out_file), exist_ok=True)
+            self.events.put(("log", f"{filename}: Processing started"))
+            started = time.perf_counter()
+            try:
+                self.report_progress(min(idx / total_files, 1))
+                file_ops, tuned = ops, {}
+                analysis = proc.file_analysis(in_file, index) if index is not None else None
+                if analysis is not None:
+                    file_ops, skipped, tuned = proc.adapt(ops, analysis)
+                    for op, reason in skipped.items():
+                        self.events.put(("log", f"{filename}: {op} skipped ({reason})"))
+                span = 1 / total_files / (len(file_ops) + 1)
+                with proc.with_parameters(tuned):
+                    remaining = proc.load_cached(in_file, file_ops)
+                    audio_seconds = proc.audio_data.shape[-1] / proc.sample_rate
+                    done = len(file_ops) - len(remaining)
+                    for op in file_ops[:done]:
+                        self.events.put(("log", f"{filename}: {op} reused from cache"))
+                    steps = proc.plan(remaining)
+                    for i, step in enumerate(steps):
+                        start = idx / total_files + span * (done + 1)
+                        step_progress = self.operation_progress(start, span * len(step[1]))
+                        # The last step also writes the output file (in the same pass when it is pointwise).
+                        if i == len(steps) - 1:
+                            proc.run_step_and_save(step, out_file, progress=step_progress)
+                        else:
+                            proc.run_step(step, progress=step_progress)
+                        done += len(step[1])
+                        for op in step[1]:
+                            self.events.put(("log", f"{filename}: {op} Successful"))
+                    if not steps:
+                        proc.save_audio(out_file)
+                manifest.complete(job.id, worker, time.perf_counter() - started, audio_seconds)
+                self.events.put(("log", f"{filename}: Saved to output folder"))
+            except ProcessingCancelled:
+                raise
+            except Exception as e:
+                manifest.fail(job.id, worker, f"{type(e).__name__}: {e}")
+                self.events.put(("log", f"{filename}: Processing failed: {e}"))
+            finally:
+                claimed.discard(job.id)
+                proc.audio_data = None
+                idx += 1
+    
+    def poll_events(self):
+        finished = False
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            kind = event[0]
+            if kind == "log":
+                self.add_log(event[1])
+            elif kind == "progress":
+                self.progress_var.set(event[1])
+            elif kind == "preview":
+                self.plot_preview(event[1], "B: Preview")
+            elif kind == "done":
+                finished = True
+                # A finished preview is already showing; it needs no dialog.
+                if event[1] == "single":
+                    self.plot_processed_waveform()
+                    messagebox.showinfo("Success", event[2])
+                elif event[1] == "batch":
+                    messagebox.showinfo("Batch Processing", event[2])
+            elif kind == "cancelled":
+                finished = True
+                self.add_log("Processing cancelled")
+            elif kind == "error":
+                finished = True
+                self.add_log(f"Processing failed: {event[1]}")
+                messagebox.showerror("Error", f"Processing failed:\n{event[1]}")
+        if finished or self.job.done() and self.events.empty():
+            self.process_btn.config(state="normal")
+            self.cancel_btn.config(state="disabled")
             self.progress_var.set(0)
+        else:
+            self.after(self.poll_interval_ms, self.poll_events)
 
 if __name__ == "__main__":
-    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-    processor = AudioProcessor()
+    processor = AudioProcessor(keep_overview=True, cache=ResultCache(), telemetry=Telemetry())
     app = NoiseReducerGUI(processor)
     app.mainloop()
@@ -1,9 +1,18 @@
+import argparse
+
 from gui import NoiseReducerGUI
 from processing import AudioProcessor
+from cache import ResultCache
+from telemetry import Telemetry
 
-def main():
-    processor = AudioProcessor()
-    app = NoiseReducerGUI(processor)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AudioPolish")
+    parser.add_argument("--no-warm-up", action="store_true",
+                        help="Do not import the operations in the background once the window shows; "
+                             "each loads when it first runs.")
+    args = parser.parse_args(argv)
+    processor = AudioProcessor(keep_overview=True, cache=ResultCache(), telemetry=Telemetry())
+    app = NoiseReducerGUI(processor, warm_up=not args.no_warm_up)
     app.mainloop()
 
 if __name__ == "__main__":
@@ -0,0 +1,566 @@
+"""
+Job manifests for resumable batch runs shared by any number of workers and hosts.
+
+A manifest records one job per input file: the file's path relative to the input
+folder, its size and modification time, and whether it is pending, running (claimed
+under a lease), done or failed. Workers claim jobs atomically and renew their leases
+with heartbeats; a job whose lease runs out (its worker crashed or lost its host) is
+claimed again by someone else. Finished jobs are checkpointed with their timings, so
+a rerun processes only the files that are new, changed, failed, or whose output has
+gone missing, and the manifest gives the throughput and ETA of all workers together.
+
+Two stores are available:
+- SQLiteManifest: one SQLite file. Workers on one host, or on hosts whose shared
+  storage has working file locks.
+- DirectoryManifest: a folder of small files, claimed with exclusive creates and
+  atomic renames only, for hosts sharing storage with unreliable locking (e.g. NFS).
+
+A manifest also keeps a key of the settings its jobs were done with (the operations and
+their parameters, see settings_key): a run with other settings calls use_settings, which
+makes every job pending again, since their outputs no longer match.
+
+open_manifest picks one from the path: a .sqlite or .db file, or a directory.
+Leases use the wall clock, so the clocks of the hosts must agree to well within a lease.
+"""
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+# Seconds a claim holds without a heartbeat.
+DEFAULT_LEASE = 120.0
+
+# Claims of a job (e.g. crashes of the workers running it) before it is marked failed.
+MAX_ATTEMPTS = 3
+
+# Seconds of recent finishes the throughput is measured over.
+RATE_WINDOW = 600.0
+
+# A claimed job: id is the input path relative to the input folder, with "/" separators.
+Job = namedtuple("Job", ["id", "size", "attempts"])
+
+
+def worker_name():
+    """Name identifying this process in leases: host:pid."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def open_manifest(path):
+    """Opens (creating if needed) the manifest at path: SQLite for .sqlite/.db files, otherwise a directory."""
+    if path.lower().endswith((".sqlite", ".db")):
+        return SQLiteManifest(path)
+    return DirectoryManifest(path)
+
+
+def settings_key(settings):
+    """Short hash of a run's settings (JSON-serializable, other values by their str)."""
+    text = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def progress_line(stats):
+    """One-line summary of stats() for logs: jobs done, failed and running, throughput and ETA."""
+    line = f"{stats['done']}/{stats['total']} done, {stats['failed']} failed, {stats['running']} running"
+    if stats["files_per_hour"] is not None:
+        line += f", {stats['files_per_hour']:.0f} files/h"
+    if stats["eta_seconds"] is not None:
+        eta = int(stats["eta_seconds"])
+        line += f", ETA {eta // 3600}:{eta % 3600 // 60:02d}:{eta % 60:02d}"
+    return line
+
+
+def _rates(recent, remaining_bytes, now):
+    # Throughput and ETA from (started, finished, size, audio_seconds) of recently finished jobs.
+    stats = {"files_per_hour": None, "audio_seconds_per_second": None, "bytes_per_second": None,
+             "eta_seconds": None}
+    if not recent:
+        return stats
+    span = max(now - min(started for started, _, _, _ in recent), 1e-3)
+    stats["files_per_hour"] = len(recent) / span * 3600
+    stats["audio_seconds_per_second"] = sum(audio or 0.0 for _, _, _, audio in recent) / span
+    stats["bytes_per_second"] = sum(size for _, _, size, _ in recent) / span
+    if stats["bytes_per_second"]:
+        stats["eta_seconds"] = remaining_bytes / stats["bytes_per_second"]
+    return stats
+
+
+class SQLiteManifest:
+    """
+    Job manifest in one SQLite file; see the module docstring. One instance may be used from
+    several threads (e.g. a heartbeat thread).
+    """
+
+    def __init__(self, path):
+        """
+        Parameters:
+            path (str): SQLite file, created with its folder if missing.
+        """
+        self.path = path
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        # Autocommit, with explicit immediate transactions where a read decides a write.
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY, size INTEGER, mtime REAL, status TEXT NOT NULL DEFAULT 'pending',
+            worker TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0, started REAL, finished REAL,
+            seconds REAL, audio_seconds REAL, error TEXT)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _write(self, statements):
+        # Runs (sql, parameters) pairs in one immediate transaction.
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, parameters in statements:
+                    self._db.execute(sql, parameters)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _read(self, sql, parameters=()):
+        with self._lock:
+            return self._db.execute(sql, parameters).fetchall()
+
+    def use_settings(self, key):
+        """
+        Records the settings key of this run. When the jobs were done with other settings, they
+        all become pending again.
+
+        Parameters:
+            key (str): See settings_key.
+
+        Returns:
+            int: The jobs done or failed with other settings, now pending again.
+
+        Raises:
+            ValueError: If jobs are still running with other settings.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT value FROM meta WHERE name = 'settings'").fetchone()
+                reset = 0
+                if row is not None and row[0] != key:
+                    running, = self._db.execute("""SELECT count(*) FROM jobs WHERE status = 'running'
+                                                   AND lease_until >= ?""", (now,)).fetchone()
+                    if running:
+                        raise ValueError(f"{running} jobs of {self.path} are running with other settings; "
+                                         "wait for them to finish or use another manifest")
+                    reset = self._db.execute("""UPDATE jobs SET status = 'pending', attempts = 0, error = NULL
+                                                WHERE status != 'pending'""").rowcount
+                self._db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('settings', ?)", (key,))
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+        return reset
+
+    def add(self, entries):
+        """
+        Adds jobs for (id, size, mtime) entries. A known job whose input changed size or
+        modification time becomes pending again.
+        """
+        self._write([("""INSERT INTO jobs (id, size, mtime) VALUES (?, ?, ?) ON CONFLICT (id) DO UPDATE SET
+                         size = excluded.size, mtime = excluded.mtime, status = 'pending', attempts = 0, error = NULL
+                         WHERE jobs.size != excluded.size OR jobs.mtime != excluded.mtime""", entry)
+                     for entry in entries])
+
+    def requeue(self, output_exists):
+        """
+        Makes failed jobs pending again, and done jobs whose output is missing.
+
+        Parameters:
+            output_exists (callable): output_exists(job id) -> bool.
+        """
+        missing = [job_id for job_id, in self._read("SELECT id FROM jobs WHERE status = 'done'")
+                   if not output_exists(job_id)]
+        self._write([("UPDATE jobs SET status = 'pending', attempts = 0, error = NULL WHERE status = 'failed'", ())]
+                    + [("UPDATE jobs SET status = 'pending' WHERE id = ? AND status = 'done'", (job_id,))
+                       for job_id in missing])
+
+    def claim(self, worker, lease=DEFAULT_LEASE):
+        """
+        Claims the next pending job, or one whose lease ran out, for worker.
+
+        Returns:
+            Job: The claimed job, or None when there is none left to claim.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs whose worker kept dying fail instead of being claimed again.
+                self._db.execute("""UPDATE jobs SET status = 'failed', finished = ?, error = 'Lease expired '
+                                    || attempts || ' times' WHERE status = 'running' AND lease_until < ?
+                                    AND attempts >= ?""", (now, now, MAX_ATTEMPTS))
+                row = self._db.execute("""SELECT id, size, attempts FROM jobs WHERE status = 'pending'
+                                          OR (status = 'running' AND lease_until < ?) ORDER BY id LIMIT 1""",
+                                       (now,)).fetchone()
+                if row is not None:
+                    self._db.execute("""UPDATE jobs SET status = 'running', worker = ?, lease_until = ?,
+                                        started = ?, attempts = attempts + 1 WHERE id = ?""",
+                                     (worker, now + lease, now, row[0]))
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+        return Job(row[0], row[1], row[2] + 1) if row is not None else None
+
+    def heartbeat(self, job_ids, worker, lease=DEFAULT_LEASE):
+        """
+        Renews worker's leases on job_ids.
+
+        Returns:
+            set: The ids worker still holds; a job missing from it was claimed by another worker.
+        """
+        until = time.time() + lease
+        self._write([("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                      (until, job_id, worker)) for job_id in job_ids])
+        return {job_id for job_id in job_ids
+                if self._read("SELECT worker, status FROM jobs WHERE id = ?", (job_id,)) == [(worker, "running")]}
+
+    def complete(self, job_id, worker, seconds=None, audio_seconds=None):
+        """Checkpoints a finished job. Its output must already be in place."""
+        self._write([("""UPDATE jobs SET status = 'done', worker = ?, finished = ?, seconds = ?, audio_seconds = ?,
+                         error = NULL WHERE id = ?""", (worker, time.time(), seconds, audio_seconds, job_id))])
+
+    def fail(self, job_id, worker, error):
+        """Marks a job failed, unless another worker has claimed it since."""
+        self._write([("""UPDATE jobs SET status = 'failed', finished = ?, error = ? WHERE id = ? AND worker = ?
+                         AND status = 'running'""", (time.time(), error, job_id, worker))])
+
+    def release(self, job_id, worker):
+        """Gives a claimed job back unprocessed (e.g. on shutdown)."""
+        self._write([("""UPDATE jobs SET status = 'pending', attempts = max(attempts - 1, 0) WHERE id = ?
+                         AND worker = ? AND status = 'running'""", (job_id, worker))])
+
+    def failures(self):
+        """Returns {job id: error} of the failed jobs."""
+        return dict(self._read("SELECT id, error FROM jobs WHERE status = 'failed'"))
+
+    def stats(self, window=RATE_WINDOW):
+        """
+        Returns:
+            dict: Job counts by status, bytes done and remaining, and the throughput of the jobs
+                finished in the last window seconds (by every worker) with the ETA it gives.
+        """
+        now = time.time()
+        stats = {status: 0 for status in ("pending", "running", "done", "failed")}
+        stats.update(done_bytes=0, remaining_bytes=0)
+        for status, count, size in self._read("SELECT status, count(*), sum(size) FROM jobs GROUP BY status"):
+            stats[status] = count
+            if status == "done":
+                stats["done_bytes"] = size or 0
+            elif status in ("pending", "running"):
+                stats["remaining_bytes"] += size or 0
+        stats["total"] = sum(stats[status] for status in ("pending", "running", "done", "failed"))
+        recent = self._read("""SELECT started, finished, size, audio_seconds FROM jobs WHERE status = 'done'
+                               AND finished >= ?""", (now - window,))
+        stats.update(_rates(recent, stats["remaining_bytes"], now))
+        return stats
+
+
+class DirectoryManifest:
+    """
+    Job manifest in a folder, for workers on hosts that share storage without reliable locks.
+
+    Every job has a file jobs/KEY.json (KEY hashes its id). A claim is a lease file
+    leases/KEY/N created exclusively, N counting the claims of the job: an expired lease N
+    is taken over by creating N + 1, which only one worker can do. Heartbeats replace the
+    lease file atomically. Results are done/KEY.json and failed/KEY.json, written to a
+    temporary name and renamed into place. One instance may be used from several threads.
+    """
+
+    def __init__(self, path):
+        """
+        Parameters:
+            path (str): Manifest folder, created if missing.
+        """
+        self.path = path
+        for folder in ("jobs", "leases", "done", "failed"):
+            os.makedirs(os.path.join(path, folder), exist_ok=True)
+        # Finished records never change, so they are read once.
+        self._done = {}
+        self._claims = {}
+        # Keeps a heartbeat from rewriting a lease that is being released.
+        self._lock = threading.RLock()
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _key(job_id):
+        return hashlib.sha1(job_id.encode()).hexdigest()
+
+    def _file(self, folder, key, suffix=".json"):
+        return os.path.join(self.path, folder, key + suffix)
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _replace(self, path, values):
+        # Writes JSON next to path and renames it into place.
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(values, f)
+        os.replace(temp_path, path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def use_settings(self, key):
+        """
+        Records the settings key of this run in settings.json. When the jobs were done with other
+        settings, they all become pending again.
+
+        Parameters:
+            key (str): See settings_key.
+
+        Returns:
+            int: The jobs done or failed with other settings, now pending again.
+
+        Raises:
+            ValueError: If jobs are still running with other settings.
+        """
+        path = os.path.join(self.path, "settings.json")
+        stored = self._read(path)
+        reset = 0
+        if stored is not None and stored.get("key") != key:
+            now = time.time()
+            done = set(self._done_records())
+            failed = {name[:-5] for name in os.listdir(os.path.join(self.path, "failed"))}
+            running = sum(self._status(name[:-5], done, failed, now) == "running"
+                          for name in os.listdir(os.path.join(self.path, "jobs")) if name.endswith(".json"))
+            if running:
+                raise ValueError(f"{running} jobs of {self.path} are running with other settings; "
+                                 "wait for them to finish or use another manifest")
+            for folder in ("done", "failed"):
+                for name in os.listdir(os.path.join(self.path, folder)):
+                    self._remove(os.path.join(self.path, folder, name))
+                    reset += name.endswith(".json")
+            for key_folder in os.listdir(os.path.join(self.path, "leases")):
+                for generation in self._generations(key_folder):
+                    self._remove(os.path.join(self.path, "leases", key_folder, str(generation)))
+            self._done.clear()
+        if stored is None or stored.get("key") != key:
+            self._replace(path, {"key": key})
+        return reset
+
+    def add(self, entries):
+        """
+        Adds jobs for (id, size, mtime) entries. A known job whose input changed size or
+        modification time becomes pending again.
+        """
+        for job_id, size, mtime in entries:
+            key = self._key(job_id)
+            path = self._file("jobs", key)
+            job = self._read(path)
+            if job is not None and (job["size"], job["mtime"]) == (size, mtime):
+                continue
+            self._replace(path, {"id": job_id, "size": size, "mtime": mtime})
+            if job is not None:
+                self._remove(self._file("done", key))
+                self._remove(self._file("failed", key))
+                self._done.pop(key, None)
+
+    def requeue(self, output_exists):
+        """
+        Makes failed jobs pending again, and done jobs whose output is missing.
+
+        Parameters:
+            output_exists (callable): output_exists(job id) -> bool.
+        """
+        for name in os.listdir(os.path.join(self.path, "failed")):
+            # The expired leases that failed it no longer count.
+            key = name[:-5]
+            for generation in self._generations(key):
+                self._remove(os.path.join(self.path, "leases", key, str(generation)))
+            self._remove(os.path.join(self.path, "failed", name))
+        for key, record in self._done_records().items():
+            if not output_exists(record["id"]):
+                self._remove(self._file("done", key))
+                self._done.pop(key, None)
+
+    def _done_records(self):
+        names = os.listdir(os.path.join(self.path, "done"))
+        current = {name[:-5] for name in names if name.endswith(".json")}
+        for key in list(self._done):
+            if key not in current:
+                del self._done[key]
+        for key in current - self._done.keys():
+            record = self._read(self._file("done", key))
+            if record is not None:
+                self._done[key] = record
+        return self._done
+
+    def _generations(self, key):
+        try:
+            return sorted(int(name) for name in os.listdir(os.path.join(self.path, "leases", key))
+                          if name.isdigit())
+        except FileNotFoundError:
+            return []
+
+    def _lease_expired(self, key, generation, now):
+        path = os.path.join(self.path, "leases", key, str(generation))
+        lease = self._read(path)
+        if lease is None:
+            # Just created and not written yet, or unreadable: go by its age.
+            try:
+                return os.path.getmtime(path) + DEFAULT_LEASE < now
+            except OSError:
+                return True
+        return lease["until"] < now
+
+    def _status(self, key, done, failed, now):
+        if key in done:
+            return "done"
+        if key in failed:
+            return "failed"
+        generations = self._generations(key)
+        if generations and not self._lease_expired(key, generations[-1], now):
+            return "running"
+        return "pending"
+
+    def claim(self, worker, lease=DEFAULT_LEASE):
+        """
+        Claims the next pending job, or one whose lease ran out, for worker.
+
+        Returns:
+            Job: The claimed job, or None when there is none left to claim.
+        """
+        now = time.time()
+        done = self._done_records()
+        failed = {name[:-5] for name in os.listdir(os.path.join(self.path, "failed"))}
+        jobs = {}
+        for name in os.listdir(os.path.join(self.path, "jobs")):
+            key = name[:-5]
+            if name.endswith(".json") and key not in done and key not in failed:
+                job = self._read(self._file("jobs", key))
+                if job is not None:
+                    jobs[key] = job
+        for key, job in sorted(jobs.items(), key=lambda item: item[1]["id"]):
+            generations = self._generations(key)
+            if generations and not self._lease_expired(key, generations[-1], now):
+                continue
+            generation = generations[-1] + 1 if generations else 0
+            if generation >= MAX_ATTEMPTS:
+                self._replace(self._file("failed", key), {"id": job["id"], "finished": now,
+                                                          "error": f"Lease expired {generation} times"})
+                continue
+            folder = os.path.join(self.path, "leases", key)
+            os.makedirs(folder, exist_ok=True)
+            try:
+                fd = os.open(os.path.join(folder, str(generation)), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            with os.fdopen(fd, "w") as f:
+                json.dump({"worker": worker, "until": now + lease, "started": now}, f)
+            self._claims[job["id"]] = (key, generation, now)
+            return Job(job["id"], job["size"], generation + 1)
+        return None
+
+    def _holds(self, job_id, worker):
+        claim = self._claims.get(job_id)
+        if claim is None:
+            return False
+        key, generation, _ = claim
+        generations = self._generations(key)
+        return bool(generations) and generations[-1] == generation
+
+    def heartbeat(self, job_ids, worker, lease=DEFAULT_LEASE):
+        """
+        Renews worker's leases on job_ids.
+
+        Returns:
+            set: The ids worker still holds; a job missing from it was claimed by another worker.
+        """
+        held = set()
+        until = time.time() + lease
+        with self._lock:
+            for job_id in job_ids:
+                if self._holds(job_id, worker):
+                    key, generation, started = self._claims[job_id]
+                    self._replace(os.path.join(self.path, "leases", key, str(generation)),
+                                  {"worker": worker, "until": until, "started": started})
+                    held.add(job_id)
+        return held
+
+    def complete(self, job_id, worker, seconds=None, audio_seconds=None):
+        """Checkpoints a finished job. Its output must already be in place."""
+        key = self._key(job_id)
+        job = self._read(self._file("jobs", key)) or {"size": 0}
+        started = self._claims.get(job_id, (None, None, time.time()))[2]
+        self._replace(self._file("done", key), {"id": job_id, "worker": worker, "size": job["size"],
+                                                "started": started, "finished": time.time(), "seconds": seconds,
+                                                "audio_seconds": audio_seconds})
+        self.release(job_id, worker)
+
+    def fail(self, job_id, worker, error):
+        """Marks a job failed, unless another worker has claimed it since."""
+        with self._lock:
+            if self._holds(job_id, worker):
+                self._replace(self._file("failed", self._key(job_id)), {"id": job_id, "worker": worker,
+                                                                        "finished": time.time(), "error": error})
+            self.release(job_id, worker)
+
+    def release(self, job_id, worker):
+        """Gives a claimed job back (e.g. on shutdown), or drops the lease of a finished one."""
+        with self._lock:
+            if self._holds(job_id, worker):
+                key, generation, _ = self._claims[job_id]
+                self._remove(os.path.join(self.path, "leases", key, str(generation)))
+            self._claims.pop(job_id, None)
+
+    def failures(self):
+        """Returns {job id: error} of the failed jobs."""
+        records = (self._read(os.path.join(self.path, "failed", name))
+                   for name in os.listdir(os.path.join(self.path, "failed")))
+        return {record["id"]: record["error"] for record in records if record is not None}
+
+    def stats(self, window=RATE_WINDOW):
+        """
+        Returns:
+            dict: Job counts by status, bytes done and remaining, and the throughput of the jobs
+                finished in the last window seconds (by every worker) with the ETA it gives.
+        """
+        now = time.time()
+        done = self._done_records()
+        failed = {name[:-5] for name in os.listdir(os.path.join(self.path, "failed"))}
+        stats = {status: 0 for status in ("pending", "running", "done", "failed")}
+        stats.update(done_bytes=0, remaining_bytes=0)
+        for name in os.listdir(os.path.join(self.path, "jobs")):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-5]
+            status = self._status(key, done, failed, now)
+            stats[status] += 1
+            if status == "done":
+                stats["done_bytes"] += done[key]["size"]
+            elif status in ("pending", "running"):
+                job = self._read(self._file("jobs", key))
+                stats["remaining_bytes"] += job["size"] if job else 0
+        stats["total"] = sum(stats[status] for status in ("pending", "running", "done", "failed"))
+        recent = [(r["started"], r["finished"], r["size"], r["audio_seconds"]) for r in done.values()
+                  if r["finished"] >= now - window]
+        stats.update(_rates(recent, stats["remaining_bytes"], now))
+        return stats
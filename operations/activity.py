@@ -0,0 +1,368 @@
+"""
+Voice activity detection, and processing of the active parts of a signal only.
+
+Interviews, lectures and surveillance recordings are often mostly silence or room
+tone, on which echo or reverb reduction and compression change little but cost as
+much as on speech. detect_activity segments a signal once, from the energy and
+spectral flux of short frames. An ActiveSpans then runs an operation on the active
+segments only (each widened by a margin), gives the inactive spans a cheap
+treatment instead, and crossfades at every boundary, so the cost of a stage
+follows the duration of speech rather than that of the file.
+"""
+import numpy as np
+
+# How inactive spans are treated: brought down towards the noise floor, replaced by comfort
+# noise at that level, or left as they are.
+INACTIVE_TREATMENTS = ("attenuate", "fill", "keep")
+
+# Frames analysed at a time, bounding the detector's scratch memory.
+_FRAMES_PER_BLOCK = 4096
+
+# Quantiles of the frame energies taken as the noise floor and as the level of loud speech.
+_FLOOR_QUANTILE = 10
+_LOUD_QUANTILE = 99
+
+
+class ActivityGate:
+    """
+    Settings of activity-gated processing: how activity is detected, and how the active
+    segments and inactive spans are processed (see AudioProcessor's activity_gate).
+    """
+
+    def __init__(self, threshold_db=6.0, range_db=40.0, frame_ms=20.0, margin_ms=200.0, min_gap_ms=300.0,
+                 min_active_ms=60.0, crossfade_ms=20.0, inactive="attenuate", inactive_gain_db=-6.0):
+        """
+        Parameters:
+            threshold_db (float): Frames this far above the noise floor are active; frames half as far
+                above it are active too when their spectral flux marks an onset.
+            range_db (float): Frames more than this far below loud speech are never active, however
+                low the noise floor (e.g. the residual noise left by noise reduction).
+            frame_ms (float): Analysis frame length in milliseconds.
+            margin_ms (float): Samples kept either side of every active run, so onsets and decaying
+                tails (and the reverb and echo after them) are processed.
+            min_gap_ms (float): Segments closer than this are merged.
+            min_active_ms (float): Shorter active runs (clicks, bumps) are ignored.
+            crossfade_ms (float): Length of the crossfade at every segment boundary.
+            inactive (str): Treatment of the inactive spans, one of INACTIVE_TREATMENTS.
+            inactive_gain_db (float): Level of the inactive spans relative to the noise floor after
+                "attenuate" (spans already quieter are left alone) or "fill".
+        """
+        if inactive not in INACTIVE_TREATMENTS:
+            raise ValueError(f"Unknown treatment of inactive spans: {inactive}")
+        self.threshold_db = threshold_db
+        self.range_db = range_db
+        self.frame_ms = frame_ms
+        self.margin_ms = margin_ms
+        self.min_gap_ms = min_gap_ms
+        self.min_active_ms = min_active_ms
+        self.crossfade_ms = crossfade_ms
+        self.inactive = inactive
+        self.inactive_gain_db = inactive_gain_db
+
+    def settings(self):
+        """The settings as a dict, e.g. to key results processed with them."""
+        return dict(vars(self))
+
+    def detect(self, audio_data, sample_rate):
+        """Returns the ActivityMap of a signal with these settings."""
+        return detect_activity(audio_data, sample_rate, self.threshold_db, self.range_db, self.frame_ms,
+                               self.margin_ms, self.min_gap_ms, self.min_active_ms)
+
+
+class ActivityMap:
+    """
+    The active segments of a signal, as sorted, non-overlapping [start, stop) sample ranges,
+    with the levels they were detected at.
+    """
+
+    def __init__(self, segments, length, sample_rate, noise_floor_db, active_db):
+        """
+        Parameters:
+            segments: (n, 2) sample ranges.
+            length (int): Samples per channel of the signal.
+            sample_rate (int): Its sampling rate.
+            noise_floor_db (float): Noise floor: mean power per sample of the inactive spans, in dB.
+            active_db (float): Mean power of the active segments in dB.
+        """
+        self.segments = np.asarray(segments, dtype=np.int64).reshape(-1, 2)
+        self.length = int(length)
+        self.sample_rate = int(sample_rate)
+        self.noise_floor_db = float(noise_floor_db)
+        self.active_db = float(active_db)
+
+    def active_samples(self):
+        """Samples per channel inside the active segments."""
+        return int((self.segments[:, 1] - self.segments[:, 0]).sum())
+
+    def active_fraction(self):
+        """Share of the signal inside the active segments."""
+        return self.active_samples() / self.length if self.length else 0.0
+
+    def gaps(self):
+        """
+        The inactive spans as (n + 1, 2) sample ranges: before the first segment, between every
+        two, and after the last. Some may be empty.
+        """
+        return np.concatenate([[0], self.segments.ravel(), [self.length]]).reshape(-1, 2)
+
+    def excerpt(self, start, stop):
+        """The map of samples [start, stop) of the signal, with the same levels."""
+        segments = np.clip(self.segments, start, stop) - start
+        segments = segments[segments[:, 1] > segments[:, 0]]
+        return ActivityMap(segments, stop - start, self.sample_rate, self.noise_floor_db, self.active_db)
+
+    def to_dict(self):
+        """A JSON-serializable form, read back by from_dict."""
+        return {"segments": self.segments.tolist(), "length": self.length, "sample_rate": self.sample_rate,
+                "noise_floor_db": self.noise_floor_db, "active_db": self.active_db}
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(values["segments"], values["length"], values["sample_rate"], values["noise_floor_db"],
+                   values["active_db"])
+
+
+def _power_db(channels, ranges):
+    # Mean power per sample of a (channels, samples) signal over the given sample ranges, in dB.
+    total = count = 0.0
+    for start, stop in ranges:
+        piece = channels[:, start:stop]
+        total += float(np.einsum("ij,ij->", piece, piece, dtype=np.float64))
+        count += piece.size
+    return 10 * np.log10(total / count + 1e-12) if count else -120.0
+
+
+def detect_activity(audio_data, sample_rate, threshold_db=6.0, range_db=40.0, frame_ms=20.0, margin_ms=200.0,
+                    min_gap_ms=300.0, min_active_ms=60.0):
+    """
+    Segments a signal into active and inactive parts.
+
+    The signal is cut into non-overlapping frames, and every frame's energy and spectral flux
+    (the mean rise of its log spectrum over the previous frame) are computed in vectorized
+    blocks. The noise floor is a low quantile of the frame energies. Frames threshold_db above
+    it, and no more than range_db below loud speech (a high quantile), are active, and so are
+    frames half as far above that level whose flux stands out from the typical flux (onsets of
+    quiet speech). Runs shorter than min_active_ms are dropped, the
+    rest are widened by margin_ms either side, and segments closer than min_gap_ms are merged.
+    Channels are detected together, from their mean power.
+
+    Parameters:
+        audio_data (np.ndarray): 1D or (channels, samples) signal.
+        sample_rate (int): Sampling rate of the signal.
+        The other parameters are described in ActivityGate.
+
+    Returns:
+        ActivityMap: The active segments.
+    """
+    length = audio_data.shape[-1]
+    channels = audio_data.reshape(-1, length)
+    frame = max(16, round(sample_rate * frame_ms / 1000))
+    n_frames = -(-length // frame)
+    energy = np.zeros(n_frames)
+    flux = np.zeros(n_frames)
+    window = np.hanning(frame).astype(np.float32)
+    previous = None
+    for first in range(0, n_frames, _FRAMES_PER_BLOCK):
+        last = min(n_frames, first + _FRAMES_PER_BLOCK)
+        frames = np.zeros((len(channels), (last - first) * frame), dtype=np.float32)
+        piece = channels[:, first * frame:last * frame]
+        frames[:, :piece.shape[1]] = piece
+        frames = frames.reshape(len(channels), last - first, frame)
+        energy[first:last] = np.einsum("cfn,cfn->f", frames, frames, dtype=np.float64) / (frame * len(channels))
+        spectrum = np.log10(np.abs(np.fft.rfft(frames * window, axis=-1)).mean(axis=0) + 1e-6)
+        rise = np.diff(spectrum, axis=0, prepend=spectrum[:1] if previous is None else previous[None])
+        flux[first:last] = np.maximum(rise, 0).mean(axis=1)
+        previous = spectrum[-1]
+    energy_db = 10 * np.log10(energy + 1e-12)
+
+    floor_db, loud_db = np.percentile(energy_db, (_FLOOR_QUANTILE, _LOUD_QUANTILE)) if n_frames else (-120.0, -120.0)
+    level_db = max(floor_db + threshold_db, loud_db - range_db)
+    median = np.median(flux) if n_frames else 0.0
+    onset = median + 3 * 1.4826 * np.median(np.abs(flux - median)) if n_frames else 0.0
+    active = (energy_db > level_db) | ((flux > onset) & (energy_db > level_db - threshold_db / 2))
+
+    edges = np.diff(np.concatenate([[0], active.astype(np.int8), [0]]))
+    starts, stops = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    keep = stops - starts >= max(1, round(min_active_ms / frame_ms))
+    margin = round(sample_rate * margin_ms / 1000)
+    starts = np.maximum(starts[keep] * frame - margin, 0)
+    stops = np.minimum(stops[keep] * frame + margin, length)
+    if len(starts):
+        # Segments that overlap after widening, or are closer than min_gap, are merged.
+        apart = starts[1:] - stops[:-1] >= round(sample_rate * min_gap_ms / 1000)
+        starts = np.concatenate([starts[:1], starts[1:][apart]])
+        stops = np.concatenate([stops[:-1][apart], stops[-1:]])
+    segments = np.stack([starts, stops], axis=1)
+    gaps = [(start, stop) for start, stop in np.concatenate([[0], segments.ravel(), [length]]).reshape(-1, 2)
+            if stop > start]
+    # The noise floor the inactive spans are treated against is their own mean level.
+    if gaps:
+        floor_db = _power_db(channels, gaps)
+    return ActivityMap(segments, length, sample_rate, floor_db, _power_db(channels, segments))
+
+
+class ActiveSpans:
+    """
+    Processing of the active segments of one signal, given its ActivityMap.
+
+    Every active segment is run through the operation on its own; every inactive span gets the
+    gate's treatment. Over crossfade_ms at each segment boundary inside the signal, the processed
+    segment fades in from (and out to) the treated input, with a raised-cosine ramp.
+
+    The treatment follows the level of the signal it is built for: "attenuate" brings each
+    inactive span down to inactive_gain_db below the noise floor, shifted by however much the
+    active level has changed since detection (e.g. by normalization), and "fill" replaces the
+    spans with white noise at that level. Treating a signal twice therefore changes it no further,
+    so every gated step of a chain can treat its input.
+    """
+
+    def __init__(self, activity, gate, audio_data):
+        """
+        Parameters:
+            activity (ActivityMap): Segments of audio_data.
+            gate (ActivityGate): Settings of the treatment and crossfades.
+            audio_data (np.ndarray): The signal to be processed, 1D or (channels, samples), measured
+                for the treatment.
+        """
+        self.activity = activity
+        self.gate = gate
+        self.crossfade_samples = max(1, round(activity.sample_rate * gate.crossfade_ms / 1000))
+        channels = audio_data.reshape(-1, audio_data.shape[-1])
+        target_db = activity.noise_floor_db + gate.inactive_gain_db
+        if len(activity.segments):
+            target_db += _power_db(channels, activity.segments) - activity.active_db
+        self.target_rms = 10 ** (target_db / 20)
+        self.gains = np.ones(len(activity.segments) + 1)
+        if gate.inactive == "attenuate":
+            for index, (start, stop) in enumerate(activity.gaps()):
+                if stop > start:
+                    rms = 10 ** (_power_db(channels, [(start, stop)]) / 20)
+                    self.gains[index] = min(1.0, self.target_rms / rms)
+        # Piece boundaries: pieces 0, 2, 4... are inactive spans, pieces 1, 3, 5... active segments.
+        self._bounds = np.concatenate([[0], activity.segments.ravel(), [activity.length]])
+
+    def pieces(self, start, stop):
+        """
+        Yields (active, index, piece start, piece stop) for the non-empty pieces of [start, stop):
+        active segment or inactive span number index.
+        """
+        j = int(np.searchsorted(self._bounds, start, side="right")) - 1
+        while start < stop:
+            end = min(int(self._bounds[j + 1]), stop)
+            if end > start:
+                yield j % 2 == 1, j // 2, start, end
+            start = end
+            j += 1
+
+    def treat(self, audio_data, gap, start, out):
+        """Writes the treatment of inactive span gap into out; audio_data starts at sample start."""
+        if self.gate.inactive == "fill":
+            noise = np.random.default_rng(start).standard_normal(audio_data.shape, dtype=np.float32)
+            np.multiply(noise, self.target_rms, out=out, casting="unsafe")
+        elif self.gate.inactive == "attenuate":
+            np.multiply(audio_data, self.gains[gap], out=out, casting="unsafe")
+        elif out is not audio_data:
+            np.copyto(out, audio_data, casting="unsafe")
+
+    def _fades(self, segment, start, stop):
+        # (fade start, fade stop, inactive span, rising) ramps of segment that overlap [start, stop).
+        first, last = (int(v) for v in self.activity.segments[segment])
+        length = min(self.crossfade_samples, (last - first) // 2)
+        fades = []
+        if first > 0 and length:
+            fades.append((first, first + length, segment, True))
+        if last < self.activity.length and length:
+            fades.append((last - length, last, segment + 1, False))
+        return [(max(a, start), min(b, stop), gap, rising, a, b) for a, b, gap, rising in fades
+                if max(a, start) < min(b, stop)]
+
+    def save_fades(self, segment, start, audio_data):
+        """
+        Returns the input of the crossfades of segment in audio_data (which starts at sample
+        start), to be passed to crossfade once the piece is processed.
+        """
+        stop = start + audio_data.shape[-1]
+        return [(fade, audio_data[..., fade[0] - start:fade[1] - start].copy())
+                for fade in self._fades(segment, start, stop)]
+
+    def crossfade(self, saved, start, out):
+        """Fades the processed piece in out (starting at sample start) from and to the treated input."""
+        for (a, b, gap, rising, first, last), original in saved:
+            treated = np.empty(original.shape, dtype=np.float32)
+            self.treat(original, gap, a, treated)
+            ramp = (np.arange(a, b) - first + 0.5) / (last - first)
+            weight = (0.5 - 0.5 * np.cos(np.pi * (ramp if rising else 1 - ramp))).astype(np.float32)
+            piece = out[..., a - start:b - start]
+            np.subtract(piece, treated, out=piece, casting="unsafe")
+            np.multiply(piece, weight, out=piece)
+            np.add(piece, treated, out=piece)
+
+    def run(self, audio_data, process, out=None, progress=None):
+        """
+        Processes a whole signal: process on every active segment, the treatment elsewhere.
+
+        Parameters:
+            audio_data (np.ndarray): The signal this ActiveSpans was built for.
+            process (callable): process(segment, progress) -> the processed segment, of the same shape.
+            out (np.ndarray, optional): float32 array for the result (default: a new one); it may
+                be audio_data.
+            progress (callable, optional): Called as progress(done, total) over the active samples.
+
+        Returns:
+            np.ndarray: out.
+        """
+        if out is None:
+            out = np.empty(audio_data.shape, dtype=np.float32)
+        total = max(self.activity.active_samples(), 1)
+        done = 0
+        for active, index, start, stop in self.pieces(0, audio_data.shape[-1]):
+            if not active:
+                self.treat(audio_data[..., start:stop], index, start, out[..., start:stop])
+                continue
+            segment = np.ascontiguousarray(audio_data[..., start:stop])
+            saved = self.save_fades(index, start, segment)
+            reported = None if progress is None else (
+                lambda d, t, offset=done, size=stop - start: progress(offset + size * d / max(t, 1), total))
+            np.copyto(out[..., start:stop], process(segment, reported), casting="unsafe")
+            self.crossfade(saved, start, out[..., start:stop])
+            done += stop - start
+            if progress is not None:
+                progress(done, total)
+        return out
+
+
+class GatedStage:
+    """
+    A pointwise stage (see operations.pointwise.PointwiseChain) applied to the active segments
+    of a signal only, with the treatment of ActiveSpans elsewhere. The signal must be passed
+    through in order, from its first sample; a stateful stage carries its state from the end
+    of one segment to the start of the next.
+    """
+
+    latency = 0
+
+    def __init__(self, stage, spans):
+        """
+        Parameters:
+            stage: Stage with process(block, out=None) and zero latency.
+            spans (ActiveSpans): Segments and treatment of the signal.
+        """
+        self.stage = stage
+        self.spans = spans
+        self.position = 0
+
+    def process(self, audio_data, out=None):
+        if out is None:
+            out = np.empty(audio_data.shape, dtype=np.float32)
+        start = self.position
+        for active, index, first, last in self.spans.pieces(start, start + audio_data.shape[-1]):
+            piece = audio_data[..., first - start:last - start]
+            target = out[..., first - start:last - start]
+            if not active:
+                self.spans.treat(piece, index, first, target)
+                continue
+            saved = self.spans.save_fades(index, first, piece)
+            self.stage.process(piece, out=target)
+            self.spans.crossfade(saved, first, target)
+        self.position = start + audio_data.shape[-1]
+        return out
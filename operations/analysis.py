@@ -0,0 +1,224 @@
+"""
+Fast analysis of a recording, measured block by block in one pass.
+
+A FileAnalyzer meters what decides whether a processing stage is needed on a file, and how
+to set it up: integrated loudness and true peak (with a LoudnessMeter), crest factor, the
+noise floor and the signal-to-noise ratio (from the energies of short frames), an estimate
+of the reverberation time (from the free decays of those energies), and the delay of a
+discrete echo (from the autocorrelation of the signal).
+
+The echo delay is found in the autocorrelation averaged over long frames of the signal,
+partly whitened by its spectrum smoothed over SMOOTHING_HZ, so the formants and pitch of
+speech, which vary from frame to frame, average out while an echo, always at the same delay,
+adds up to a peak. Whitening only partly keeps bands of background noise, which carry no
+echo, from outweighing the speech. The reverberation time follows from the steepest decays
+of the frame energies: speech can stop abruptly, but the room cannot decay faster than its
+reverberation allows.
+"""
+import numpy as np
+
+from operations.loudness import LoudnessMeter
+
+# Length of the frames whose energies give the noise floor, SNR and reverberation time.
+FRAME_MS = 10.0
+
+# Quantile of the frame energies taken as the noise floor (as operations.activity does).
+FLOOR_QUANTILE = 10
+
+# Frames this far above the noise floor count as signal for the SNR and decay fits.
+SIGNAL_MARGIN_DB = 6.0
+
+# Decays are fitted over windows of this many frames; a window counts as a free decay when the
+# energy falls along a line with a correlation below -DECAY_CORRELATION.
+DECAY_FRAMES = 20
+DECAY_CORRELATION = 0.9
+# Percentile of the decay rates taken as the room's, and the fewest decays to estimate it from.
+DECAY_PERCENTILE = 10
+MIN_DECAYS = 5
+
+# Range of echo delays searched, in milliseconds, above the pitch periods of speech.
+MIN_ECHO_MS = 20.0
+MAX_ECHO_MS = 500.0
+
+# Width of the spectral smoothing that whitens the autocorrelation; it averages out the ripple
+# of every echo at MIN_ECHO_MS or longer, so whitening keeps them. The power spectrum is divided
+# by the smoothed one raised to WHITENING (1 would flatten it completely).
+SMOOTHING_HZ = 2000.0 / MIN_ECHO_MS
+WHITENING = 0.5
+
+# Normalized autocorrelation peak above which an echo is reported.
+ECHO_THRESHOLD = 0.12
+
+# Floor of every level in dB, for digital silence.
+_SILENCE_DB = -120.0
+
+
+def _db(power):
+    return float(max(10 * np.log10(max(power, 1e-30)), _SILENCE_DB))
+
+
+def echo_frame_length(sample_rate, max_echo_ms=MAX_ECHO_MS):
+    """Samples per frame of the echo autocorrelation: a power of two of at least twice the longest delay."""
+    return 1 << int(np.ceil(np.log2(2 * sample_rate * max_echo_ms / 1000)))
+
+
+def estimate_echo(power, sample_rate, window, min_echo_ms=MIN_ECHO_MS, max_echo_ms=MAX_ECHO_MS):
+    """
+    Finds the strongest echo in a summed power spectrum.
+
+    Parameters:
+        power (np.ndarray): Power spectra of windowed frames, zero-padded to twice their length, summed.
+        sample_rate (int): Sampling rate of the audio.
+        window (np.ndarray): The window the frames were multiplied by.
+        min_echo_ms (float): Shortest delay searched.
+        max_echo_ms (float): Longest delay searched.
+
+    Returns:
+        tuple: (delay in ms, normalized autocorrelation at that delay).
+    """
+    n = 2 * (len(power) - 1)
+    bins = max(1, int(round(SMOOTHING_HZ * n / sample_rate)))
+    envelope = np.convolve(power, np.ones(bins) / bins, mode="same")
+    correlation = np.fft.irfft(power / np.maximum(envelope, 1e-30) ** WHITENING, n)
+    # Undo the window's own autocorrelation, which tapers long lags.
+    taper = np.fft.irfft(np.abs(np.fft.rfft(window, n)) ** 2, n)
+    low = int(sample_rate * min_echo_ms / 1000)
+    high = min(int(sample_rate * max_echo_ms / 1000), len(window) // 2)
+    if high <= low or correlation[0] <= 0:
+        return None, 0.0
+    lags = correlation[low:high] / correlation[0] * (taper[0] / taper[low:high])
+    peak = int(np.argmax(lags))
+    return (low + peak) * 1000 / sample_rate, float(lags[peak])
+
+
+def estimate_reverb_time(frame_db, frame_seconds, floor_db):
+    """
+    Estimates the reverberation time (RT60) from the energies of consecutive frames.
+
+    Parameters:
+        frame_db (np.ndarray): Frame energies in dB.
+        frame_seconds (float): Length of a frame.
+        floor_db (float): Noise floor; decays must stay SIGNAL_MARGIN_DB above it.
+
+    Returns:
+        float or None: Seconds for a 60 dB decay, or None with fewer than MIN_DECAYS free decays.
+    """
+    if len(frame_db) < DECAY_FRAMES:
+        return None
+    times = np.arange(DECAY_FRAMES) * frame_seconds
+    times -= times.mean()
+    windows = np.lib.stride_tricks.sliding_window_view(frame_db, DECAY_FRAMES)
+    centred = windows - windows.mean(axis=1, keepdims=True)
+    covariance = centred @ times
+    slopes = covariance / (times @ times)
+    correlation = covariance / np.sqrt((centred ** 2).sum(axis=1) * (times @ times) + 1e-12)
+    decays = slopes[(correlation < -DECAY_CORRELATION) & (windows.min(axis=1) > floor_db + SIGNAL_MARGIN_DB)]
+    if len(decays) < MIN_DECAYS:
+        return None
+    return float(-60 / np.percentile(decays, DECAY_PERCENTILE))
+
+
+class FileAnalyzer:
+    """
+    Analysis of a signal fed block by block (1D, or (channels, samples) blocks); see the module
+    docstring. Energies, the echo and the reverberation are measured on the mix of the channels.
+    """
+
+    def __init__(self, sample_rate):
+        """
+        Parameters:
+            sample_rate (int): Sampling rate of the audio.
+        """
+        self.sample_rate = sample_rate
+        self.meter = LoudnessMeter(sample_rate, true_peak=True)
+        self.channels = None
+        self.samples = 0
+        self._sum_squares = 0.0
+        self._frame = max(1, int(sample_rate * FRAME_MS / 1000))
+        self._frame_power = []
+        self._echo_frame = echo_frame_length(sample_rate)
+        self._window = np.hanning(self._echo_frame)
+        self._power = np.zeros(self._echo_frame + 1)
+        self._echo_frames = 0
+        # Mixed samples not yet in a whole frame, for the energies and for the echo.
+        self._pending = np.zeros(0)
+        self._echo_pending = np.zeros(0)
+
+    def _add_echo_frame(self, frame):
+        spectrum = np.fft.rfft(frame * self._window, 2 * self._echo_frame)
+        self._power += spectrum.real ** 2 + spectrum.imag ** 2
+        self._echo_frames += 1
+
+    def update(self, audio_data):
+        """Adds the next block of the signal."""
+        self.meter.update(audio_data)
+        if self.channels is None:
+            self.channels = 1 if audio_data.ndim == 1 else audio_data.shape[0]
+        block = np.asarray(audio_data, dtype=np.float64)
+        self.samples += block.shape[-1]
+        self._sum_squares += float(np.vdot(block, block))
+        mono = block if block.ndim == 1 else block.mean(axis=0)
+
+        pending = np.concatenate((self._pending, mono))
+        whole = len(pending) - len(pending) % self._frame
+        frames = pending[:whole].reshape(-1, self._frame)
+        self._frame_power.append(np.einsum("ij,ij->i", frames, frames) / self._frame)
+        self._pending = pending[whole:]
+
+        pending = np.concatenate((self._echo_pending, mono))
+        size = self._echo_frame
+        for start in range(0, len(pending) - size + 1, size):
+            self._add_echo_frame(pending[start:start + size])
+        self._echo_pending = pending[len(pending) - len(pending) % size:]
+
+    def measurements(self):
+        """
+        Returns:
+            dict: integrated_lufs, true_peak_dbtp, rms_db, crest_factor_db, noise_floor_db, snr_db,
+                rt60_seconds (None without enough free decays), echo_delay_ms (None without an echo
+                above ECHO_THRESHOLD), echo_strength, duration_seconds, sample_rate and channels.
+        """
+        rms_db = _db(self._sum_squares / (self.samples * self.channels)) if self.samples else _SILENCE_DB
+        peak_db = _db(self.meter.sample_peak ** 2)
+        power = np.concatenate(self._frame_power) if self._frame_power else np.zeros(0)
+        frame_db = 10 * np.log10(np.maximum(power, 10 ** (_SILENCE_DB / 10)))
+        floor_db = float(np.percentile(frame_db, FLOOR_QUANTILE)) if len(frame_db) else _SILENCE_DB
+        signal = power[frame_db > floor_db + SIGNAL_MARGIN_DB]
+        snr_db = _db(float(signal.mean())) - floor_db if len(signal) else 0.0
+
+        echo_power = self._power
+        if not self._echo_frames and len(self._echo_pending):
+            # Shorter than one echo frame: use what there is.
+            echo_power = self._power.copy()
+            spectrum = np.fft.rfft(self._echo_pending * self._window[:len(self._echo_pending)],
+                                   2 * self._echo_frame)
+            echo_power += spectrum.real ** 2 + spectrum.imag ** 2
+        delay, strength = estimate_echo(echo_power, self.sample_rate, self._window)
+
+        return {
+            "integrated_lufs": self.meter.integrated_loudness(),
+            "true_peak_dbtp": self.meter.true_peak(),
+            "rms_db": rms_db,
+            "crest_factor_db": peak_db - rms_db,
+            "noise_floor_db": floor_db,
+            "snr_db": snr_db,
+            "rt60_seconds": estimate_reverb_time(frame_db, FRAME_MS / 1000, floor_db),
+            "echo_delay_ms": round(delay, 1) if delay is not None and strength >= ECHO_THRESHOLD else None,
+            "echo_strength": strength,
+            "duration_seconds": self.samples / self.sample_rate,
+            "sample_rate": self.sample_rate,
+            "channels": self.channels or 1,
+        }
+
+
+def analyze(audio_data, sample_rate, block_size=65536):
+    """
+    Analyzes a whole signal (1D, or (channels, samples)) block by block.
+
+    Returns:
+        dict: See FileAnalyzer.measurements.
+    """
+    analyzer = FileAnalyzer(sample_rate)
+    for start in range(0, audio_data.shape[-1], block_size):
+        analyzer.update(audio_data[..., start:start + block_size])
+    return analyzer.measurements()
@@ -0,0 +1,81 @@
+"""
+Reusable work buffers for a chain of whole-buffer operations.
+
+Each whole-buffer stage reads one full-length array and writes another, so without
+reuse every stage allocates a new result (and often scratch arrays as large). A
+BufferArena keeps the arrays a chain is done with and lends them out again: a stage
+borrows a float32 result buffer (or a complex64 spectrogram) of the size it needs,
+writes into it with out=, and the buffer it read from goes back to the arena. Once
+the first file has been through the chain, later stages and later files of a
+similar length allocate nothing new, and peak memory stays a small multiple of the
+input size.
+"""
+import numpy as np
+
+
+class BufferArena:
+    """
+    Pool of byte buffers handed out as arrays of any shape and dtype.
+
+    borrow() returns a view of the smallest free buffer that is large enough, allocating
+    a new one only when none is; give_back() returns a borrowed array, or adopts any other
+    array the caller is done with (e.g. the decoded input). The arena keeps no reference
+    to lent buffers, so one that is never given back is simply freed. At most max_free
+    buffers are kept free; beyond that the smallest are dropped.
+
+    A borrowed array is uninitialized and must not be used after it is given back.
+    """
+
+    def __init__(self, max_free=4):
+        """
+        Parameters:
+            max_free (int): Free buffers kept for reuse.
+        """
+        self.max_free = max_free
+        self._free = []
+        self.allocated_bytes = 0
+
+    def borrow(self, shape, dtype=np.float32):
+        """
+        Returns an uninitialized C-contiguous array of the given shape and dtype.
+        """
+        dtype = np.dtype(dtype)
+        shape = tuple(np.atleast_1d(shape))
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        fitting = [i for i, buffer in enumerate(self._free) if len(buffer) >= nbytes]
+        if fitting:
+            buffer = self._free.pop(min(fitting, key=lambda i: len(self._free[i])))
+        else:
+            buffer = np.empty(nbytes, dtype=np.uint8)
+            self.allocated_bytes += nbytes
+        return buffer[:nbytes].view(dtype).reshape(shape)
+
+    def give_back(self, array):
+        """
+        Returns an array to the arena: the memory it views becomes free for the next borrow().
+        That is the buffer of a borrowed array; any other array whose memory is owned by a
+        C-contiguous NumPy array (e.g. a decoded input) is adopted. Memory not owned by NumPy
+        (e.g. a memory map) and None are ignored. The caller must be done with every view
+        of that memory.
+        """
+        if array is None:
+            return
+        owner = array
+        while isinstance(owner.base, np.ndarray):
+            owner = owner.base
+        if owner.base is not None or not owner.flags.c_contiguous:
+            return
+        buffer = owner.reshape(-1).view(np.uint8)
+        if any(np.may_share_memory(buffer, free) for free in self._free):
+            return
+        self._free.append(buffer)
+        if len(self._free) > self.max_free:
+            self._free.pop(min(range(len(self._free)), key=lambda i: len(self._free[i])))
+
+    def free_bytes(self):
+        """Bytes held in free buffers."""
+        return sum(len(buffer) for buffer in self._free)
+
+    def clear(self):
+        """Drops every free buffer; borrowed arrays stay valid."""
+        self._free = []
@@ -1,65 +1,395 @@
+"""
+Real-time audio visualizer: a scrolling waveform and a live spectrogram, following playback
+by the wall clock.
+
+Audio is never loaded whole. The input file is block-read as playback reaches it into a
+preallocated RingBuffer; the output of a streaming processing run arrives the same way through
+a PipelineTap, so the original and processed signals can be shown side by side while the file
+is being processed. Every timer tick computes how far playback should be from the time since
+it started, reads up to there and redraws; a slow tick is caught up on the next one instead
+of letting the view drift.
+
+The per-tick work reuses preallocated buffers: ring reads copy into fixed arrays, and the
+spectrogram windows, transforms and scales each frame in place into a double-width image, so
+the scrolled image is a view rather than a copy.
+
+Usage:
+    python -m operations.audio_visualization FILE
+    python -m operations.audio_visualization FILE --process "Noise Reduction" "Reverb Reduction" --output OUT.wav
+"""
+import argparse
 import sys
+import threading
+import time
+
 import numpy as np
 import pyqtgraph as pg
-from PyQt5 import QtWidgets, QtCore
 import soundfile as sf
+from PyQt5 import QtWidgets, QtCore
+from scipy.signal import get_window
+
+# Spectrogram levels shown, in dB relative to a full-scale sine.
+_FLOOR_DB = -100.0
+_CEILING_DB = 0.0
+
+
+class RingBuffer:
+    """
+    The last `capacity` samples of a stream, in a preallocated (channels, capacity) float32 array.
+
+    `written` counts every sample written since the start, so samples are addressed by their
+    position in the stream.
+    """
+
+    def __init__(self, capacity, channels=1):
+        self.capacity = capacity
+        self.data = np.zeros((channels, capacity), dtype=np.float32)
+        self.written = 0
+
+    def write(self, block):
+        """Appends a (channels, samples) block; only its last `capacity` samples are kept."""
+        size = block.shape[-1]
+        if size > self.capacity:
+            self.written += size - self.capacity
+            block = block[:, size - self.capacity:]
+            size = self.capacity
+        start = self.written % self.capacity
+        first = min(size, self.capacity - start)
+        self.data[:, start:start + first] = block[:, :first]
+        self.data[:, :size - first] = block[:, first:]
+        self.written += size
+
+    def read(self, end, out):
+        """
+        Copies the samples at positions [end - n, end) into out, a (channels, n) array.
+        Positions no longer held, or not written yet, read as zeros.
+        """
+        size = out.shape[-1]
+        start = end - size
+        low = max(start, self.written - self.capacity, 0)
+        high = min(end, self.written)
+        if high <= low:
+            out[:] = 0.0
+            return out
+        out[:, :low - start] = 0.0
+        out[:, high - start:] = 0.0
+        # The held range wraps around the end of the array at most once.
+        first = low % self.capacity
+        count = min(high - low, self.capacity - first)
+        out[:, low - start:low - start + count] = self.data[:, first:first + count]
+        out[:, low - start + count:high - start] = self.data[:, :high - low - count]
+        return out
+
+
+class FileSource:
+    """An audio file read block by block into a RingBuffer as playback reaches it."""
+
+    def __init__(self, filepath, history, block_size=4096):
+        """
+        Parameters:
+            filepath (str): Audio file readable by libsndfile.
+            history (int): Samples before the playback position that must stay readable.
+            block_size (int): Samples read from the file at a time.
+        """
+        self._file = sf.SoundFile(filepath)
+        self.sample_rate = self._file.samplerate
+        self.channels = self._file.channels
+        self.frames = self._file.frames
+        self._scratch = np.empty((block_size, self.channels), dtype=np.float32)
+        self.ring = RingBuffer(history + block_size, self.channels)
+
+    def advance(self, position):
+        """Reads the file up to `position`; returns the end of the samples available."""
+        target = min(position, self.frames)
+        if target - self.ring.written > self.ring.capacity:
+            # After a long stall, skip what would be overwritten before it is shown.
+            self._file.seek(target - self.ring.capacity)
+            self.ring.written = target - self.ring.capacity
+        while self.ring.written < target:
+            size = min(len(self._scratch), target - self.ring.written)
+            block = self._file.read(dtype="float32", out=self._scratch[:size])
+            if not len(block):
+                self.frames = self.ring.written
+                break
+            self.ring.write(block.T)
+        return self.ring.written
+
+    def finished(self, position):
+        """True once playback has passed the end of the file."""
+        return position >= self.frames
+
+    def read(self, end, out):
+        return self.ring.read(end, out)
+
+    def close(self):
+        self._file.close()
+
+
+class PipelineTap:
+    """
+    The output of a streaming processing run, received block by block into a RingBuffer.
+
+    Pass feed as the monitor of AudioProcessor.process_file_streaming. A run that gets more
+    than `lead` samples ahead of playback is held back until playback catches up, so no block
+    is overwritten before it has been shown; close() releases it for good.
+    """
+
+    def __init__(self, channels, history, lead=1 << 17):
+        """
+        Parameters:
+            channels (int): Channel count of the processed audio.
+            history (int): Samples before the playback position that must stay readable.
+            lead (int): Samples the run may get ahead of playback.
+        """
+        self.ring = RingBuffer(history + lead, channels)
+        self._lead = lead
+        self._position = 0
+        self._done = False
+        self._closed = False
+        self._ready = threading.Condition()
+
+    def feed(self, block):
+        """Adds the next block of output, 1D or (channels, samples)."""
+        if block.ndim == 1:
+            block = block[np.newaxis]
+        start = 0
+        with self._ready:
+            while start < block.shape[-1] and not self._closed:
+                room = self._position + self._lead - self.ring.written
+                if room <= 0:
+                    self._ready.wait()
+                    continue
+                size = min(room, block.shape[-1] - start)
+                self.ring.write(block[:, start:start + size])
+                start += size
+
+    def finish(self):
+        """Marks the end of the output."""
+        with self._ready:
+            self._done = True
+
+    def advance(self, position):
+        """Moves playback to `position`; returns the end of the samples available."""
+        with self._ready:
+            self._position = position
+            self._ready.notify_all()
+            return min(position, self.ring.written)
+
+    def finished(self, position):
+        """True once the run is over and playback has passed the end of its output."""
+        with self._ready:
+            return self._done and position >= self.ring.written
+
+    def read(self, end, out):
+        with self._ready:
+            return self.ring.read(end, out)
+
+    def close(self):
+        """Stops holding back the run; later blocks are dropped."""
+        with self._ready:
+            self._closed = True
+            self._ready.notify_all()
+
+
+class LiveSpectrogram:
+    """
+    Scrolling spectrogram of a stream, one column per hop.
+
+    The window, frame, spectrum and magnitude buffers are allocated once, and every frame is
+    windowed, transformed (numpy's FFT reuses its cached plan for the fixed size; only its
+    small result is a new array) and scaled to dB in place. Columns are written twice into an image twice the visible width, so the
+    visible part is always one contiguous slice of it.
+    """
+
+    def __init__(self, channels, n_fft=1024, hop_length=256, columns=400):
+        """
+        Parameters:
+            channels (int): Channel count of the stream; the channels are averaged.
+            n_fft (int): FFT size.
+            hop_length (int): Samples between columns.
+            columns (int): Columns shown.
+        """
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.columns = columns
+        bins = n_fft // 2 + 1
+        # Scaled so a full-scale sine reads 0 dB.
+        self._window = (get_window("hann", n_fft) * 2 / get_window("hann", n_fft).sum()).astype(np.float32)
+        self._frames = np.empty((channels, n_fft), dtype=np.float32)
+        self._frame = np.empty(n_fft, dtype=np.float32)
+        self._spectrum = np.empty(bins, dtype=np.complex64)
+        self._magnitude = np.empty(bins, dtype=np.float32)
+        self._image = np.full((2 * columns, bins), _FLOOR_DB, dtype=np.float32)
+        self._column = 0
+        # End position of the next frame.
+        self._next_end = n_fft
+
+    def update(self, source, end):
+        """Adds a column for every frame of source ending by `end` (only the last `columns` are computed)."""
+        behind = (end - self._next_end) // self.hop_length + 1
+        if behind > self.columns:
+            self._next_end += (behind - self.columns) * self.hop_length
+        while self._next_end <= end:
+            source.read(self._next_end, self._frames)
+            np.mean(self._frames, axis=0, out=self._frame)
+            np.multiply(self._frame, self._window, out=self._frame)
+            # rfft's out= needs NumPy 2; the spectrum is a few KB, so it is copied in instead.
+            self._spectrum[:] = np.fft.rfft(self._frame)
+            np.abs(self._spectrum, out=self._magnitude)
+            np.maximum(self._magnitude, 10 ** (_FLOOR_DB / 20), out=self._magnitude)
+            np.log10(self._magnitude, out=self._magnitude)
+            self._magnitude *= 20
+            self._image[self._column] = self._magnitude
+            self._image[self._column + self.columns] = self._magnitude
+            self._column = (self._column + 1) % self.columns
+            self._next_end += self.hop_length
+
+    @property
+    def image(self):
+        """The visible (columns, bins) image in dB, oldest column first."""
+        return self._image[self._column:self._column + self.columns]
+
+
+class _View:
+    # One signal: its source, a waveform plot and a spectrogram image.
+
+    def __init__(self, layout, column, title, source, channels, sample_rate, window, n_fft, hop_length):
+        self.source = source
+        self._wave = np.empty((channels, window), dtype=np.float32)
+        self._mono = np.empty(window, dtype=np.float32)
+        self._times = np.arange(-window, 0, dtype=np.float32) / sample_rate
+
+        plot = layout.addPlot(row=0, col=column, title=title)
+        plot.setYRange(-1, 1)
+        plot.setLabel("bottom", "Time", units="s")
+        plot.setDownsampling(auto=True, mode="peak")
+        plot.setClipToView(True)
+        self._curve = plot.plot(pen="c")
+
+        self.spectrogram = LiveSpectrogram(channels, n_fft, hop_length,
+                                           columns=max(1, window // hop_length))
+        spectrum_plot = layout.addPlot(row=1, col=column)
+        spectrum_plot.setLabel("left", "Frequency", units="Hz")
+        self._image = pg.ImageItem(axisOrder="col-major")
+        self._image.setLookupTable(pg.colormap.get("inferno").getLookupTable())
+        spectrum_plot.addItem(self._image)
+        self._image.setRect(QtCore.QRectF(-window / sample_rate, 0, window / sample_rate, sample_rate / 2))
+
+    def update(self, position):
+        end = self.source.advance(position)
+        self.source.read(end, self._wave)
+        np.mean(self._wave, axis=0, out=self._mono)
+        self._curve.setData(self._times, self._mono)
+        self.spectrogram.update(self.source, end)
+        self._image.setImage(self.spectrogram.image, autoLevels=False, levels=(_FLOOR_DB, _CEILING_DB))
+
 
 class AudioVisualizer(QtWidgets.QMainWindow):
-    def __init__(self, audio_file, chunk_size=1024, update_interval=100):
+    def __init__(self, audio_file, processed=None, window_seconds=2.0, update_interval=30, n_fft=1024,
+                 hop_length=256):
         """
         Initializes the real-time audio visualizer.
-        
+
         Parameters:
             audio_file (str): Path to the audio file to visualize.
-            chunk_size (int): Number of samples to update per timer tick.
+            processed (PipelineTap, optional): Output of a processing run of audio_file, shown
+                next to the original (see watch_processing).
+            window_seconds (float): Length of audio shown.
             update_interval (int): Update interval in milliseconds.
+            n_fft (int): FFT size of the spectrogram.
+            hop_length (int): Samples between spectrogram columns.
         """
         super().__init__()
         self.setWindowTitle("Real-time Audio Visualization")
-        
-        # Create a PlotWidget for visualization.
-        self.plot_widget = pg.PlotWidget()
-        self.setCentralWidget(self.plot_widget)
-        self.plot_widget.setYRange(-1, 1)
-        self.plot = self.plot_widget.plot()
-        
-        # Load the audio file.
-        self.audio_data, self.sample_rate = sf.read(audio_file)
-        if self.audio_data.ndim > 1:
-            self.audio_data = self.audio_data[:, 0]
-        if self.audio_data.size == 0:
+
+        original = FileSource(audio_file, history=int(window_seconds * sf.info(audio_file).samplerate) + n_fft)
+        if original.frames == 0:
+            original.close()
             raise ValueError("Audio data is empty.")
-        
-        print("Audio length in samples:", len(self.audio_data))
-        
-        self.chunk_size = chunk_size
-        self.ptr = 0
-        
-        # Setup a timer to update the plot.
+        self.sample_rate = original.sample_rate
+        window = int(window_seconds * self.sample_rate)
+
+        layout = pg.GraphicsLayoutWidget()
+        self.setCentralWidget(layout)
+        sources = [("Original", original)] + ([("Processed", processed)] if processed is not None else [])
+        self.views = [_View(layout, column, title, source, original.channels, self.sample_rate, window, n_fft,
+                            hop_length)
+                      for column, (title, source) in enumerate(sources)]
+
+        self._started = None
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self.update_plot)
         self.timer.start(update_interval)
 
+    def position(self):
+        """Playback position in samples, from the time since the first update."""
+        now = time.perf_counter()
+        if self._started is None:
+            self._started = now
+        return int((now - self._started) * self.sample_rate)
+
     def update_plot(self):
         """
-        Updates the plot with the next chunk of audio data.
+        Reads every source up to the current playback position and redraws.
         """
-        if self.ptr < len(self.audio_data):
-            # Get the next chunk of samples.
-            chunk = self.audio_data[self.ptr:self.ptr+self.chunk_size]
-            # Update the plot.
-            self.plot.setData(chunk)
-            self.ptr += self.chunk_size
-            print("Pointer:", self.ptr)  # Debug print
-        else:
+        position = self.position()
+        for view in self.views:
+            view.update(position)
+        if all(view.source.finished(position) for view in self.views):
             self.timer.stop()
-            print("Visualization finished.")
 
-def main():
+    def closeEvent(self, event):
+        self.timer.stop()
+        for view in self.views:
+            view.source.close()
+        super().closeEvent(event)
+
+
+def watch_processing(audio_file, output_path, operations, processor=None, window_seconds=2.0, n_fft=1024):
+    """
+    Starts processing audio_file in streaming mode on a background thread and returns a
+    PipelineTap receiving its output, for the Processed view of an AudioVisualizer.
+
+    Parameters:
+        audio_file (str): File to process.
+        output_path (str): Where the result is written.
+        operations (list): Operation names.
+        processor (AudioProcessor, optional): Processor to run with (default: a new one).
+        window_seconds (float): Length of audio the visualizer shows.
+        n_fft (int): FFT size of the visualizer's spectrogram.
+    """
+    from processing import AudioProcessor
+    info = sf.info(audio_file)
+    tap = PipelineTap(info.channels, history=int(window_seconds * info.samplerate) + n_fft)
+    processor = processor or AudioProcessor()
+
+    def run():
+        try:
+            processor.process_file_streaming(audio_file, output_path, operations, monitor=tap.feed)
+        finally:
+            tap.finish()
+
+    threading.Thread(target=run, daemon=True).start()
+    return tap
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show an audio file's waveform and spectrogram as it plays.")
+    parser.add_argument("audio_file", help="Audio file to visualize.")
+    parser.add_argument("--process", nargs="+", default=None, metavar="OPERATION",
+                        help="Also process the file with these operations (e.g. \"Noise Reduction\") and "
+                             "show the result next to the original as it is produced.")
+    parser.add_argument("--output", default=None, help="Where the processed file is written (with --process).")
+    parser.add_argument("--window", type=float, default=2.0, help="Seconds of audio shown (default: 2).")
+    args = parser.parse_args(argv)
+
     app = QtWidgets.QApplication(sys.argv)
-    # Make sure to update this path to point to an existing audio file.
-    audio_file = "your_audio_file.wav"
-    visualizer = AudioVisualizer(audio_file)
+    processed = None
+    if args.process:
+        if not args.output:
+            parser.error("--process needs --output")
+        processed = watch_processing(args.audio_file, args.output, args.process, window_seconds=args.window)
+    visualizer = AudioVisualizer(args.audio_file, processed=processed, window_seconds=args.window)
     visualizer.show()
     sys.exit(app.exec_())
 
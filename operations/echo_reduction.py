@@ -1,52 +1,309 @@
+import hashlib
 import numpy as np
-import pyroomacoustics as pra
 
-def apply_echo_reduction(audio_data, sample_rate, filter_length=1024, mu=0.01, delay_ms=50):
+
+class EchoWeights:
+    """
+    Adapted state of an EchoCanceller: its filter weights and, for "fdaf", its per-bin power
+    estimates. A canceller started from them skips the convergence of a cold start.
+    """
+
+    def __init__(self, method, weights, power=None):
+        """
+        Parameters:
+            method (str): "fdaf" or "time", the method that adapted them.
+            weights (np.ndarray): (partitions, bins) complex weights for "fdaf", (filter_length,) taps for "time".
+            power (np.ndarray, optional): Per-bin power estimate of "fdaf".
+        """
+        self.method = method
+        self.weights = np.array(weights)
+        self.power = None if power is None else np.array(power)
+
+    @property
+    def fingerprint(self):
+        """Short hash of the state, which identifies it in cache keys."""
+        digest = hashlib.sha256(self.method.encode())
+        digest.update(np.ascontiguousarray(self.weights).tobytes())
+        if self.power is not None:
+            digest.update(np.ascontiguousarray(self.power).tobytes())
+        return digest.hexdigest()[:16]
+
+    def __repr__(self):
+        return f"EchoWeights({self.fingerprint})"
+
+
+class EchoCanceller:
+    """
+    Stateful NLMS echo canceller that uses a delayed copy of the input as the far-end reference.
+
+    Two adaptation methods are available:
+        "fdaf": partitioned-block frequency-domain adaptive filter (PBFDAF). The
+            filter is split into partitions of block_size taps; convolution and
+            the (gradient-constrained, per-bin normalized) weight update are done
+            once per block with FFTs. Output is delayed by block_size samples
+            when fed through process().
+        "time": sample-by-sample NLMS over a ring buffer. No arrays are
+            reallocated per sample and output is not delayed.
+
+    Weights and the far-end delay line are carried across calls, so a long
+    recording can be fed in consecutive chunks.
+    """
+
+    def __init__(self, sample_rate, filter_length=1024, mu=0.01, delay_ms=50,
+                 method="fdaf", block_size=None, initial_weights=None):
+        """
+        Parameters:
+            sample_rate (int): Sample rate of the audio.
+            filter_length (int): Length of the adaptive filter in samples.
+            mu (float): Step size for the NLMS update.
+            delay_ms (float): Estimated echo delay in milliseconds.
+            method (str): "fdaf" (block frequency domain, default) or "time".
+            block_size (int, optional): Partition/block size for "fdaf" (default: filter_length,
+                i.e. a single partition; smaller blocks lower the latency at some cost in speed).
+            initial_weights (EchoWeights, optional): Start from weights adapted earlier, e.g. on
+                an excerpt of the same recording, instead of from zero.
+        """
+        if method not in ("fdaf", "time"):
+            raise ValueError(f"Unknown echo reduction method: {method}")
+        self.sample_rate = sample_rate
+        self.filter_length = filter_length
+        self.mu = mu
+        self.method = method
+        self.delay_samples = int(sample_rate * delay_ms / 1000)
+        self.eps = 1e-8
+
+        # Far-end delay line: the last delay_samples input samples.
+        self._history = np.zeros(self.delay_samples)
+
+        if method == "fdaf":
+            self.block_size = block_size or filter_length
+            self.partitions = -(-filter_length // self.block_size)
+            bins = self.block_size + 1
+            self._weights = np.zeros((self.partitions, bins), dtype=np.complex128)
+            # Spectra of the most recent input frames, used as a ring indexed by _newest.
+            self._spectra = np.zeros((self.partitions, bins), dtype=np.complex128)
+            self._newest = 0
+            self._frame = np.zeros(2 * self.block_size)
+            self._power = np.full(bins, self.eps)
+            self._error_frame = np.zeros(2 * self.block_size)
+            self._pending = np.zeros(0)
+            self._ready = np.zeros(self.block_size)
+            self.latency = self.block_size
+        else:
+            self.block_size = block_size or 4096
+            # Ring buffer twice the filter length so the newest-first window is always contiguous.
+            self._ring = np.zeros(2 * filter_length)
+            self._pos = 0
+            self._energy = 0.0
+            self._weights = np.zeros(filter_length)
+            self._scratch = np.zeros(filter_length)
+            self.latency = 0
+        if initial_weights is not None:
+            if initial_weights.method != method or initial_weights.weights.shape != self._weights.shape:
+                raise ValueError("initial_weights were adapted with another method or filter size")
+            self._weights[:] = initial_weights.weights
+            if initial_weights.power is not None and method == "fdaf":
+                self._power[:] = initial_weights.power
+
+    def weights(self):
+        """Returns a copy of the adapted state as EchoWeights."""
+        return EchoWeights(self.method, self._weights, self._power if self.method == "fdaf" else None)
+
+    def _far_end(self, block):
+        """Returns the far-end reference for a block and advances the delay line."""
+        if self.delay_samples == 0:
+            return np.asarray(block, dtype=np.float64)
+        line = np.concatenate((self._history, block))
+        self._history = line[len(block):]
+        return line[:len(block)]
+
+    def _fdaf_block(self, near, out):
+        """
+        Runs one PBFDAF iteration on exactly block_size samples.
+
+        Parameters:
+            near (np.ndarray): Microphone block (the signal to clean).
+            out (np.ndarray): Where the error (echo-reduced) signal is written.
+        """
+        B = self.block_size
+        far = self._far_end(near)
+
+        # Overlap-save frame: previous far-end block followed by the current one.
+        frame = self._frame
+        frame[:B] = frame[B:]
+        frame[B:] = far
+        self._newest = (self._newest - 1) % self.partitions
+        newest = np.fft.rfft(frame)
+        self._spectra[self._newest] = newest
+
+        # Partition p of the weights pairs with the frame from p blocks ago.
+        spectra = np.roll(self._spectra, -self._newest, axis=0) if self._newest else self._spectra
+
+        # Echo estimate is the last half of the circular convolution.
+        echo_spectrum = np.einsum("pk,pk->k", spectra, self._weights)
+        echo = np.fft.irfft(echo_spectrum, n=2 * B)[B:]
+        error = near - echo
+        out[:] = error
+
+        # Per-bin power estimate for step normalization.
+        self._power *= 0.9
+        self._power += 0.1 * (newest.real ** 2 + newest.imag ** 2)
+        self._error_frame[B:] = error
+        error_spectrum = np.fft.rfft(self._error_frame)
+        error_spectrum /= self._power + self.eps
+
+        # Constrained gradient: keep only the first B taps of each partition.
+        gradient = np.conj(spectra) * error_spectrum
+        taps = np.fft.irfft(gradient, n=2 * B, axis=1)
+        taps[:, B:] = 0.0
+        self._weights += self.mu * np.fft.rfft(taps, axis=1)
+
+    def _run_fdaf(self, audio_data, out, progress=None):
+        """Processes a whole number of blocks from audio_data into out."""
+        B = self.block_size
+        total = len(audio_data)
+        for start in range(0, total, B):
+            self._fdaf_block(audio_data[start:start + B], out[start:start + B])
+            if progress is not None:
+                progress(start + B, total)
+        return out
+
+    def _run_time(self, audio_data, out, progress=None):
+        """Sample-by-sample NLMS over the ring buffer."""
+        L = self.filter_length
+        ring = self._ring
+        weights = self._weights
+        scratch = self._scratch
+        total = len(audio_data)
+        for start in range(0, total, self.block_size):
+            near_block = audio_data[start:start + self.block_size]
+            far_block = self._far_end(near_block)
+            for i, (near, far) in enumerate(zip(near_block, far_block)):
+                pos = (self._pos - 1) % L
+                self._energy += far * far - ring[pos] * ring[pos]
+                ring[pos] = far
+                ring[pos + L] = far
+                self._pos = pos
+                window = ring[pos:pos + L]
+
+                error = near - np.dot(weights, window)
+                out[start + i] = error
+                np.multiply(window, self.mu * error / (max(self._energy, 0.0) + self.eps), out=scratch)
+                weights += scratch
+            if progress is not None:
+                progress(min(start + self.block_size, total), total)
+        return out
+
+    def process(self, audio_data, out=None, progress=None):
+        """
+        Cancels echo in the next chunk of a stream.
+
+        With the "fdaf" method the returned samples lag the input by `latency` samples;
+        call flush() at the end of the stream to get the remainder.
+
+        Parameters:
+            audio_data (np.ndarray): 1D chunk of samples of any length.
+            out (np.ndarray, optional): Array to write the result into.
+            progress (callable, optional): Called as progress(done, total) after every block.
+
+        Returns:
+            np.ndarray: Echo-reduced samples, the same length as the chunk, clipped to [-1, 1].
+        """
+        if out is None:
+            out = np.empty(len(audio_data), dtype=np.float32)
+        if self.method == "time":
+            self._run_time(audio_data, out, progress)
+            return np.clip(out, -1, 1, out=out)
+
+        B = self.block_size
+        pending = np.concatenate((self._pending, audio_data))
+        usable = len(pending) - len(pending) % B
+        produced = self._run_fdaf(pending[:usable], np.empty(usable), progress)
+        self._pending = pending[usable:]
+        ready = np.concatenate((self._ready, produced))
+        np.clip(ready[:len(audio_data)], -1, 1, out=out)
+        self._ready = ready[len(audio_data):]
+        return out
+
+    def flush(self):
+        """
+        Finishes the stream, returning the `latency` samples still held back.
+        """
+        if self.method == "time":
+            return np.zeros(0, dtype=np.float32)
+        pad = (-len(self._pending)) % self.block_size
+        tail = self.process(np.zeros(pad))
+        held = np.concatenate((tail, self._ready))[:self.latency]
+        self._ready = np.zeros(0)
+        return np.clip(held, -1, 1).astype(np.float32)
+
+
+def apply_echo_reduction(audio_data, sample_rate, filter_length=1024, mu=0.01, delay_ms=50,
+                         method="fdaf", block_size=None, initial_weights=None, progress=None, out=None,
+                         adapted=None):
     """
-    Applies echo cancellation using an NLMS adaptive filter from Pyroomacoustics.
-    
+    Applies echo cancellation using an NLMS adaptive filter.
+
     This implementation uses a delayed version of the audio as a proxy for the far-end signal.
     It adapts an NLMS filter to cancel the echo.
-    
+
     Parameters:
         audio_data (np.ndarray): 1D array of normalized audio samples (range [-1, 1]).
         sample_rate (int): Sample rate of the audio.
         filter_length (int): Length of the adaptive filter (default: 1024 samples).
         mu (float): Step size for the NLMS algorithm (default: 0.01).
         delay_ms (float): Estimated echo delay in milliseconds (default: 50 ms).
-    
+        method (str): "fdaf" for the partitioned-block frequency-domain filter (default)
+            or "time" for the sample-by-sample ring-buffer filter.
+        block_size (int, optional): Block/partition size for "fdaf" (default: filter_length, i.e. a
+            single partition; see EchoCanceller).
+        initial_weights (EchoWeights, optional): Adapted state to start from (see learn_echo_weights).
+        progress (callable, optional): Called as progress(done, total) after every block.
+        out (np.ndarray, optional): float32 array for the result (default: a new one); it may be audio_data.
+        adapted (callable, optional): Called with the canceller's EchoWeights once it has run,
+            e.g. to start a later run from them.
+
     Returns:
         np.ndarray: The echo-reduced audio signal.
     """
-    # Calculate delay in samples.
-    delay_samples = int(sample_rate * delay_ms / 1000)
-    
-    # Create a proxy far-end signal: a delayed version of the audio.
-    # This is a simplification when no separate far-end reference is available.
-    far_end = np.concatenate((np.zeros(delay_samples), audio_data[:-delay_samples]))
-    
-    # Initialize the NLMS adaptive filter from Pyroomacoustics.
-    nlms = pra.adaptive.NLMS(filter_length, mu=mu)
-    
+    canceller = EchoCanceller(sample_rate, filter_length, mu, delay_ms, method, block_size, initial_weights)
     N = len(audio_data)
-    y = np.zeros(N)  # Filter output
-    e = np.zeros(N)  # Error signal (echo-cancelled output)
-    x_buffer = np.zeros(filter_length)  # Input buffer for the filter
-    
-    # Process each sample.
-    for n in range(N):
-        # Update the input buffer with the current far-end sample.
-        x_buffer = np.roll(x_buffer, 1)
-        x_buffer[0] = far_end[n]
-        
-        # Compute filter output (estimated echo).
-        y[n] = np.dot(nlms.w, x_buffer)
-        
-        # Compute error signal (desired minus estimated echo).
-        e[n] = audio_data[n] - y[n]
-        
-        # Adapt the filter weights based on the error.
-        nlms.adapt(x_buffer, e[n])
-    
-    # Clip the output to maintain the normalized range.
-    return np.clip(e, -1, 1)
+    if out is None:
+        out = np.empty(N, dtype=np.float32)
+
+    if method == "time":
+        canceller.process(audio_data, out=out, progress=progress)
+    else:
+        # Offline, the whole signal is available, so run the blocks directly with no added latency.
+        # Whole blocks go straight from the input into the float32 result; only the last, partial
+        # block is zero-padded.
+        B = canceller.block_size
+        whole = N - N % B
+        canceller._run_fdaf(audio_data[:whole], out[:whole],
+                            progress and (lambda done, total: progress(done, N)))
+        if whole < N:
+            tail = np.zeros(B)
+            tail[:N - whole] = audio_data[whole:]
+            out[whole:] = canceller._run_fdaf(tail, np.empty(B))[:N - whole]
+            if progress is not None:
+                progress(N, N)
+
+        # Clip the output to maintain the normalized range.
+        np.clip(out, -1, 1, out=out)
+    if adapted is not None:
+        adapted(canceller.weights())
+    return out
+
+
+def learn_echo_weights(audio_data, sample_rate, filter_length=1024, mu=0.01, delay_ms=50, method="fdaf",
+                       block_size=None, initial_weights=None):
+    """
+    Adapts an echo canceller over audio_data and returns its state, to start later runs with
+    the same parameters from (apply_echo_reduction's initial_weights). The output is discarded.
+
+    Returns:
+        EchoWeights: The adapted state.
+    """
+    canceller = EchoCanceller(sample_rate, filter_length, mu, delay_ms, method, block_size, initial_weights)
+    canceller.process(np.asarray(audio_data, dtype=np.float64))
+    return canceller.weights()
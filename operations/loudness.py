@@ -0,0 +1,205 @@
+import numpy as np
+import pyloudnorm as pyln
+from scipy.signal import firwin, sosfilt
+
+# Step between gating blocks (100 ms) and the block lengths, in steps, of EBU R128 loudness.
+_STEP_SECONDS = 0.1
+_MOMENTARY_STEPS = 4    # 400 ms, also the gating block of integrated loudness
+_SHORT_TERM_STEPS = 30  # 3 s
+
+_ABSOLUTE_GATE = -70.0
+_RELATIVE_GATE = -10.0
+
+# Histogram of gating-block loudness: 0.001 LU bins from the absolute gate up to +10 LUFS.
+_HISTOGRAM_STEP = 0.001
+_HISTOGRAM_BINS = int(80 / _HISTOGRAM_STEP)
+
+# True-peak interpolation filter taps per phase (ITU-R BS.1770-4 Annex 2 uses 12).
+_TRUE_PEAK_TAPS = 12
+
+# BS.1770 channel weights for the L, R, C, Ls, Rs layout (as in pyloudnorm); further channels,
+# such as the microphones of an array, count like the front channels.
+_CHANNEL_WEIGHTS = (1.0, 1.0, 1.0, 1.41, 1.41)
+
+
+def _block_loudness(power):
+    with np.errstate(divide="ignore"):
+        return -0.691 + 10 * np.log10(power)
+
+
+class LoudnessMeter:
+    """
+    EBU R128 / ITU-R BS.1770 loudness measured block by block in constant memory.
+
+    The two K-weighting biquads (pyloudnorm's coefficients) run as one second-order-section
+    filter with its state carried between blocks. Mean squares are kept per 100 ms step;
+    every 400 ms gating block (four consecutive steps) is added to a histogram of block
+    loudness in 0.001 LU bins that also sums the block powers, so the integrated loudness is
+    gated from the histogram instead of a list of every block. Only the last 3 s of steps
+    are kept, for momentary and short-term loudness.
+
+    Multichannel audio is given as (channels, samples) blocks; the K-weighted channel powers
+    are summed with the BS.1770 channel weights before gating.
+
+    Integrated loudness agrees with pyloudnorm to within about 0.001 LU; the only difference
+    is that the relative gate is resolved to the histogram's bin width.
+    """
+
+    def __init__(self, sample_rate, true_peak=True):
+        """
+        Parameters:
+            sample_rate (int): Sampling rate of the audio.
+            true_peak (bool): Also track the true peak (4x oversampled below 96 kHz).
+        """
+        self.sample_rate = sample_rate
+        sections = []
+        for f in pyln.Meter(sample_rate)._filters.values():
+            b = np.asarray(f.b, dtype=np.float64) * f.passband_gain
+            sections.append(np.concatenate((b, f.a)) / f.a[0])
+        self._sos = np.array(sections)
+        # Filter and true-peak state, sized for the channel count of the first block.
+        self._zi = None
+        self._weights = None
+        self._step = int(_STEP_SECONDS * sample_rate)
+        self._partial = np.zeros(0)
+        # Powers of the last 30 steps (3 s), for momentary and short-term loudness.
+        self._recent = np.zeros(0)
+        self._counts = np.zeros(_HISTOGRAM_BINS, dtype=np.int64)
+        self._powers = np.zeros(_HISTOGRAM_BINS)
+        self.max_momentary = -np.inf
+        self.max_short_term = -np.inf
+        self.sample_peak = 0.0
+
+        # Oversampling to at least 192 kHz, as BS.1770-4 recommends.
+        factor = 4 if sample_rate < 96000 else 2 if sample_rate < 192000 else 1
+        self._peak = 0.0
+        self._phases = None
+        if true_peak and factor > 1:
+            taps = firwin(_TRUE_PEAK_TAPS * factor, 1.0 / factor, window=("kaiser", 5.0)) * factor
+            # Polyphase form: column k holds the (time-reversed) taps producing the output samples
+            # k/factor of the way between inputs, so every phase is one matrix product over a
+            # sliding window of the input.
+            self._phases = np.stack([taps[k::factor][::-1] for k in range(factor)], axis=1)
+
+    def _start(self, samples):
+        leading = samples.shape[:-1]
+        self._zi = np.zeros((len(self._sos),) + leading + (2,))
+        self._history = np.zeros(leading + (_TRUE_PEAK_TAPS - 1,))
+        if samples.ndim > 1:
+            channels = samples.shape[0]
+            weights = _CHANNEL_WEIGHTS + (1.0,) * max(0, channels - len(_CHANNEL_WEIGHTS))
+            self._weights = np.array(weights[:channels])
+
+    def update(self, audio_data):
+        """Adds the next block of audio (1D, or (channels, samples)) to the measurement."""
+        samples = np.asarray(audio_data, dtype=np.float64)
+        if not samples.shape[-1]:
+            return
+        if self._zi is None:
+            self._start(samples)
+        self.sample_peak = max(self.sample_peak, float(np.max(np.abs(samples))))
+        if self._phases is not None:
+            padded = np.concatenate((self._history, samples), axis=-1)
+            windows = np.lib.stride_tricks.sliding_window_view(padded, _TRUE_PEAK_TAPS, axis=-1)
+            self._peak = max(self._peak, float(np.max(np.abs(windows @ self._phases))))
+            self._history = padded[..., -(_TRUE_PEAK_TAPS - 1):]
+
+        filtered, self._zi = sosfilt(self._sos, samples, axis=-1, zi=self._zi)
+        np.square(filtered, out=filtered)
+        if self._weights is not None:
+            filtered = self._weights @ filtered
+        if len(self._partial):
+            filtered = np.concatenate((self._partial, filtered))
+        whole = len(filtered) - len(filtered) % self._step
+        self._partial = filtered[whole:].copy()
+        if not whole:
+            return
+        steps = filtered[:whole].reshape(-1, self._step).mean(axis=1)
+
+        # Each new step ends a 400 ms block once four steps are seen, and a 3 s window once 30 are.
+        history = np.concatenate((self._recent, steps))
+        cumulative = np.concatenate(([0.0], np.cumsum(history)))
+        ends = np.arange(len(self._recent) + 1, len(history) + 1)
+        momentary = ends[ends >= _MOMENTARY_STEPS]
+        if len(momentary):
+            blocks = (cumulative[momentary] - cumulative[momentary - _MOMENTARY_STEPS]) / _MOMENTARY_STEPS
+            self._add_blocks(blocks)
+            self.max_momentary = max(self.max_momentary, float(_block_loudness(blocks.max())))
+        short = ends[ends >= _SHORT_TERM_STEPS]
+        if len(short):
+            windows = (cumulative[short] - cumulative[short - _SHORT_TERM_STEPS]) / _SHORT_TERM_STEPS
+            self.max_short_term = max(self.max_short_term, float(_block_loudness(windows.max())))
+        self._recent = history[-_SHORT_TERM_STEPS:]
+
+    def _add_blocks(self, blocks):
+        loudness = _block_loudness(blocks)
+        gated = loudness >= _ABSOLUTE_GATE
+        bins = np.minimum(((loudness[gated] - _ABSOLUTE_GATE) / _HISTOGRAM_STEP).astype(np.int64),
+                          _HISTOGRAM_BINS - 1)
+        self._counts += np.bincount(bins, minlength=_HISTOGRAM_BINS)
+        self._powers += np.bincount(bins, weights=blocks[gated], minlength=_HISTOGRAM_BINS)
+
+    def integrated_loudness(self):
+        """
+        Returns the gated integrated loudness in LUFS of everything seen so far
+        (-inf for silence or less than 400 ms of audio).
+        """
+        count = self._counts.sum()
+        if not count:
+            return -np.inf
+        relative = _block_loudness(self._powers.sum() / count) + _RELATIVE_GATE
+        # Bins whose centre lies above the relative gate.
+        first = max(0, int(np.floor((relative - _ABSOLUTE_GATE) / _HISTOGRAM_STEP + 0.5)))
+        count = self._counts[first:].sum()
+        if not count:
+            return -np.inf
+        return float(_block_loudness(self._powers[first:].sum() / count))
+
+    def _window_loudness(self, steps):
+        if len(self._recent) < steps:
+            return -np.inf
+        return float(_block_loudness(np.mean(self._recent[-steps:])))
+
+    def momentary_loudness(self):
+        """Loudness in LUFS of the last 400 ms (-inf before 400 ms of audio have been seen)."""
+        return self._window_loudness(_MOMENTARY_STEPS)
+
+    def short_term_loudness(self):
+        """Loudness in LUFS of the last 3 s (-inf before 3 s of audio have been seen)."""
+        return self._window_loudness(_SHORT_TERM_STEPS)
+
+    def true_peak(self):
+        """
+        Returns the largest absolute value of the oversampled signal so far in dBTP
+        (the sample peak when true-peak tracking is off).
+        """
+        peak = max(self._peak, self.sample_peak)
+        with np.errstate(divide="ignore"):
+            return float(20 * np.log10(peak))
+
+    def measurements(self):
+        """
+        Returns:
+            dict: integrated, momentary and short-term loudness (LUFS), their maxima, and true peak (dBTP).
+        """
+        return {
+            "integrated_lufs": self.integrated_loudness(),
+            "momentary_lufs": self.momentary_loudness(),
+            "short_term_lufs": self.short_term_loudness(),
+            "max_momentary_lufs": self.max_momentary,
+            "max_short_term_lufs": self.max_short_term,
+            "true_peak_dbtp": self.true_peak(),
+        }
+
+
+def measure_loudness(audio_data, sample_rate, block_size=65536, true_peak=True):
+    """
+    Meters a whole signal (1D, or (channels, samples)) block by block.
+
+    Returns:
+        LoudnessMeter: The meter after the whole signal; see LoudnessMeter.measurements.
+    """
+    meter = LoudnessMeter(sample_rate, true_peak=true_peak)
+    for start in range(0, audio_data.shape[-1], block_size):
+        meter.update(audio_data[..., start:start + block_size])
+    return meter
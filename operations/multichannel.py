@@ -0,0 +1,78 @@
+"""
+Helpers for multichannel audio.
+
+Mono audio is a 1D array; audio with more channels is a (channels, samples) array.
+Operations that treat channels independently run once per channel: map_channels
+spreads such runs over threads, and ChannelStages wraps one stateful stage per
+channel so a chain can push (channels, samples) blocks through it.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+def channel_count(audio_data):
+    """Number of channels of a 1D (mono) or (channels, samples) buffer."""
+    return 1 if np.ndim(audio_data) == 1 else audio_data.shape[0]
+
+
+def frame_count(audio_data):
+    """Number of samples per channel."""
+    return audio_data.shape[-1]
+
+
+def downmix(audio_data):
+    """Mono float32 average of the channels; mono audio is returned as it is."""
+    if np.ndim(audio_data) == 1:
+        return audio_data
+    return audio_data.mean(axis=0, dtype=np.float32)
+
+
+def map_channels(function, items, workers=None):
+    """
+    Returns [function(item) for item in items], computed on up to `workers` threads
+    (default: one per CPU). NumPy, SciPy and FFT routines release the GIL, so the
+    per-channel work of the spectral and pointwise operations runs in parallel.
+    """
+    items = list(items)
+    workers = min(workers or os.cpu_count() or 1, len(items))
+    if workers <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(function, items))
+
+
+class ChannelStages:
+    """
+    Runs one stage per channel as a single stage over (channels, samples) blocks.
+
+    Each channel keeps its own state (e.g. a compressor's envelope or a noise
+    reducer's noise estimate); channels are processed in parallel with map_channels.
+    The stages must all have the same latency.
+    """
+
+    def __init__(self, stages, workers=None):
+        """
+        Parameters:
+            stages (list): One stage per channel, with process(block) and flush().
+            workers (int, optional): Threads used per block (default: one per CPU).
+        """
+        self.stages = stages
+        self.workers = workers
+        self.latency = stages[0].latency
+
+    def process(self, audio_data, out=None):
+        """
+        Processes a (channels, samples) block. With out given (it may be audio_data),
+        every stage writes its channel into it; the stages must then accept out=.
+        """
+        channels = range(len(self.stages))
+        if out is not None:
+            map_channels(lambda c: self.stages[c].process(audio_data[c], out=out[c]), channels, self.workers)
+            return out
+        blocks = map_channels(lambda c: self.stages[c].process(audio_data[c]), channels, self.workers)
+        return np.stack(blocks).astype(np.float32, copy=False)
+
+    def flush(self):
+        """Returns the samples every stage still holds, as a (channels, latency) array."""
+        return np.stack([stage.flush() for stage in self.stages]).astype(np.float32, copy=False)
@@ -1,14 +1,357 @@
+import hashlib
+import numpy as np
 import noisereduce as nr
+from scipy.ndimage import convolve1d
+from scipy.signal import fftconvolve, filtfilt, lfilter
+from operations.stft import StreamingSTFT, istft, stft
 
-def apply_noise_reduction(audio_data, sample_rate):
+def apply_noise_reduction(audio_data, sample_rate, noise_profile=None, stationary=False, out=None):
     """
     Applies noise reduction using the noisereduce library.
     
     Parameters:
         audio_data (np.ndarray): Normalized audio samples in the range [-1, 1].
         sample_rate (int): Sample rate of the audio.
+        noise_profile (NoiseProfile, optional): Learned noise statistics; the audio is then gated
+            against them (stationary spectral gating) instead of re-estimating the noise.
+        stationary (bool): Without a profile, gate against a profile learned from this audio's
+            own quietest frames. Much cheaper than the default non-stationary gating, which
+            tracks the noise floor frame by frame.
+        out (np.ndarray, optional): float32 array for the result (default: a new one); it may be audio_data.
     
     Returns:
         np.ndarray: Processed (noise-reduced) audio data.
     """
-    return nr.reduce_noise(y=audio_data, sr=sample_rate)
+    if noise_profile is None and not stationary:
+        reduced = nr.reduce_noise(y=audio_data, sr=sample_rate)
+        if out is None:
+            return reduced
+        np.copyto(out, reduced, casting="unsafe")
+        return out
+    n_fft, hop_length = 1024, 256
+    stft_audio = stft(audio_data, n_fft, hop_length)
+    stft_audio = gate_stationary_spectrogram(stft_audio, sample_rate, n_fft, hop_length, noise_profile)
+    return istft(stft_audio, hop_length, len(audio_data), out=out)
+
+
+class NoiseProfile:
+    """
+    Per-frequency noise statistics for stationary spectral gating.
+
+    Holds the mean and standard deviation over time of every STFT bin's level in dB, as
+    noisereduce's stationary mode computes them from its noise clip. A profile is learned
+    once, from a noise-only clip or from the quietest frames of a reference take, saved,
+    and then used to gate every take recorded in the same room with the same microphone.
+    It can be applied at any FFT size or sample rate; the statistics are interpolated
+    over frequency and rescaled for the FFT size.
+    """
+
+    def __init__(self, sample_rate, n_fft, mean_db, std_db):
+        """
+        Parameters:
+            sample_rate (int): Sample rate the profile was learned at.
+            n_fft (int): FFT size the profile was learned with (Hann window, unnormalized).
+            mean_db (np.ndarray): Mean level in dB of each of the n_fft // 2 + 1 bins.
+            std_db (np.ndarray): Standard deviation of the level in dB of each bin.
+        """
+        self.sample_rate = int(sample_rate)
+        self.n_fft = int(n_fft)
+        self.mean_db = np.asarray(mean_db, dtype=np.float64)
+        self.std_db = np.asarray(std_db, dtype=np.float64)
+
+    @classmethod
+    def from_spectrogram(cls, stft_audio, sample_rate, n_fft, quietest=None):
+        """
+        Learns a profile from a complex spectrogram, shape (frequency bins, frames).
+
+        Parameters:
+            quietest (float, optional): Use only this fraction of the frames with the least
+                energy (e.g. 0.1 for a take with speech in it). All frames are used when not
+                given, for a noise-only clip. Digitally silent frames are always skipped.
+        """
+        magnitude = np.abs(stft_audio)
+        energy = np.sum(magnitude ** 2, axis=0)
+        frames = np.flatnonzero(energy > 0)
+        if not len(frames):
+            frames = np.arange(magnitude.shape[1])
+        if quietest is not None and len(frames):
+            count = min(len(frames), max(8, int(round(quietest * len(frames)))))
+            frames = frames[np.argsort(energy[frames], kind="stable")[:count]]
+        if not len(frames):
+            raise ValueError("Cannot learn a noise profile from empty audio.")
+        level_db = 20 * np.log10(magnitude[:, frames] + np.finfo(np.float64).eps)
+        # Levels more than 80 dB below each bin's loudest frame are clamped, as in noisereduce.
+        level_db = np.maximum(level_db, level_db.max(axis=1, keepdims=True) - 80.0)
+        return cls(sample_rate, n_fft, level_db.mean(axis=1), level_db.std(axis=1))
+
+    @classmethod
+    def learn(cls, audio_data, sample_rate, quietest=None, n_fft=1024, hop_length=None):
+        """
+        Learns a profile from audio; see from_spectrogram for quietest. The frames of every
+        channel of (channels, samples) audio are pooled into one profile.
+        """
+        hop_length = hop_length or n_fft // 4
+        channels = audio_data if np.ndim(audio_data) > 1 else [audio_data]
+        stft_audio = np.concatenate([stft(channel, n_fft, hop_length) for channel in channels], axis=1)
+        return cls.from_spectrogram(stft_audio, sample_rate, n_fft, quietest)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(int(data["sample_rate"]), int(data["n_fft"]), data["mean_db"], data["std_db"])
+
+    def save(self, path):
+        """Writes the profile as an .npz file."""
+        with open(path, "wb") as f:
+            np.savez(f, sample_rate=np.int64(self.sample_rate), n_fft=np.int64(self.n_fft),
+                     mean_db=self.mean_db, std_db=self.std_db)
+
+    @property
+    def fingerprint(self):
+        """Short hash of the statistics, which identifies the profile in cache keys."""
+        digest = hashlib.sha256(np.array([self.sample_rate, self.n_fft]).tobytes())
+        digest.update(self.mean_db.tobytes())
+        digest.update(self.std_db.tobytes())
+        return digest.hexdigest()[:16]
+
+    def __repr__(self):
+        return f"NoiseProfile({self.fingerprint})"
+
+    def threshold(self, sample_rate, n_fft, n_std_thresh=1.5):
+        """
+        Returns the magnitude, per bin of an n_fft STFT at sample_rate, below which a bin is gated.
+        """
+        profile_freqs = np.linspace(0, self.sample_rate / 2, len(self.mean_db))
+        freqs = np.linspace(0, sample_rate / 2, n_fft // 2 + 1)
+        threshold_db = (np.interp(freqs, profile_freqs, self.mean_db)
+                        + n_std_thresh * np.interp(freqs, profile_freqs, self.std_db))
+        # Noise magnitude grows with the square root of the window length.
+        threshold_db += 10 * np.log10(n_fft / self.n_fft)
+        return (10 ** (threshold_db / 20)).astype(np.float32)
+
+
+def gate_stationary_spectrogram(stft_audio, sample_rate, n_fft, hop_length, noise_profile=None,
+                                n_std_thresh_stationary=1.5, freq_mask_smooth_hz=500, time_mask_smooth_ms=50,
+                                prop_decrease=1.0, quietest=0.1):
+    """
+    Stationary spectral gating of a complex spectrogram, as in noisereduce's stationary mode.
+
+    A bin passes when its magnitude is above the profile's mean plus n_std_thresh_stationary
+    standard deviations for its frequency; the binary mask is then smoothed over frequency
+    and time. There is no per-frame noise tracking, which makes this several times cheaper
+    than reduce_noise_spectrogram's non-stationary mode.
+
+    Parameters:
+        stft_audio (np.ndarray): Complex spectrogram, shape (frequency bins, frames).
+        sample_rate (int): Sample rate of the audio.
+        n_fft (int): FFT size the spectrogram was computed with.
+        hop_length (int): Hop length the spectrogram was computed with.
+        noise_profile (NoiseProfile, optional): Noise statistics; learned from the quietest
+            frames of this spectrogram if not given.
+        n_std_thresh_stationary (float): Standard deviations above the noise mean a bin must be to pass.
+        freq_mask_smooth_hz (float): Frequency extent of the mask smoothing in Hz.
+        time_mask_smooth_ms (float): Time extent of the mask smoothing in ms.
+        prop_decrease (float): Proportion of the noise to remove (0 to 1).
+        quietest (float): Fraction of frames a profile is learned from when none is given.
+
+    Returns:
+        np.ndarray: The gated spectrogram: stft_audio, gated in place.
+    """
+    if noise_profile is None:
+        noise_profile = NoiseProfile.from_spectrogram(stft_audio, sample_rate, n_fft, quietest)
+    threshold = noise_profile.threshold(sample_rate, n_fft, n_std_thresh_stationary)
+    # The mask is built in the magnitude's float32 buffer.
+    mask = np.abs(stft_audio)
+    np.greater(mask, threshold[:, np.newaxis], out=mask, casting="unsafe")
+    mask *= prop_decrease
+    mask += 1.0 - prop_decrease
+    n_freq = max(1, int(freq_mask_smooth_hz / (sample_rate / (n_fft / 2))))
+    n_time = max(1, int(time_mask_smooth_ms / (hop_length / sample_rate * 1000)))
+    smooth_mask(mask, n_freq, n_time)
+    return np.multiply(stft_audio, mask, out=stft_audio)
+
+
+def _triangle(n):
+    return np.concatenate((np.linspace(0, 1, n + 1, endpoint=False), np.linspace(1, 0, n + 2)))[1:-1]
+
+
+def smoothing_kernel(n_freq, n_time):
+    """
+    Triangular 2D kernel (frequency x time) used to smooth a spectral mask, normalized to sum to 1.
+    """
+    kernel = np.outer(_triangle(n_time), _triangle(n_freq))
+    return kernel / np.sum(kernel)
+
+
+def smooth_mask(mask, n_freq, n_time):
+    """
+    Smooths a (frequency bins, frames) mask with smoothing_kernel in place, as a
+    zero-padded "same" convolution.
+
+    The kernel is the outer product of two triangles, so it is applied as one pass
+    over frequency and one over time; this needs a single scratch array the size of
+    the mask, where a 2D FFT convolution needs several larger ones. The result agrees
+    with the 2D convolution to within rounding.
+
+    Returns:
+        np.ndarray: mask, smoothed.
+    """
+    freq, time = _triangle(n_freq), _triangle(n_time)
+    scratch = np.empty_like(mask)
+    convolve1d(mask, (freq / freq.sum()).astype(mask.dtype), axis=0, output=scratch, mode="constant")
+    convolve1d(scratch, (time / time.sum()).astype(mask.dtype), axis=1, output=mask, mode="constant")
+    return mask
+
+
+def smoothing_coefficient(time_constant_s, sample_rate, hop_length):
+    """
+    Coefficient b of the one-pole smoother y[t] = b * x[t] + (1 - b) * y[t - 1] used for the
+    noise estimate, chosen as in noisereduce for the given time constant.
+    """
+    t_frames = time_constant_s * sample_rate / float(hop_length)
+    return (np.sqrt(1 + 4 * t_frames ** 2) - 1) / (2 * t_frames ** 2)
+
+
+def nonstationary_mask(magnitude, smoothed, thresh_n_mult=2, sigmoid_slope=10):
+    """
+    Soft mask that passes bins whose magnitude rises thresh_n_mult times above the smoothed magnitude.
+    """
+    smoothed = np.maximum(smoothed, 1e-10)
+    # 1 / (1 + exp(-((magnitude - smoothed) / smoothed - thresh_n_mult) * sigmoid_slope)), in one buffer.
+    mask = np.subtract(magnitude, smoothed)
+    mask /= smoothed
+    mask -= thresh_n_mult
+    mask *= -sigmoid_slope
+    np.exp(mask, out=mask)
+    mask += 1
+    return np.reciprocal(mask, out=mask)
+
+
+def reduce_noise_spectrogram(stft_audio, sample_rate, n_fft, hop_length, time_constant_s=2.0,
+                             freq_mask_smooth_hz=500, time_mask_smooth_ms=50,
+                             thresh_n_mult_nonstationary=2, sigmoid_slope_nonstationary=10,
+                             prop_decrease=1.0, noise_profile=None, stationary=False):
+    """
+    Non-stationary spectral gating applied directly to a complex spectrogram.
+
+    Same algorithm as noisereduce's default (non-stationary) mode, for use when the
+    STFT is shared with other spectral operations. With a noise_profile, or with
+    stationary set, gate_stationary_spectrogram is used instead.
+
+    Parameters:
+        stft_audio (np.ndarray): Complex spectrogram, shape (frequency bins, frames).
+        sample_rate (int): Sample rate of the audio.
+        n_fft (int): FFT size the spectrogram was computed with.
+        hop_length (int): Hop length the spectrogram was computed with.
+        time_constant_s (float): Time constant of the noise estimate in seconds.
+        freq_mask_smooth_hz (float): Frequency extent of the mask smoothing in Hz.
+        time_mask_smooth_ms (float): Time extent of the mask smoothing in ms.
+        thresh_n_mult_nonstationary (float): How far above the smoothed magnitude a bin must be to pass.
+        sigmoid_slope_nonstationary (float): Steepness of the mask.
+        prop_decrease (float): Proportion of the noise to remove (0 to 1).
+        noise_profile (NoiseProfile, optional): Gate against these noise statistics.
+        stationary (bool): Gate against a profile learned from this spectrogram's quietest frames.
+
+    Returns:
+        np.ndarray: The gated spectrogram: stft_audio, gated in place.
+    """
+    if noise_profile is not None or stationary:
+        return gate_stationary_spectrogram(stft_audio, sample_rate, n_fft, hop_length, noise_profile,
+                                           freq_mask_smooth_hz=freq_mask_smooth_hz,
+                                           time_mask_smooth_ms=time_mask_smooth_ms, prop_decrease=prop_decrease)
+    magnitude = np.abs(stft_audio)
+    b = smoothing_coefficient(time_constant_s, sample_rate, hop_length)
+    smoothed = filtfilt([b], [1, b - 1], magnitude, axis=-1, padtype=None)
+    mask = nonstationary_mask(magnitude, smoothed, thresh_n_mult_nonstationary, sigmoid_slope_nonstationary)
+
+    n_freq = max(1, int(freq_mask_smooth_hz / (sample_rate / (n_fft / 2))))
+    n_time = max(1, int(time_mask_smooth_ms / (hop_length / sample_rate * 1000)))
+    smooth_mask(mask, n_freq, n_time)
+    mask *= prop_decrease
+    mask += 1.0 - prop_decrease
+    return np.multiply(stft_audio, mask.astype(np.float32), out=stft_audio)
+
+
+class StreamingNoiseReducer:
+    """
+    Non-stationary spectral gating for audio that arrives in chunks.
+
+    Follows noisereduce's non-stationary mode: a bin is kept when its magnitude
+    rises far enough above a time-smoothed version of itself. The smoothing is
+    a causal one-pole filter instead of noisereduce's zero-phase filter, and
+    the mask smoothing looks ahead only time_mask_smooth_ms, so the total
+    latency stays bounded. Given a NoiseProfile, bins are instead gated against
+    its fixed per-frequency threshold (stationary gating).
+    """
+
+    def __init__(self, sample_rate, n_fft=1024, hop_length=None, time_constant_s=2.0,
+                 freq_mask_smooth_hz=500, time_mask_smooth_ms=50,
+                 thresh_n_mult_nonstationary=2, sigmoid_slope_nonstationary=10, prop_decrease=1.0,
+                 noise_profile=None, n_std_thresh_stationary=1.5):
+        """
+        Parameters:
+            sample_rate (int): Sample rate of the audio.
+            n_fft (int): FFT size (default: 1024, as in noisereduce).
+            hop_length (int, optional): Hop between frames (default: n_fft // 4).
+            time_constant_s (float): Time constant of the noise estimate in seconds.
+            freq_mask_smooth_hz (float): Frequency extent of the mask smoothing in Hz.
+            time_mask_smooth_ms (float): Time extent of the mask smoothing in ms; also the lookahead.
+            thresh_n_mult_nonstationary (float): How far above the smoothed magnitude a bin must be to pass.
+            sigmoid_slope_nonstationary (float): Steepness of the mask.
+            prop_decrease (float): Proportion of the noise to remove (0 to 1).
+            noise_profile (NoiseProfile, optional): Gate against these noise statistics instead.
+            n_std_thresh_stationary (float): Standard deviations above the profile's mean a bin
+                must be to pass, with a noise_profile.
+        """
+        hop_length = hop_length or n_fft // 4
+        self.thresh = thresh_n_mult_nonstationary
+        self.slope = sigmoid_slope_nonstationary
+        self.prop_decrease = prop_decrease
+
+        self._b = smoothing_coefficient(time_constant_s, sample_rate, hop_length)
+        self._smooth_state = None
+        self._threshold = (noise_profile.threshold(sample_rate, n_fft, n_std_thresh_stationary)
+                           if noise_profile is not None else None)
+
+        n_freq = max(1, int(freq_mask_smooth_hz / (sample_rate / (n_fft / 2))))
+        self._lookahead = max(1, int(time_mask_smooth_ms / (hop_length / sample_rate * 1000)))
+        self._kernel = smoothing_kernel(n_freq, self._lookahead)
+
+        bins = n_fft // 2 + 1
+        self._mask_tail = np.ones((2 * self._lookahead, bins), dtype=np.float32)
+        self._spec_tail = np.zeros((self._lookahead, bins), dtype=np.complex64)
+
+        self._stft = StreamingSTFT(n_fft, hop_length, self._process_frames, frame_latency=self._lookahead)
+        self.latency = self._stft.latency
+
+    def _gate(self, magnitude):
+        if self._threshold is not None:
+            return magnitude > self._threshold
+        if self._smooth_state is None:
+            self._smooth_state = (1 - self._b) * magnitude[0]
+        smoothed, self._smooth_state = lfilter([self._b], [1, self._b - 1], magnitude, axis=0,
+                                               zi=self._smooth_state[np.newaxis])
+        self._smooth_state = self._smooth_state[0]
+        return nonstationary_mask(magnitude, smoothed, self.thresh, self.slope)
+
+    def _process_frames(self, spectra):
+        mask = self._gate(np.abs(spectra))
+
+        # Smooth the mask once the lookahead frames it needs have arrived.
+        n_frames = len(spectra)
+        masks = np.concatenate((self._mask_tail, mask.astype(np.float32)))
+        mask = fftconvolve(masks, self._kernel, mode="same")[self._lookahead:self._lookahead + n_frames]
+        self._mask_tail = masks[-2 * self._lookahead:]
+        mask = mask * self.prop_decrease + (1.0 - self.prop_decrease)
+
+        delayed = np.concatenate((self._spec_tail, spectra.astype(np.complex64)))
+        self._spec_tail = delayed[n_frames:]
+        return delayed[:n_frames] * mask
+
+    def process(self, audio_data):
+        """Feeds the next chunk and returns the same number of (delayed) denoised samples."""
+        return self._stft.process(audio_data)
+
+    def flush(self):
+        """Returns the `latency` samples still held back at the end of the stream."""
+        return self._stft.flush()
@@ -0,0 +1,57 @@
+import numpy as np
+
+
+class PointwiseChain:
+    """
+    Runs a chain of in-place, zero-latency stages over a signal in one blocked pass.
+
+    Gain, clip, compression and quantization only look at the current sample (or,
+    for the compressor, carry a small state forward), so instead of each stage
+    reading the whole signal and allocating a new full-length array, every block is
+    copied once into the float32 output and all stages are applied to it while it is
+    still in cache. Each stage has process(block, out=block) like the streaming
+    stages; an optional sink (e.g. an audio_io.AudioWriter) receives every finished
+    block, which fuses the final quantize-and-write step into the same pass.
+
+    Stages must not depend on how the signal is split into blocks beyond their own
+    block_size; block_size here matches the compressor's, so the result is the same
+    as running each stage over the whole signal in turn. A (channels, samples) signal
+    is processed in (channels, block_size) blocks.
+    """
+
+    def __init__(self, stages, block_size=65536):
+        """
+        Parameters:
+            stages (list): Stages with process(block, out=None), applied in order.
+            block_size (int): Samples processed per block.
+        """
+        self.stages = stages
+        self.block_size = block_size
+
+    def run(self, audio_data, out=None, sink=None, progress=None):
+        """
+        Parameters:
+            audio_data (np.ndarray): 1D or (channels, samples) input signal. It is never modified,
+                unless it is also out.
+            out (np.ndarray, optional): float32 array for the result (default: a new one).
+            sink (object, optional): Has write(block); called with every finished block.
+            progress (callable, optional): Called as progress(done, total) after every block.
+
+        Returns:
+            np.ndarray: The processed signal (out).
+        """
+        total = audio_data.shape[-1]
+        if out is None:
+            out = np.empty(audio_data.shape, dtype=np.float32)
+        for start in range(0, total, self.block_size):
+            stop = min(start + self.block_size, total)
+            block = out[..., start:stop]
+            if out is not audio_data:
+                np.copyto(block, audio_data[..., start:stop], casting="unsafe")
+            for stage in self.stages:
+                stage.process(block, out=block)
+            if sink is not None:
+                sink.write(block)
+            if progress is not None:
+                progress(stop, total)
+        return out
@@ -1,28 +1,303 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
+
 import numpy as np
 import librosa
 from nara_wpe.wpe import wpe
+from operations.stft import StreamingSTFT
+
+# Working memory allowed for WPE at once, summed over the worker processes.
+DEFAULT_MAX_MEMORY = 1024 ** 3
+
+# Spectrogram values (bins x frames x channels) below which a segment is dereverberated in
+# this process; starting worker processes would take longer than the work.
+_MIN_PARALLEL_VALUES = 2_000_000
+
+
+def wpe_memory(values, taps=10, itemsize=8):
+    """
+    Estimated peak bytes WPE needs for a spectrogram of `values` complex values: the
+    taps-deep stack of delayed frames, weighted by the inverse power, is built per iteration
+    next to the estimate, about (2 * taps + 3) copies of the input.
+
+    Parameters:
+        values (int): bins x frames x channels of the spectrogram.
+        taps (int): WPE filter taps, in frames.
+        itemsize (int): Bytes per complex value (8 for complex64, 16 for complex128).
+    """
+    return values * itemsize * (2 * taps + 3)
+
+
+def _wpe(spectra, taps, delay, iterations):
+    # One group of frequency bins, (bins, channels, frames); runs in a worker process.
+    return wpe(spectra, taps=taps, delay=delay, iterations=iterations)
+
+
+class WPEEngine:
+    """
+    WPE dereverberation of long spectrograms in bounded memory, on several processes.
 
-def apply_reverb_reduction(audio_data, sample_rate, n_fft=512, hop_length=128, iterations=3):
+    WPE estimates a separate prediction filter for every frequency bin, so the bins are
+    split into one group per worker and dereverberated by a pool of worker processes. Time
+    is processed in segments short enough that the working memory of all groups together
+    stays under max_memory; each segment is preceded by the last taps + delay frames of the
+    one before, so the filters have their full context at the boundary. A spectrogram that
+    fits is dereverberated in a single segment, like plain WPE (split over processes, the
+    complex64 results can differ from it by rounding).
+
+    The worker processes are started on the first segment large enough to need them and
+    kept until close().
+    """
+
+    def __init__(self, iterations=3, taps=10, delay=3, workers=None, max_memory=DEFAULT_MAX_MEMORY):
+        """
+        Parameters:
+            iterations (int): Number of WPE iterations (default: 3).
+            taps (int): WPE filter taps, in frames (default: 10).
+            delay (int): WPE prediction delay, in frames (default: 3).
+            workers (int, optional): Worker processes (default: CPU count); 1 runs in this process.
+            max_memory (int): Bytes of WPE working memory allowed at once (default: 1 GiB).
+        """
+        self.iterations = iterations
+        self.taps = taps
+        self.delay = delay
+        self.workers = workers or os.cpu_count() or 1
+        self.max_memory = max_memory
+        self._pool = None
+
+    def segment_frames(self, bins, channels=1, itemsize=8):
+        """Longest segment, in frames including its context, whose WPE fits in max_memory."""
+        per_frame = wpe_memory(bins * channels, self.taps, itemsize)
+        return max(self.taps + self.delay + 1, int(self.max_memory // per_frame))
+
+    def close(self):
+        """Shuts down the worker processes, if any were started."""
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self, spectra):
+        # Dereverberates one segment, (bins, channels, frames), splitting the bins over the pool.
+        workers = min(self.workers, len(spectra))
+        if workers <= 1 or spectra.size < _MIN_PARALLEL_VALUES:
+            return _wpe(spectra, self.taps, self.delay, self.iterations)
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            # Shut down before the pool's queues are closed when a worker process exits (see
+            # AudioProcessor._apply_per_channel).
+            Finalize(self, self._pool.shutdown, exitpriority=100)
+        groups = np.array_split(np.arange(len(spectra)), workers)
+        futures = [self._pool.submit(_wpe, np.ascontiguousarray(spectra[group[0]:group[-1] + 1]),
+                                     self.taps, self.delay, self.iterations) for group in groups]
+        return np.concatenate([future.result() for future in futures])
+
+    def dereverberate(self, stft_audio):
+        """
+        Dereverberates a complex spectrogram, (frequency bins, frames) or (channels,
+        frequency bins, frames) to dereverberate the channels jointly.
+
+        Returns:
+            np.ndarray: Dereverberated spectrogram, same shape as stft_audio.
+        """
+        # wpe expects (frequency, channels, frames); a mono STFT is a single channel per frequency bin.
+        if stft_audio.ndim == 2:
+            spectra = stft_audio[:, np.newaxis, :]
+        else:
+            spectra = stft_audio.transpose(1, 0, 2)
+        bins, channels, frames = spectra.shape
+        context = self.taps + self.delay
+        length = self.segment_frames(bins, channels, spectra.itemsize)
+        if frames <= length:
+            dereverb = self._run(spectra)
+        else:
+            dereverb = np.empty_like(spectra)
+            step = length - context
+            for start in range(0, frames, step):
+                first = max(0, start - context)
+                segment = self._run(spectra[..., first:start + step])
+                dereverb[..., start:start + step] = segment[..., start - first:]
+        if stft_audio.ndim == 2:
+            return dereverb[:, 0, :]
+        return dereverb.transpose(1, 0, 2)
+
+
+def apply_reverb_reduction(audio_data, sample_rate, n_fft=512, hop_length=128, iterations=3, taps=10, delay=3,
+                           max_memory=DEFAULT_MAX_MEMORY, workers=None, out=None):
     """
     Applies Weighted Prediction Error (WPE) dereverberation to reduce reverberation.
 
+    Multichannel audio is dereverberated jointly: the prediction filter of every channel
+    uses the delayed spectra of all channels, which removes more of the room than
+    treating each microphone on its own.
+
+    When WPE on the whole recording would need more than max_memory, the audio is
+    dereverberated in segments as long as max_memory allows (see StreamingReverbReducer),
+    so memory no longer grows with the length of the recording.
+
     Parameters:
-        audio_data (np.ndarray): 1D array of time-domain audio samples normalized to [-1, 1].
+        audio_data (np.ndarray): Time-domain audio samples normalized to [-1, 1], 1D or
+            (channels, samples).
         sample_rate (int): The sample rate of the audio.
         n_fft (int): FFT size for STFT computation (default: 512).
         hop_length (int): Hop length for STFT computation (default: 128).
         iterations (int): Number of WPE iterations (default: 3).
+        taps (int): WPE filter taps, in frames (default: 10).
+        delay (int): WPE prediction delay, in frames (default: 3).
+        max_memory (int): Bytes of WPE working memory allowed at once (default: 1 GiB).
+        workers (int, optional): Processes the frequency bins are split over (default: CPU count).
+        out (np.ndarray, optional): float32 array for the result (default: a new one); it may be audio_data.
 
     Returns:
         np.ndarray: Dereverberated audio in the time domain.
     """
-    # Compute the STFT of the audio
+    channels = 1 if audio_data.ndim == 1 else audio_data.shape[0]
+    values = (n_fft // 2 + 1) * (1 + audio_data.shape[-1] // hop_length) * channels
+    # librosa's STFT of float32 audio is complex64.
+    if wpe_memory(values, taps) > max_memory:
+        return _reverb_reduction_in_segments(audio_data, sample_rate, n_fft, hop_length, iterations, taps, delay,
+                                             max_memory, workers, out=out)
+
+    # Compute the STFT of the audio, (frequency bins, frames) or (channels, frequency bins, frames)
     stft_audio = librosa.stft(audio_data, n_fft=n_fft, hop_length=hop_length)
     
     # Apply the WPE algorithm
-    # The function wpe takes a complex STFT matrix and returns a dereverberated version.
-    dereverb_stft = wpe(stft_audio, iterations=iterations)
+    dereverb_stft = dereverberate_spectrogram(stft_audio, iterations, taps, delay, workers, max_memory)
     
     # Convert the dereverberated STFT back to time-domain audio
-    audio_dereverb = librosa.istft(dereverb_stft, hop_length=hop_length, length=len(audio_data))
+    audio_dereverb = librosa.istft(dereverb_stft, hop_length=hop_length, length=audio_data.shape[-1], out=out)
     return audio_dereverb
+
+
+def _reverb_reduction_in_segments(audio_data, sample_rate, n_fft, hop_length, iterations, taps, delay, max_memory,
+                                  workers, block_size=65536, out=None):
+    # Runs the streaming reducer over the buffer with segments as long as max_memory allows, then
+    # drops its latency, so only a few segments of spectrogram are held at once.
+    channels = 1 if audio_data.ndim == 1 else audio_data.shape[0]
+    reducer = StreamingReverbReducer(sample_rate, n_fft, hop_length, iterations, taps, delay, segment_seconds=None,
+                                     channels=channels, workers=workers, max_memory=max_memory)
+    length = audio_data.shape[-1]
+    if out is None:
+        out = np.empty(audio_data.shape, dtype=np.float32)
+
+    def blocks():
+        for start in range(0, length, block_size):
+            yield reducer.process(audio_data[..., start:start + block_size])
+        yield reducer.flush()
+
+    # Output position of the next sample the reducer returns.
+    position = -reducer.latency
+    for block in blocks():
+        end = position + block.shape[-1]
+        if end > 0:
+            out[..., max(0, position):min(end, length)] = block[..., max(0, -position):length - position]
+        position = end
+    return out
+
+
+def dereverberate_spectrogram(stft_audio, iterations=3, taps=10, delay=3, workers=1, max_memory=DEFAULT_MAX_MEMORY):
+    """
+    Applies WPE dereverberation directly to a complex spectrogram (see WPEEngine).
+
+    Parameters:
+        stft_audio (np.ndarray): Complex spectrogram, shape (frequency bins, frames), or
+            (channels, frequency bins, frames) to dereverberate the channels jointly.
+        iterations (int): Number of WPE iterations (default: 3).
+        taps (int): WPE filter taps, in frames (default: 10).
+        delay (int): WPE prediction delay, in frames (default: 3).
+        workers (int, optional): Processes the frequency bins are split over (default: 1;
+            None for the CPU count).
+        max_memory (int): Bytes of WPE working memory allowed at once (default: 1 GiB).
+
+    Returns:
+        np.ndarray: Dereverberated spectrogram, same shape as stft_audio.
+    """
+    with WPEEngine(iterations, taps, delay, workers, max_memory) as engine:
+        return engine.dereverberate(stft_audio)
+
+
+class StreamingReverbReducer:
+    """
+    WPE dereverberation for audio that arrives in chunks.
+
+    STFT frames are collected into segments of segment_seconds; each segment is
+    dereverberated with the batch WPE algorithm, preceded by the last
+    taps + delay frames of the previous segment so the prediction filter has
+    its full context at the segment boundary. Memory is bounded by the
+    segment length, and output is delayed by one segment. With channels > 1,
+    chunks are (channels, samples) arrays, dereverberated jointly.
+
+    Segments are also kept short enough for WPE to fit in max_memory, and the
+    frequency bins of large segments are split over worker processes (see WPEEngine).
+    """
+
+    def __init__(self, sample_rate, n_fft=512, hop_length=128, iterations=3,
+                 taps=10, delay=3, segment_seconds=10.0, channels=1, workers=None, max_memory=DEFAULT_MAX_MEMORY):
+        """
+        Parameters:
+            sample_rate (int): The sample rate of the audio.
+            n_fft (int): FFT size for STFT computation (default: 512).
+            hop_length (int): Hop length for STFT computation (default: 128).
+            iterations (int): Number of WPE iterations (default: 3).
+            taps (int): WPE filter taps, in frames (default: 10).
+            delay (int): WPE prediction delay, in frames (default: 3).
+            segment_seconds (float, optional): Length of audio dereverberated at once; None for
+                as long as max_memory allows.
+            channels (int): Channel count of the chunks.
+            workers (int, optional): Processes the frequency bins are split over (default: CPU count).
+            max_memory (int): Bytes of WPE working memory allowed at once (default: 1 GiB).
+        """
+        self.taps = taps
+        self.delay = delay
+        self._engine = WPEEngine(iterations, taps, delay, workers, max_memory)
+        # The streamed spectra are complex128; every segment is preceded by taps + delay frames of context.
+        self.segment_frames = self._engine.segment_frames(n_fft // 2 + 1, channels, itemsize=16) - (taps + delay)
+        if segment_seconds is not None:
+            self.segment_frames = min(self.segment_frames, int(segment_seconds * sample_rate / hop_length))
+        self.segment_frames = max(taps + delay + 1, self.segment_frames)
+
+        # Frames are kept as (frames, bins), or (channels, frames, bins); they run along axis -2.
+        leading = () if channels == 1 else (channels,)
+        bins = n_fft // 2 + 1
+        self._context = np.zeros(leading + (0, bins), dtype=np.complex128)
+        self._pending = np.zeros(leading + (0, bins), dtype=np.complex128)
+        self._ready = np.zeros(leading + (self.segment_frames, bins), dtype=np.complex128)
+
+        self._stft = StreamingSTFT(n_fft, hop_length, self._process_frames, frame_latency=self.segment_frames,
+                                   channels=channels)
+        self.latency = self._stft.latency
+
+    def _dereverb_segment(self, segment):
+        frames = np.concatenate((self._context, segment), axis=-2)
+        self._context = segment[..., -(self.taps + self.delay):, :]
+        dereverb = self._engine.dereverberate(np.swapaxes(frames, -1, -2))
+        return np.swapaxes(dereverb, -1, -2)[..., -segment.shape[-2]:, :]
+
+    def _process_frames(self, spectra):
+        pending = np.concatenate((self._pending, spectra), axis=-2)
+        done = []
+        while pending.shape[-2] >= self.segment_frames:
+            done.append(self._dereverb_segment(pending[..., :self.segment_frames, :]))
+            pending = pending[..., self.segment_frames:, :]
+        self._pending = pending
+        ready = np.concatenate([self._ready] + done, axis=-2)
+        count = spectra.shape[-2]
+        self._ready = ready[..., count:, :]
+        return ready[..., :count, :]
+
+    def process(self, audio_data):
+        """Feeds the next chunk and returns the same number of (delayed) dereverberated samples."""
+        return self._stft.process(audio_data)
+
+    def flush(self):
+        """Returns the `latency` samples still held back at the end of the stream."""
+        tail = self._stft.flush()
+        self._engine.close()
+        return tail
@@ -0,0 +1,77 @@
+from collections import namedtuple
+
+import numpy as np
+from operations.multichannel import map_channels
+
+# A spectral operation: function(stft_audio, sample_rate, n_fft, hop_length) -> stft_audio,
+# plus the STFT size and hop it was designed for. A multichannel stage is given the spectra of
+# all channels at once, as (channels, bins, frames); any other stage gets one channel at a time.
+SpectralStage = namedtuple("SpectralStage", ["name", "function", "n_fft", "hop_length", "multichannel"],
+                           defaults=(False,))
+
+
+def negotiate_stft(stages):
+    """
+    Picks one STFT configuration for a run of spectral stages.
+
+    The largest preferred FFT size wins, so no stage loses frequency resolution, and the
+    hop is a quarter of it (75% overlap, which every stage here supports). Stages whose
+    parameters are counted in frames rescale them from their preferred hop.
+
+    Parameters:
+        stages (list): SpectralStage entries.
+
+    Returns:
+        tuple: (n_fft, hop_length).
+    """
+    n_fft = max(stage.n_fft for stage in stages)
+    return n_fft, n_fft // 4
+
+
+def apply_spectral_stages(audio_data, sample_rate, stages, n_fft=None, hop_length=None, workers=None, out=None,
+                          arena=None):
+    """
+    Runs consecutive spectral operations on one shared STFT.
+
+    The signal is transformed once, every stage works on the same complex
+    spectrogram in turn, and a single inverse transform produces the output.
+    For multichannel audio, stages that treat channels independently run on
+    the channels in parallel.
+
+    Parameters:
+        audio_data (np.ndarray): Normalized audio samples, 1D or (channels, samples).
+        sample_rate (int): Sample rate of the audio.
+        stages (list): SpectralStage entries, applied in order.
+        n_fft (int, optional): FFT size; negotiated from the stages if not given.
+        hop_length (int, optional): Hop length; negotiated from the stages if not given.
+        workers (int, optional): Threads for per-channel stages (default: one per CPU).
+        out (np.ndarray, optional): float32 array for the result (default: a new one).
+        arena (BufferArena, optional): Lends the complex64 spectrogram, which is given back
+            once the result is written.
+
+    Returns:
+        np.ndarray: Processed audio, the same shape as the input.
+    """
+    # Imported here, so that describing spectral stages does not load librosa.
+    import librosa
+    if n_fft is None or hop_length is None:
+        negotiated_fft, negotiated_hop = negotiate_stft(stages)
+        n_fft = n_fft or negotiated_fft
+        hop_length = hop_length or negotiated_hop
+
+    audio_data = np.asarray(audio_data, dtype=np.float32)
+    spectrogram = None
+    if arena is not None:
+        frames = 1 + audio_data.shape[-1] // hop_length
+        spectrogram = arena.borrow(audio_data.shape[:-1] + (n_fft // 2 + 1, frames), np.complex64)
+    stft_audio = librosa.stft(audio_data, n_fft=n_fft, hop_length=hop_length, out=spectrogram)
+    for stage in stages:
+        if stft_audio.ndim == 2 or stage.multichannel:
+            stft_audio = stage.function(stft_audio, sample_rate, n_fft, hop_length)
+        else:
+            stft_audio = np.stack(map_channels(lambda channel: stage.function(channel, sample_rate, n_fft, hop_length),
+                                               stft_audio, workers))
+    result = librosa.istft(stft_audio, hop_length=hop_length, length=audio_data.shape[-1], out=out)
+    if arena is not None:
+        arena.give_back(spectrogram)
+    return result
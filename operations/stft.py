@@ -0,0 +1,153 @@
+import numpy as np
+
+
+def hann_window(n_fft):
+    """Periodic Hann window, as used by librosa and scipy for STFT analysis."""
+    return (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(n_fft) / n_fft)).astype(np.float32)
+
+
+# Frames transformed at a time by stft/istft, bounding their scratch memory.
+_FRAMES_PER_BLOCK = 512
+
+
+def stft(audio_data, n_fft, hop_length):
+    """
+    Complex spectrogram of a whole signal, shape (n_fft // 2 + 1, frames).
+
+    Same framing as librosa.stft's defaults (periodic Hann window, frames centred on
+    multiples of hop_length, zero padding at the ends), computed with NumPy alone so
+    callers avoid librosa's import and JIT start-up cost.
+    """
+    audio_data = np.asarray(audio_data, dtype=np.float32)
+    padded = np.pad(audio_data, n_fft // 2)
+    frames = np.lib.stride_tricks.sliding_window_view(padded, n_fft)[::hop_length]
+    window = hann_window(n_fft)
+    out = np.empty((n_fft // 2 + 1, len(frames)), dtype=np.complex64)
+    for start in range(0, len(frames), _FRAMES_PER_BLOCK):
+        block = frames[start:start + _FRAMES_PER_BLOCK]
+        out[:, start:start + len(block)] = np.fft.rfft(block * window, axis=1).T
+    return out
+
+
+def istft(stft_audio, hop_length, length, out=None):
+    """
+    Inverse of stft: windowed overlap-add, normalized by the summed squared window, trimmed to length.
+    With out given (a float32 array of that length), the result is written into it.
+    """
+    n_fft = 2 * (stft_audio.shape[0] - 1)
+    n_frames = stft_audio.shape[1]
+    window = hann_window(n_fft)
+    total = n_fft + hop_length * (n_frames - 1)
+    signal = np.zeros(total, dtype=np.float32)
+    norm = np.zeros(total, dtype=np.float32)
+    squared = window ** 2
+    for start in range(0, n_frames, _FRAMES_PER_BLOCK):
+        block = np.fft.irfft(stft_audio[:, start:start + _FRAMES_PER_BLOCK].T, n=n_fft, axis=1)
+        block = block.astype(np.float32) * window
+        # Overlap-add by hop-sized columns, so every add is one vectorized strided operation.
+        for offset in range(0, n_fft, hop_length):
+            width = min(hop_length, n_fft - offset)
+            first = start * hop_length + offset
+            count = len(block)
+            target = signal[first:first + count * hop_length].reshape(count, hop_length)
+            target[:, :width] += block[:, offset:offset + width]
+            target = norm[first:first + count * hop_length].reshape(count, hop_length)
+            target[:, :width] += squared[offset:offset + width]
+    signal = signal[n_fft // 2:n_fft // 2 + length]
+    norm = norm[n_fft // 2:n_fft // 2 + length]
+    np.divide(signal, norm, out=signal, where=norm > 1e-8)
+    if len(signal) < length:
+        signal = np.pad(signal, (0, length - len(signal)))
+    if out is None:
+        return signal
+    out[:] = signal
+    return out
+
+
+class StreamingSTFT:
+    """
+    Overlap-add STFT processor for audio that arrives in chunks.
+
+    Incoming samples are cut into Hann-windowed frames every hop_length samples;
+    the complex spectra of all frames completed by a chunk are handed to
+    frame_fn as one (frames, bins) array, and the spectra it returns are
+    inverted and overlap-added. frame_fn may hold frames back (for lookahead
+    or segment-wise processing) as long as it always returns as many frames as
+    it was given and declares the delay as frame_latency.
+
+    With channels > 1, chunks are (channels, samples) arrays and frame_fn is given
+    the spectra of all channels at once, as a (channels, frames, bins) array.
+
+    Output has a constant latency of n_fft + frame_latency * hop_length samples.
+    """
+
+    def __init__(self, n_fft, hop_length, frame_fn, frame_latency=0, channels=1):
+        """
+        Parameters:
+            n_fft (int): Frame length and FFT size.
+            hop_length (int): Samples between consecutive frames.
+            frame_fn (callable): Maps a (frames, n_fft // 2 + 1) complex array to one of the same shape
+                (with a leading channel axis when channels > 1).
+            frame_latency (int): Frames frame_fn holds back before returning them.
+            channels (int): Channel count of the chunks.
+        """
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.frame_fn = frame_fn
+        self.latency = n_fft + frame_latency * hop_length
+        self._leading = () if channels == 1 else (channels,)
+
+        self.window = hann_window(n_fft)
+        # Overlap-added squared window is periodic in hop_length; divide it out on synthesis.
+        norm = np.zeros(hop_length, dtype=np.float32)
+        for offset in range(0, n_fft, hop_length):
+            segment = self.window[offset:offset + hop_length] ** 2
+            norm[:len(segment)] += segment
+        self._norm = np.maximum(norm, 1e-8)
+
+        # Pre-padding so the first input sample is covered by a full set of frames.
+        leading = self._leading
+        self._input = np.zeros(leading + (n_fft - hop_length,), dtype=np.float32)
+        self._ola = np.zeros(leading + (n_fft,), dtype=np.float32)
+        # Completed output not yet returned, primed so every call can return a full chunk.
+        # Frames held back by frame_fn already delay the overlap-added output by themselves.
+        self._ready = np.zeros(leading + (hop_length,), dtype=np.float32)
+
+    def process(self, audio_data):
+        """
+        Feeds the next chunk and returns the same number of (delayed) processed samples.
+        """
+        n_fft, hop, leading = self.n_fft, self.hop_length, self._leading
+        buffer = np.concatenate((self._input, np.asarray(audio_data, dtype=np.float32)), axis=-1)
+        length = buffer.shape[-1]
+        n_frames = (length - n_fft) // hop + 1 if length >= n_fft else 0
+
+        produced = np.zeros(leading + (n_frames * hop,), dtype=np.float32)
+        if n_frames:
+            frames = np.lib.stride_tricks.sliding_window_view(buffer, n_fft, axis=-1)[..., ::hop, :][..., :n_frames, :]
+            spectra = self.frame_fn(np.fft.rfft(frames * self.window, axis=-1))
+            segments = np.fft.irfft(spectra, n=n_fft, axis=-1).astype(np.float32) * self.window
+
+            # Overlap-add into a scratch timeline that starts at the pending partial sums.
+            timeline = np.zeros(leading + (n_frames * hop + n_fft,), dtype=np.float32)
+            timeline[..., :n_fft] = self._ola
+            for offset in range(0, n_fft, hop):
+                span = segments[..., offset:offset + hop]
+                width = span.shape[-1]
+                target = timeline[..., offset:offset + n_frames * hop].reshape(leading + (n_frames, hop))
+                target[..., :width] += span
+            produced = timeline[..., :n_frames * hop].reshape(leading + (n_frames, hop)) / self._norm
+            produced = produced.reshape(leading + (-1,))
+            self._ola = timeline[..., n_frames * hop:]
+            buffer = buffer[..., n_frames * hop:]
+
+        self._input = buffer
+        ready = np.concatenate((self._ready, produced), axis=-1)
+        n = np.shape(audio_data)[-1]
+        out = ready[..., :n]
+        self._ready = ready[..., n:]
+        return out
+
+    def flush(self):
+        """Returns the `latency` samples still held back at the end of the stream."""
+        return self.process(np.zeros(self._leading + (self.latency,), dtype=np.float32))
@@ -1,11 +1,200 @@
 import numpy as np
 
-def apply_volume_compression(audio_data, sample_rate, 
-                             threshold_dB=-20.0, ratio=4.0, 
-                             attack=0.01, release=0.1, knee=5.0):
+# Largest total decay (in nepers) allowed inside one envelope sub-block. Keeping
+# it bounded keeps exp(-cumsum(log a)) well inside float64 range.
+_MAX_BLOCK_DECAY = 30.0
+
+
+def compute_gain_db(level_dB, threshold_dB=-20.0, ratio=4.0, knee=5.0):
+    """
+    Static gain curve of the compressor (threshold, ratio, soft knee) evaluated over whole arrays.
+
+    Parameters:
+        level_dB (np.ndarray): Envelope level in dB.
+        threshold_dB (float): Threshold in dB above which compression is applied.
+        ratio (float): Compression ratio.
+        knee (float): Knee width in dB.
+
+    Returns:
+        np.ndarray: Gain in dB (always <= 0).
+    """
+    level_dB = np.asarray(level_dB, dtype=np.float64)
+    slope = 1.0 / ratio - 1.0
+    over = level_dB - threshold_dB
+    gain_dB = np.where(over > knee / 2, slope * over, 0.0)
+    if knee > 0:
+        in_knee = np.abs(over) <= knee / 2
+        delta = level_dB[in_knee] - (threshold_dB - knee / 2)
+        gain_dB[in_knee] = slope * (delta ** 2) / (2 * knee)
+    return gain_dB
+
+
+class VolumeCompressor:
+    """
+    Block-based feed-forward compressor.
+
+    The envelope follower is the same attack/release recursion as the per-sample
+    reference, but it is evaluated a block at a time: the attack/release decision
+    for every sample is guessed, the resulting linear time-varying recursion is
+    solved in closed form with cumulative sums, and the decisions are re-checked
+    until they agree with the envelope they produce. A sub-block whose decisions
+    have not settled after max_iterations passes is finished sample by sample from
+    its first wrong decision, so the result never depends on that limit. The
+    envelope is carried across calls, so consecutive blocks of a stream give the
+    same result as one call on the whole signal.
+    """
+
+    latency = 0
+
+    def __init__(self, sample_rate, threshold_dB=-20.0, ratio=4.0,
+                 attack=0.01, release=0.1, knee=5.0,
+                 block_size=65536, max_iterations=32):
+        """
+        Parameters:
+            sample_rate (int): Sampling rate of the audio.
+            threshold_dB (float): Threshold in dB above which compression is applied.
+            ratio (float): Compression ratio.
+            attack (float): Attack time in seconds.
+            release (float): Release time in seconds.
+            knee (float): Knee width in dB.
+            block_size (int): Number of samples processed per vectorized block.
+            max_iterations (int): Maximum attack/release refinement passes per sub-block, before
+                the rest of it is followed sample by sample.
+        """
+        self.sample_rate = sample_rate
+        self.threshold_dB = threshold_dB
+        self.ratio = ratio
+        self.knee = knee
+        self.alpha_attack = np.exp(-1.0 / (sample_rate * attack))
+        self.alpha_release = np.exp(-1.0 / (sample_rate * release))
+        self.max_iterations = max_iterations
+
+        # Sub-blocks are sized so that the decay over one of them stays bounded.
+        steepest = -np.log(min(self.alpha_attack, self.alpha_release))
+        self.sub_block = int(max(1, min(block_size, _MAX_BLOCK_DECAY // steepest)))
+        self.block_size = max(block_size, self.sub_block)
+
+        self.envelope = 0.0
+
+    def reset(self):
+        """Resets the envelope follower to silence."""
+        self.envelope = 0.0
+
+    def _follow(self, rectified):
+        """
+        Runs the attack/release envelope follower over one sub-block.
+
+        Parameters:
+            rectified (np.ndarray): float64 absolute sample values.
+
+        Returns:
+            np.ndarray: Envelope for every sample of the sub-block.
+        """
+        env0 = self.envelope
+        log_attack = np.log(self.alpha_attack)
+        log_release = np.log(self.alpha_release)
+
+        # First guess: release everywhere except where the input beats the
+        # envelope of the previous block.
+        attacking = rectified > env0
+        env = None
+        for _ in range(self.max_iterations):
+            log_a = np.where(attacking, log_attack, log_release)
+            decay = np.cumsum(log_a)
+            drive = (1.0 - np.exp(log_a)) * rectified
+            env = np.exp(decay) * (env0 + np.cumsum(drive * np.exp(-decay)))
+
+            previous = np.empty_like(env)
+            previous[0] = env0
+            previous[1:] = env[:-1]
+            decided = rectified > previous
+            if np.array_equal(decided, attacking):
+                break
+            attacking, guessed = decided, attacking
+        else:
+            # Not settled: the envelope is exact up to the first sample whose decision was wrong,
+            # and is followed sample by sample from there, as the reference engine does.
+            start = int(np.argmax(attacking != guessed))
+            level = env[start - 1] if start else env0
+            for i in range(start, len(rectified)):
+                alpha = self.alpha_attack if rectified[i] > level else self.alpha_release
+                level = alpha * level + (1 - alpha) * rectified[i]
+                env[i] = level
+
+        self.envelope = float(env[-1])
+        return env
+
+    def envelope_of(self, audio_data):
+        """
+        Computes the envelope of a block, advancing the follower state.
+
+        Parameters:
+            audio_data (np.ndarray): 1D block of samples.
+
+        Returns:
+            np.ndarray: float64 envelope of the block.
+        """
+        rectified = np.abs(np.asarray(audio_data, dtype=np.float64))
+        env = np.empty_like(rectified)
+        for start in range(0, len(rectified), self.sub_block):
+            stop = start + self.sub_block
+            env[start:stop] = self._follow(rectified[start:stop])
+        return env
+
+    def gain_of(self, envelope):
+        """
+        Converts an envelope into a linear gain using the static gain curve.
+
+        Parameters:
+            envelope (np.ndarray): Envelope values.
+
+        Returns:
+            np.ndarray: Linear gain for every sample.
+        """
+        level_dB = 20 * np.log10(envelope + 1e-8)
+        gain_dB = compute_gain_db(level_dB, self.threshold_dB, self.ratio, self.knee)
+        return 10 ** (gain_dB / 20)
+
+    def process(self, audio_data, out=None, progress=None):
+        """
+        Compresses a block of audio, continuing from the state left by the previous call.
+
+        Parameters:
+            audio_data (np.ndarray): 1D array of normalized audio samples.
+            out (np.ndarray, optional): Array to write the result into (may be audio_data).
+            progress (callable, optional): Called as progress(done, total) after every block.
+
+        Returns:
+            np.ndarray: The compressed block, clipped to [-1, 1].
+        """
+        if out is None:
+            out = np.empty_like(audio_data)
+        total = len(audio_data)
+        for start in range(0, total, self.block_size):
+            stop = min(start + self.block_size, total)
+            block = audio_data[start:stop]
+            gain = self.gain_of(self.envelope_of(block))
+            np.multiply(block, gain, out=out[start:stop], casting="unsafe")
+            np.clip(out[start:stop], -1, 1, out=out[start:stop])
+            if progress is not None:
+                progress(stop, total)
+        return out
+
+    def flush(self):
+        """Returns any buffered output. The compressor has no lookahead, so this is empty."""
+        return np.zeros(0, dtype=np.float32)
+
+
+def apply_volume_compression(audio_data, sample_rate,
+                             threshold_dB=-20.0, ratio=4.0,
+                             attack=0.01, release=0.1, knee=5.0,
+                             engine="block", block_size=65536, progress=None, out=None):
     """
     Applies dynamic range compression to the audio signal.
-    
+
+    The default "block" engine is vectorized and agrees with the per-sample
+    "reference" engine to within 1e-6 (absolute, on [-1, 1] samples).
+
     Parameters:
         audio_data (np.ndarray): 1D array of normalized audio samples (range [-1, 1]).
         sample_rate (int): Sampling rate of the audio.
@@ -14,21 +203,40 @@ def apply_volume_compression(audio_data, sample_rate,
         attack (float): Attack time in seconds (default: 0.01 s).
         release (float): Release time in seconds (default: 0.1 s).
         knee (float): Knee width in dB (default: 5 dB).
-        
+        engine (str): "block" (vectorized, default) or "reference" (per-sample loop).
+        block_size (int): Samples per block for the "block" engine.
+        progress (callable, optional): Called as progress(done, total) after every block.
+        out (np.ndarray, optional): float32 array for the result of the "block" engine (default: a
+            new one); it may be audio_data.
+
     Returns:
         np.ndarray: The compressed audio signal.
     """
+    if engine == "reference":
+        return _apply_volume_compression_reference(audio_data, sample_rate, threshold_dB,
+                                                   ratio, attack, release, knee)
+    if engine != "block":
+        raise ValueError(f"Unknown compression engine: {engine}")
+    compressor = VolumeCompressor(sample_rate, threshold_dB, ratio, attack, release, knee,
+                                  block_size=block_size)
+    return compressor.process(audio_data, out=out, progress=progress)
+
+
+def _apply_volume_compression_reference(audio_data, sample_rate,
+                                        threshold_dB=-20.0, ratio=4.0,
+                                        attack=0.01, release=0.1, knee=5.0):
+    """
+    Per-sample reference compressor. Slow; kept to validate the block engine.
+    """
     eps = 1e-8  # small constant to prevent log(0)
     output = np.zeros_like(audio_data)
-    envelope = np.zeros_like(audio_data)
-    gain = np.zeros_like(audio_data)
-    
+
     # Time constant coefficients for smoothing (attack and release)
     alpha_attack = np.exp(-1.0 / (sample_rate * attack))
     alpha_release = np.exp(-1.0 / (sample_rate * release))
-    
+
     env = 0.0  # initialize envelope
-    
+
     for i, sample in enumerate(audio_data):
         rectified = abs(sample)
         # Apply attack or release smoothing based on whether the current rectified signal is rising or falling.
@@ -36,11 +244,10 @@ def apply_volume_compression(audio_data, sample_rate,
             env = alpha_attack * env + (1 - alpha_attack) * rectified
         else:
             env = alpha_release * env + (1 - alpha_release) * rectified
-        envelope[i] = env
-        
+
         # Convert the envelope value to dB.
         level_dB = 20 * np.log10(env + eps)
-        
+
         # Calculate gain reduction based on the level relative to threshold and knee.
         if level_dB < threshold_dB - knee / 2:
             # Below knee region: no compression.
@@ -51,15 +258,11 @@ def apply_volume_compression(audio_data, sample_rate,
         else:
             # Within the knee region: apply a smooth quadratic interpolation.
             delta = level_dB - (threshold_dB - knee / 2)
-            gain_dB = -((1 / ratio - 1) * (delta ** 2) / (2 * knee))
-        
-        # Convert gain from dB to linear scale.
-        current_gain = 10 ** (gain_dB / 20)
-        gain[i] = current_gain
-        
-        # Apply the gain to the current sample.
-        output[i] = sample * current_gain
-    
+            gain_dB = (1 / ratio - 1) * (delta ** 2) / (2 * knee)
+
+        # Convert gain from dB to linear scale and apply it to the current sample.
+        output[i] = sample * 10 ** (gain_dB / 20)
+
     # Clip the output to ensure it stays within the normalized range [-1, 1].
     output = np.clip(output, -1, 1)
     return output
@@ -1,33 +1,129 @@
 import numpy as np
-import pyloudnorm as pyln
+from operations.loudness import measure_loudness, LoudnessMeter
 
-def apply_volume_normalization(audio_data, sample_rate, target_lufs=-16.0):
+def apply_volume_normalization(audio_data, sample_rate, target_lufs=-16.0, out=None):
     """
     Normalizes the volume of the audio signal to the target LUFS level using ITU BS.1770 standard.
     
     Parameters:
-        audio_data (np.ndarray): 1D array of audio samples (range typically in [-1, 1]).
+        audio_data (np.ndarray): 1D array of audio samples (range typically in [-1, 1]), or a
+            (channels, samples) array; all channels get the same gain, from their combined loudness.
         sample_rate (int): Sampling rate of the audio.
         target_lufs (float): The target integrated loudness in LUFS (default is -16 LUFS for voiceovers).
+        out (np.ndarray, optional): float32 array for the result (default: a new one); it may be audio_data.
     
     Returns:
         np.ndarray: Volume-normalized audio data.
     """
-    # Create a loudness meter instance from pyloudnorm
-    meter = pyln.Meter(sample_rate)
-    
-    # Measure the integrated loudness of the input audio
-    loudness = meter.integrated_loudness(audio_data)
-    
     # Calculate the gain required to reach the target loudness
-    gain = target_lufs - loudness
-    
-    # Apply gain (convert dB gain to linear scaling)
-    linear_gain = 10**(gain / 20)
-    
-    # Normalize audio
-    normalized_audio = audio_data * linear_gain
+    gain = normalization_gain_db(audio_data, sample_rate, target_lufs)
     
-    # Optionally, clip to ensure the signal remains in the valid range
-    normalized_audio = np.clip(normalized_audio, -1, 1)
-    return normalized_audio
+    # Apply gain and clip to ensure the signal remains in the valid range
+    return LinearGain(gain).process(audio_data, out=out)
+
+
+def normalization_gain_db(audio_data, sample_rate, target_lufs=-16.0, block_size=65536, measured_lufs=None):
+    """
+    Returns the gain in dB that brings audio_data to target_lufs.
+
+    Silence has no defined loudness; it gets 0 dB. The loudness is measured block by block
+    with LoudnessMeter (the same measurement as pyloudnorm), so no full-length float64
+    copies of the signal are made. When measured_lufs is given (e.g. stored by an earlier
+    run), the signal is not read at all.
+    """
+    if measured_lufs is None:
+        measured_lufs = measure_loudness(audio_data, sample_rate, block_size, true_peak=False).integrated_loudness()
+    if not np.isfinite(measured_lufs):
+        return 0.0
+    return target_lufs - measured_lufs
+
+
+class LinearGain:
+    """
+    Applies a fixed gain in dB and clips to [-1, 1]; the streaming form of the normalization step.
+    """
+
+    latency = 0
+
+    def __init__(self, gain_dB):
+        self.linear_gain = float(10 ** (gain_dB / 20))
+
+    def process(self, audio_data, out=None):
+        """
+        Parameters:
+            audio_data (np.ndarray): Block of samples.
+            out (np.ndarray, optional): float32 array to write the result into (may be audio_data).
+        """
+        if out is None:
+            out = np.empty(np.shape(audio_data), dtype=np.float32)
+        np.multiply(audio_data, self.linear_gain, out=out, casting="unsafe")
+        return np.clip(out, -1, 1, out=out)
+
+    def flush(self):
+        return np.zeros(0, dtype=np.float32)
+
+
+class StreamingLoudnessNormalizer:
+    """
+    Single-pass loudness normalization with a fixed lookahead.
+
+    The output is delayed by `lookahead` seconds. Every block is metered as it arrives,
+    and the gain applied to the samples leaving the delay line is the one that brings
+    everything measured so far (including the lookahead) to the target. The gain moves
+    linearly across each block, so it never jumps, and it is limited to max_gain_dB.
+    Once the integrated loudness settles, which for speech takes well under a minute,
+    the result matches whole-file normalization; the opening seconds are normalized
+    from the lookahead alone. Blocks may be (channels, samples) arrays; every channel
+    gets the same gain.
+    """
+
+    def __init__(self, sample_rate, target_lufs=-16.0, lookahead=3.0, max_gain_dB=30.0):
+        """
+        Parameters:
+            sample_rate (int): Sampling rate of the audio.
+            target_lufs (float): The target integrated loudness in LUFS.
+            lookahead (float): Seconds of audio metered before the first output sample; the latency.
+            max_gain_dB (float): Largest boost or cut applied, e.g. while only room tone has been heard.
+        """
+        self.target_lufs = target_lufs
+        self.max_gain_dB = max_gain_dB
+        self.latency = int(lookahead * sample_rate)
+        self._meter = LoudnessMeter(sample_rate, true_peak=False)
+        # Delay line, shaped like the blocks once the first one arrives.
+        self._delay = None
+        self._gain = None
+
+    def _target_gain(self):
+        loudness = self._meter.integrated_loudness()
+        if not np.isfinite(loudness):
+            # Nothing above the gate yet: keep the current gain (unity at the start).
+            return self._gain if self._gain is not None else 1.0
+        gain_dB = np.clip(self.target_lufs - loudness, -self.max_gain_dB, self.max_gain_dB)
+        return float(10 ** (gain_dB / 20))
+
+    def process(self, audio_data):
+        """Returns as many samples as given, `latency` samples behind, with the gain applied and clipped."""
+        audio_data = np.asarray(audio_data, dtype=np.float32)
+        n = audio_data.shape[-1]
+        if self._delay is None:
+            self._delay = np.zeros(audio_data.shape[:-1] + (self.latency,), dtype=np.float32)
+        if not n:
+            return np.zeros(audio_data.shape, dtype=np.float32)
+        self._meter.update(audio_data)
+        target = self._target_gain()
+        start = self._gain if self._gain is not None else target
+        buffered = np.concatenate((self._delay, audio_data), axis=-1)
+        out = buffered[..., :n]
+        self._delay = buffered[..., n:]
+        ramp = start + (target - start) * np.arange(1, n + 1, dtype=np.float32) / n
+        out *= ramp
+        self._gain = target
+        return np.clip(out, -1, 1, out=out)
+
+    def flush(self):
+        """Finishes the stream, returning the `latency` samples still held back."""
+        if self._delay is None:
+            return np.zeros(self.latency, dtype=np.float32)
+        out = self._delay * np.float32(self._gain if self._gain is not None else 1.0)
+        self._delay = self._delay[..., :0]
+        return np.clip(out, -1, 1, out=out)
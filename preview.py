@@ -0,0 +1,280 @@
+"""
+Fast previews of a processing chain on a loaded file, for tuning its settings.
+
+A PreviewSession runs the selected operations on a short window of the audio loaded in an
+AudioProcessor, or on a few excerpts spread over it, so the effect of a setting shows within
+about a second instead of after a full render. The loaded audio is never modified: every
+preview processes copies, and the previews are kept with their settings, so they can be
+compared A/B with the original and with each other.
+
+Every range is processed with context_seconds of audio before and after it, which is cut off
+again, so adaptive and smoothed stages (the echo canceller, the noise tracker, the compressor's
+envelope) have settled where the range starts. What depends on the whole file is measured on
+the whole file, once per session:
+- the integrated loudness, which Volume Normalization's gain follows when it is the first
+  operation, as in the full render;
+- with stationary Noise Reduction and no noise profile set, the noise profile of the file;
+- with an activity gate, the active segments of the file.
+
+commit_parameters() hands this warmed-up state to the full render: the learned noise profile,
+the loudness (stored in the processor's cache, or passed on without one), and for mono audio
+the echo canceller's weights as the previews' Echo Reduction left them, each range continuing
+from the last, so the render's Echo Reduction starts converged instead of from zero. Multichannel
+audio runs a canceller per channel, so its render starts from zero.
+"""
+import time
+
+import numpy as np
+
+from operations.multichannel import frame_count
+from processing import OPERATIONS, AudioProcessor, sort_operations
+
+# Seconds of audio processed before and after every previewed range, and cut off again.
+CONTEXT_SECONDS = 1.0
+
+# Without a window: the number of excerpts previewed, spread evenly over the file, and their length.
+EXCERPTS = 3
+EXCERPT_SECONDS = 2.0
+
+# Longest window previewed, in seconds; a longer one is cut to this around its middle.
+MAX_WINDOW_SECONDS = 10.0
+
+# Silence between excerpts when they are joined for display, in seconds.
+GAP_SECONDS = 0.25
+
+
+def join_excerpts(excerpts, sample_rate, gap_seconds=GAP_SECONDS):
+    """Joins excerpts (1D or (channels, samples) arrays) into one signal, separated by silence."""
+    gap = np.zeros(excerpts[0].shape[:-1] + (int(gap_seconds * sample_rate),), dtype=np.float32)
+    pieces = []
+    for excerpt in excerpts:
+        pieces += [excerpt, gap]
+    return np.concatenate(pieces[:-1], axis=-1).astype(np.float32, copy=False)
+
+
+class Preview:
+    """Processed excerpts of the loaded audio, with the operations and parameters that made them."""
+
+    def __init__(self, operations, parameters, ranges, excerpts, sample_rate, seconds):
+        """
+        Parameters:
+            operations (list): Operation names applied, in OPERATION_ORDER (empty for the original).
+            parameters (dict): Parameter overrides by operation they ran with.
+            ranges (list): [start, stop) sample ranges of the loaded audio the excerpts cover.
+            excerpts (list): Processed audio of each range.
+            sample_rate (int): Sample rate of the audio.
+            seconds (float): Time the preview took.
+        """
+        self.operations = operations
+        self.parameters = parameters
+        self.ranges = ranges
+        self.excerpts = excerpts
+        self.sample_rate = sample_rate
+        self.seconds = seconds
+
+    def audio(self, gap_seconds=GAP_SECONDS):
+        """The excerpts joined into one signal (see join_excerpts)."""
+        return join_excerpts(self.excerpts, self.sample_rate, gap_seconds)
+
+    def levels(self):
+        """Returns {"peak_db": ..., "rms_db": ...}: peak and RMS level of the excerpts in dBFS."""
+        peak = max(float(np.abs(excerpt).max(initial=0.0)) for excerpt in self.excerpts)
+        power = (sum(float(np.vdot(excerpt, excerpt)) for excerpt in self.excerpts)
+                 / max(1, sum(excerpt.size for excerpt in self.excerpts)))
+        return {"peak_db": float(20 * np.log10(peak + 1e-12)), "rms_db": float(10 * np.log10(power + 1e-12))}
+
+    def describe(self):
+        """One line for logs: what ran, on how much audio, the levels and the time taken."""
+        levels = self.levels()
+        covered = sum(stop - start for start, stop in self.ranges) / self.sample_rate
+        return (f"{' + '.join(self.operations) or 'Original'}: {len(self.ranges)} range(s), {covered:.1f} s, "
+                f"peak {levels['peak_db']:.1f} dBFS, RMS {levels['rms_db']:.1f} dBFS ({self.seconds:.2f} s)")
+
+
+class PreviewSession:
+    """
+    Previews of operations on the audio loaded in an AudioProcessor; see the module docstring.
+    Create one per loaded file, before rendering it.
+    """
+
+    def __init__(self, processor, context_seconds=CONTEXT_SECONDS):
+        """
+        Parameters:
+            processor (AudioProcessor): Holds the loaded audio. Previews run with its parameters,
+                activity gate and channel workers, and measure through its cache.
+            context_seconds (float): Audio processed before and after every previewed range.
+        """
+        self.processor = processor
+        # Reads measurements of the loaded audio through the processor's cache; never runs a step.
+        # A processor with an arena reuses its buffers, so it gets a copy of the audio.
+        self.source = AudioProcessor(cache=processor.cache)
+        self.source.audio_data = processor.audio_data if processor.arena is None else processor.audio_data.copy()
+        self.source.sample_rate = processor.sample_rate
+        self.source.cache_key = processor.cache_key
+        self.pyramid = processor.pyramid
+        self.context = int(context_seconds * processor.sample_rate)
+        self.previews = []
+        # Runs the previews, reused so its channel workers are started once.
+        self._runner = None
+        self._noise_profile = None
+        # (Echo Reduction parameters, EchoWeights adapted by the previews with them)
+        self._echo = None
+
+    @property
+    def audio_data(self):
+        """The loaded audio, as it was loaded."""
+        return self.source.audio_data
+
+    @property
+    def sample_rate(self):
+        return self.source.sample_rate
+
+    def close(self):
+        """Shuts down the channel workers of the previews, if any were started."""
+        if self._runner is not None:
+            self._runner.close()
+            self._runner = None
+
+    def restore(self):
+        """Puts the loaded audio back into the processor, e.g. to render it again with other settings."""
+        processor = self.processor
+        processor.audio_data = self.audio_data if processor.arena is None else self.audio_data.copy()
+        processor.sample_rate = self.sample_rate
+        processor.cache_key = self.source.cache_key
+        processor.activity = None
+        processor.pyramid = self.pyramid
+
+    def ranges(self, window=None, excerpts=EXCERPTS, excerpt_seconds=EXCERPT_SECONDS):
+        """
+        Returns the [start, stop) sample ranges to preview: the window, at most MAX_WINDOW_SECONDS
+        around its middle, or without one, excerpts of excerpt_seconds centred at evenly spaced
+        points of the file (the whole file when it is shorter than them together).
+        """
+        length = frame_count(self.audio_data)
+        if window is not None:
+            start, stop = max(0, int(window[0])), min(length, int(window[1]))
+            limit = int(MAX_WINDOW_SECONDS * self.sample_rate)
+            if stop - start > limit:
+                start = (start + stop - limit) // 2
+                stop = start + limit
+            return [(start, stop)] if stop > start else [(0, length)]
+        size = int(excerpt_seconds * self.sample_rate)
+        if excerpts * size >= length:
+            return [(0, length)]
+        centres = [length * (i + 1) // (excerpts + 1) for i in range(excerpts)]
+        starts = [min(max(0, centre - size // 2), length - size) for centre in centres]
+        return [(start, start + size) for start in starts]
+
+    def original(self, preview):
+        """A Preview of the untouched audio over the ranges of preview, its A/B reference."""
+        excerpts = [self.audio_data[..., start:stop] for start, stop in preview.ranges]
+        return Preview([], {}, preview.ranges, excerpts, self.sample_rate, 0.0)
+
+    def noise_profile(self):
+        """The NoiseProfile of the whole loaded audio, learned from its quietest tenth on first use."""
+        if self._noise_profile is None:
+            from operations.noise_reduction import NoiseProfile
+            self._noise_profile = NoiseProfile.learn(self.audio_data, self.sample_rate, quietest=0.1)
+        return self._noise_profile
+
+    def _echo_parameters(self):
+        parameters = self.processor.operation_parameters("Echo Reduction")
+        parameters.pop("initial_weights", None)
+        return parameters
+
+    def _echo_adapted(self, parameters):
+        # Callback for a preview's Echo Reduction: keeps the canceller's final weights, and has the
+        # preview's next range (run with parameters) start from them.
+        def adapted(weights):
+            self._echo = (self._echo_parameters(), weights)
+            parameters["initial_weights"] = weights
+        return adapted
+
+    def _warm_parameters(self, operations, preview):
+        # Parameter overrides carrying the warmed-up state, by operation.
+        warm = {}
+        noise = self.processor.operation_parameters("Noise Reduction")
+        if "Noise Reduction" in operations and noise.get("stationary") and noise.get("noise_profile") is None:
+            warm["Noise Reduction"] = {"noise_profile": self.noise_profile()}
+        if "Echo Reduction" in operations and self._echo is not None and self._echo[0] == self._echo_parameters():
+            warm["Echo Reduction"] = {"initial_weights": self._echo[1]}
+        # With a cache, the render reads the loudness stored by input_loudness() itself.
+        if operations and operations[0] == "Volume Normalization" and (preview or self.processor.cache is None):
+            warm["Volume Normalization"] = {"measured_lufs": self.source.input_loudness()}
+        return warm
+
+    def _parameters(self, operations, preview):
+        parameters = {op: dict(values) for op, values in self.processor.parameters.items()}
+        for op, values in self._warm_parameters(sort_operations(operations), preview).items():
+            parameters.setdefault(op, {}).update(values)
+        return parameters
+
+    def commit_parameters(self, operations):
+        """
+        Returns the parameters to render the whole file with operations: the processor's own,
+        plus the state warmed up by the previews (see the module docstring).
+        """
+        return self._parameters(operations, preview=False)
+
+    def _activity(self, operations):
+        # The ActivityMap of the whole loaded audio, when the chain is gated.
+        gate = self.processor.activity_gate
+        if gate is None or not any(OPERATIONS[op].gated for op in operations):
+            return None
+        if self.source.activity_gate is None or self.source.activity_gate.settings() != gate.settings():
+            self.source.activity = None
+        self.source.activity_gate = gate
+        return self.source.activity_map()
+
+    def preview(self, operations, window=None, excerpts=EXCERPTS, excerpt_seconds=EXCERPT_SECONDS, progress=None,
+                partial=None):
+        """
+        Runs operations on copies of a window of the loaded audio, or of excerpts of it.
+
+        Parameters:
+            operations (list): Operation names.
+            window (tuple, optional): (start, stop) samples to preview; see ranges().
+            excerpts (int): Without a window, the number of excerpts.
+            excerpt_seconds (float): Without a window, the length of each excerpt.
+            progress (callable, optional): Called as progress(done, total) while the preview runs.
+                It may raise ProcessingCancelled to stop it.
+            partial (callable, optional): Called with a Preview of the excerpts done so far after
+                each excerpt, so a display can refine as they come in.
+
+        Returns:
+            Preview: The processed excerpts, also appended to self.previews.
+        """
+        started = time.perf_counter()
+        operations = sort_operations(operations)
+        ranges = self.ranges(window, excerpts, excerpt_seconds)
+        parameters = self._parameters(operations, preview=True)
+        activity = self._activity(operations)
+        if self._runner is None:
+            self._runner = AudioProcessor(channel_workers=self.processor.channel_workers)
+        runner = self._runner
+        runner.parameters = {op: dict(values) for op, values in parameters.items()}
+        if "Echo Reduction" in operations and self.audio_data.ndim == 1:
+            echo = runner.parameters.setdefault("Echo Reduction", {})
+            echo["adapted"] = self._echo_adapted(echo)
+        runner.activity_gate = self.processor.activity_gate
+        steps = runner.plan(operations)
+        total = max(1, len(ranges) * len(steps))
+        length = frame_count(self.audio_data)
+
+        excerpts = []
+        for i, (start, stop) in enumerate(ranges):
+            low, high = max(0, start - self.context), min(length, stop + self.context)
+            runner.audio_data = self.audio_data[..., low:high].copy()
+            runner.sample_rate = self.sample_rate
+            runner.activity = activity.excerpt(low, high) if activity is not None else None
+            for j, step in enumerate(steps):
+                done = i * len(steps) + j
+                runner.run_step(step, progress and (lambda d, t, done=done: progress(done + d / max(t, 1), total)))
+            excerpts.append(np.ascontiguousarray(runner.audio_data[..., start - low:stop - low]))
+            runner.audio_data = None
+            if partial is not None:
+                partial(Preview(operations, parameters, ranges[:i + 1], list(excerpts), self.sample_rate,
+                                time.perf_counter() - started))
+        preview = Preview(operations, parameters, ranges, excerpts, self.sample_rate, time.perf_counter() - started)
+        self.previews.append(preview)
+        return preview
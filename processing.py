@@ -1,40 +1,1083 @@
+import contextlib
+import functools
+import importlib
+import inspect
+import multiprocessing
+import os
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.util import Finalize
 import numpy as np
 import soundfile as sf
-from pydub import AudioSegment
-from operations.noise_reduction import apply_noise_reduction
+from operations.spectral import SpectralStage, apply_spectral_stages, negotiate_stft
+from operations.pointwise import PointwiseChain
+from operations.multichannel import ChannelStages, channel_count, frame_count
+from waveform import WaveformPyramid
+from cache import chain_key, file_key
+from audio_io import AudioWriter, atomic_output, output_format, read_audio, write_audio
+
+
+class ProcessingCancelled(Exception):
+    """Raised from a progress callback to stop an operation at the next block boundary."""
+
+
+class LazyObject:
+    """
+    A function or class of another module, imported the first time it is called or inspected.
+
+    The registry refers to every operation's functions this way, so importing this module
+    loads none of their dependencies (noisereduce, librosa, nara_wpe, pyloudnorm and the
+    SciPy modules behind them); running a pipeline imports only what its operations use.
+    """
+
+    def __init__(self, path):
+        """
+        Parameters:
+            path (str): "module:name", e.g. "operations.echo_reduction:apply_echo_reduction".
+        """
+        self.path = path
+        self._target = None
+
+    def resolve(self):
+        """Imports the module if needed and returns the object."""
+        if self._target is None:
+            module, _, name = self.path.partition(":")
+            self._target = getattr(importlib.import_module(module), name)
+        return self._target
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    @property
+    def __signature__(self):
+        return inspect.signature(self.resolve())
+
+    def __repr__(self):
+        return f"LazyObject({self.path!r})"
+
+
+# An operation and the forms it can run in:
+#   apply(audio_data, sample_rate, ...) -> audio_data: the whole-buffer function. Its keyword
+#       defaults are the operation's parameters (see operation_parameters).
+#   spectral: SpectralStage, if it can share an STFT with neighbouring spectral operations.
+#   streaming(sample_rate, **parameters) -> stage for block-by-block processing, or None.
+#   pointwise(audio_data, sample_rate, **parameters) -> in-place stages for a PointwiseChain,
+#       or None. It is given the operation's input, so one that measures it must start a run.
+#   measures_input: True when pointwise needs the integrated loudness of the whole input; it is
+#       passed in as measured_lufs (see AudioProcessor.input_loudness), unless the processor's
+#       parameters already give one.
+#   multichannel: True when apply, pointwise and streaming take all channels of multichannel audio
+#       at once, as (channels, samples) arrays (streaming is then also given channels=). Any other
+#       operation treats channels independently and is run once per channel, in parallel.
+#   gated: True when the operation may be run on the active segments of a recording only, with
+#       its silences treated cheaply instead (see AudioProcessor's activity_gate).
+#   skip(analysis, **parameters) -> str or None: why the operation is not needed on a file with
+#       this analysis (see operations.analysis), or None when it is. An operation that measures its
+#       input is only skipped or tuned when nothing runs before it (see AudioProcessor.adapt).
+#   tune(analysis, **parameters) -> dict: parameters fitted to a file with this analysis, used
+#       where the processor's parameters do not set them.
+# The functions may be LazyObjects, so an operation's module is imported only once it is used.
+Operation = namedtuple("Operation", ["name", "apply", "spectral", "streaming", "pointwise", "measures_input",
+                                     "multichannel", "gated", "skip", "tune"],
+                       defaults=(False, False, None, None))
+
+# Samples per block of a fused pointwise pass; the compressor's block size, so fusing does not
+# change its result.
+POINTWISE_BLOCK = 65536
+
+
+def _dereverberate_stage(stft_audio, sample_rate, n_fft, hop_length, taps=10, delay=3, workers=1, **parameters):
+    from operations.reverb_reduction import dereverberate_spectrogram
+    # WPE taps and delay are counted in frames; keep the time span they had at the preferred hop.
+    scale = 128 / hop_length
+    return dereverberate_spectrogram(stft_audio, taps=max(1, round(taps * scale)), delay=max(1, round(delay * scale)),
+                                     workers=workers, **parameters)
+
+
+def _normalization_stages(audio_data, sample_rate, target_lufs=-16.0, measured_lufs=None):
+    from operations.volume_normalization import LinearGain, normalization_gain_db
+    return [LinearGain(normalization_gain_db(audio_data, sample_rate, target_lufs, measured_lufs=measured_lufs))]
+
+
+def _compression_stages(audio_data, sample_rate, threshold_dB=-20.0, ratio=4.0, attack=0.01, release=0.1,
+                        knee=5.0, engine="block", block_size=POINTWISE_BLOCK):
+    from operations.volume_compression import VolumeCompressor
+
+    def compressor():
+        return VolumeCompressor(sample_rate, threshold_dB, ratio, attack, release, knee, block_size=block_size)
+    if audio_data.ndim == 1:
+        return [compressor()]
+    # Each channel is compressed on its own envelope.
+    return [ChannelStages([compressor() for _ in range(channel_count(audio_data))])]
+
+
+# Volume Normalization is skipped on files this close to its target, in LU.
+LOUDNESS_TOLERANCE = 0.5
+
+# Noise Reduction is skipped on files whose noise floor is this low, in dBFS.
+QUIET_NOISE_FLOOR_DB = -65.0
+
+# Echo Reduction's reference delay is set this many milliseconds ahead of a detected echo, so
+# the echo lands on the first taps of the filter even when its estimate is rounded up.
+ECHO_DELAY_LEAD_MS = 1.0
+
+
+def _skip_normalization(analysis, target_lufs=-16.0, **parameters):
+    if abs(analysis["integrated_lufs"] - target_lufs) <= LOUDNESS_TOLERANCE:
+        return f"already at {analysis['integrated_lufs']:.1f} LUFS"
+    return None
+
+
+def _tune_normalization(analysis, **parameters):
+    # The analysis has metered the file already.
+    if not np.isfinite(analysis["integrated_lufs"]):
+        return {}
+    return {"measured_lufs": analysis["integrated_lufs"]}
+
+
+def _skip_noise_reduction(analysis, noise_profile=None, **parameters):
+    # A given profile says what the noise is, whatever the level measured.
+    if noise_profile is None and analysis["noise_floor_db"] <= QUIET_NOISE_FLOOR_DB:
+        return f"noise floor at {analysis['noise_floor_db']:.1f} dBFS"
+    return None
+
+
+def _skip_echo_reduction(analysis, **parameters):
+    if analysis["echo_delay_ms"] is None:
+        return "no echo detected"
+    return None
+
+
+def _tune_echo_reduction(analysis, **parameters):
+    # The far-end reference is the input delayed by delay_ms, and the filter covers the filter_length
+    # samples after that: start it at the detected echo instead of at a fixed 50 ms.
+    if analysis["echo_delay_ms"] is None:
+        return {}
+    return {"delay_ms": round(max(0.0, analysis["echo_delay_ms"] - ECHO_DELAY_LEAD_MS), 1)}
+
+
+def _streaming(path, *names):
+    # Streaming factory passing on the listed parameters of the whole-buffer function to the
+    # stage class at path ("module:name"), imported on first use.
+    cls = LazyObject(path)
+    return lambda sample_rate, **parameters: cls(sample_rate, **{name: parameters[name] for name in names
+                                                                  if name in parameters})
+
+
+# Registered operations in the industry-standard order in which they are applied.
+OPERATIONS = {}
+
+# Operation names in application order.
+OPERATION_ORDER = []
+
+
+def register_operation(operation):
+    """Adds an Operation to the registry, applied after every operation registered before it."""
+    OPERATIONS[operation.name] = operation
+    if operation.name not in OPERATION_ORDER:
+        OPERATION_ORDER.append(operation.name)
+
+
+register_operation(Operation(
+    "Noise Reduction", LazyObject("operations.noise_reduction:apply_noise_reduction"),
+    spectral=SpectralStage("Noise Reduction", LazyObject("operations.noise_reduction:reduce_noise_spectrogram"),
+                           1024, 256),
+    streaming=_streaming("operations.noise_reduction:StreamingNoiseReducer", "noise_profile", "n_fft",
+                         "time_mask_smooth_ms"), pointwise=None,
+    measures_input=False, skip=_skip_noise_reduction))
+register_operation(Operation(
+    "Echo Reduction", LazyObject("operations.echo_reduction:apply_echo_reduction"), spectral=None,
+    streaming=_streaming("operations.echo_reduction:EchoCanceller", "filter_length", "mu", "delay_ms", "block_size",
+                         "initial_weights"),
+    pointwise=None, measures_input=False, gated=True, skip=_skip_echo_reduction, tune=_tune_echo_reduction))
+register_operation(Operation(
+    "Reverb Reduction", LazyObject("operations.reverb_reduction:apply_reverb_reduction"),
+    spectral=SpectralStage("Reverb Reduction", _dereverberate_stage, 512, 128, multichannel=True),
+    streaming=_streaming("operations.reverb_reduction:StreamingReverbReducer", "n_fft", "hop_length", "iterations",
+                         "taps", "delay", "channels", "workers", "max_memory", "segment_seconds"), pointwise=None,
+    measures_input=False, multichannel=True, gated=True))
+register_operation(Operation(
+    "Volume Normalization", LazyObject("operations.volume_normalization:apply_volume_normalization"), spectral=None,
+    streaming=_streaming("operations.volume_normalization:StreamingLoudnessNormalizer", "target_lufs", "lookahead"),
+    pointwise=_normalization_stages, measures_input=True, multichannel=True, skip=_skip_normalization,
+    tune=_tune_normalization))
+register_operation(Operation(
+    "Volume Compression", LazyObject("operations.volume_compression:apply_volume_compression"), spectral=None,
+    streaming=_streaming("operations.volume_compression:VolumeCompressor", "threshold_dB", "ratio", "attack",
+                         "release", "knee"),
+    pointwise=_compression_stages, measures_input=False, gated=True))
+
+# Parameters that change how an operation runs but not its result, left out of cache keys. An
+# operation taking workers is given the processor's channel_workers, and one taking out is given
+# a buffer from the processor's arena, if it has one; adapted reports Echo Reduction's final state.
+_EXECUTION_PARAMETERS = ("progress", "workers", "out", "adapted")
+
+
+def operation_parameters(operation):
+    """
+    Returns the parameters an operation runs with, e.g. {"target_lufs": -16.0} for
+    Volume Normalization. These identify its results in the ResultCache.
+    """
+    signature = inspect.signature(OPERATIONS[operation].apply)
+    return {name: param.default for name, param in signature.parameters.items()
+            if param.default is not inspect.Parameter.empty and name not in _EXECUTION_PARAMETERS}
+
+
+def sort_operations(operations):
+    """
+    Sorts operation names into OPERATION_ORDER. Unknown names go last, in their given order.
+    """
+    order_map = {op: i for i, op in enumerate(OPERATION_ORDER)}
+    return sorted(operations, key=lambda op: order_map.get(op, len(OPERATION_ORDER)))
+
+
+def plan_operations(operations, gated=False):
+    """
+    Sorts operations into OPERATION_ORDER and groups them into the passes that run them.
+
+    - "spectral": two or more consecutive spectral operations sharing one STFT.
+    - "pointwise": consecutive gain/clip/compression operations fused into one blocked,
+      in-place pass (see PointwiseChain). A lone pointwise operation is also run this way,
+      so its result does not depend on what it is grouped with.
+    - "whole": any other operation, run by its whole-buffer function.
+
+    With gated set, every gated operation is a step of its own, run on the active segments only.
+
+    Returns:
+        list: (kind, [operation names]) steps in application order.
+    """
+    operations = sort_operations(operations)
+    for op in operations:
+        if op not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {op}")
+    steps = []
+    for op in operations:
+        entry = OPERATIONS[op]
+        if steps and not (gated and (entry.gated or any(OPERATIONS[p].gated for p in steps[-1][1]))):
+            kind, run = steps[-1]
+            if entry.spectral is not None and all(OPERATIONS[p].spectral is not None for p in run):
+                steps[-1] = ("spectral", run + [op])
+                continue
+            if kind == "pointwise" and entry.pointwise is not None and not entry.measures_input:
+                run.append(op)
+                continue
+        steps.append(("pointwise" if entry.pointwise is not None else "whole", [op]))
+    return steps
+
+
+def warm_up(operations=None, modules=()):
+    """
+    Imports what the given operations (default: every registered one) run with, and any other
+    modules named, and compiles the STFT of spectral operations, so their first run does not
+    wait for either. A module that fails to import is skipped; the operation reports the error
+    when it runs.
+
+    Parameters:
+        operations (list, optional): Operation names.
+        modules (iterable): Further module names, e.g. a GUI's plotting backend.
+    """
+    names = []
+    spectral = False
+    for op in OPERATION_ORDER if operations is None else operations:
+        entry = OPERATIONS[op]
+        lazy = [member for member in (entry.apply, entry.spectral and entry.spectral.function)
+                if isinstance(member, LazyObject)]
+        names += [member.path.partition(":")[0] for member in lazy]
+        if entry.spectral is not None:
+            # The shared STFT of spectral steps. librosa imports its submodules on first use, so
+            # the one holding stft/istft is named.
+            names.append("librosa.core.spectrum")
+            spectral = True
+    for name in names + list(modules):
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass
+    if spectral:
+        # librosa's overlap-add is compiled by numba on its first call.
+        try:
+            apply_spectral_stages(np.zeros(4096, dtype=np.float32), 16000, [], 512, 128)
+        except Exception:
+            pass
+
+
+def start_warm_up(operations=None, modules=()):
+    """
+    Runs warm_up on a daemon thread, e.g. once a window is showing, and returns the thread.
+    """
+    thread = threading.Thread(target=warm_up, args=(operations, modules), name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def make_streaming_stage(operation, sample_rate, channels=1, workers=None, **parameters):
+    """
+    Creates the stateful, block-by-block form of an operation, with its default parameters
+    unless given others.
+
+    Every stage has process(block) returning as many samples as it is given, delayed by
+    its `latency` attribute. The streaming form of Volume Normalization follows the loudness
+    with a lookahead rather than measuring the whole input first; see
+    AudioProcessor.process_file_streaming for the exact form.
+
+    With channels > 1 the stage processes (channels, samples) blocks. Operations that treat
+    channels independently get one stage per channel, run on up to `workers` threads; an
+    operation with workers of its own (e.g. Reverb Reduction) is given `workers`.
+    """
+    entry = OPERATIONS.get(operation)
+    if entry is None or entry.streaming is None:
+        raise ValueError(f"No streaming form for operation: {operation}")
+    parameters = dict(operation_parameters(operation), **parameters)
+    parameters.setdefault("workers", workers)
+    if channels == 1:
+        return entry.streaming(sample_rate, **parameters)
+    if entry.multichannel:
+        return entry.streaming(sample_rate, channels=channels, **parameters)
+    return ChannelStages([entry.streaming(sample_rate, **parameters) for _ in range(channels)], workers)
+
+
+def _read_blocks(filepath, block_size):
+    """
+    Yields (sample_rate, float32 block) pairs from an audio file; blocks are 1D for mono
+    audio and (channels, samples) otherwise.
+
+    Formats libsndfile can read are decoded block by block; anything else is
+    decoded through pydub first and then handed out in blocks.
+    """
+    try:
+        source = sf.SoundFile(filepath)
+    except RuntimeError:
+        processor = AudioProcessor()
+        processor.load_audio(filepath)
+        for start in range(0, frame_count(processor.audio_data), block_size):
+            yield processor.sample_rate, processor.audio_data[..., start:start + block_size]
+        return
+    with source:
+        for block in source.blocks(blocksize=block_size, dtype="float32", always_2d=True):
+            yield source.samplerate, np.ascontiguousarray(block.T) if block.shape[1] > 1 else block[:, 0]
+
+
+def _step_key(previous_key, kind, operations, parameters_of=operation_parameters):
+    """
+    Cache key of the result of a plan step. Pointwise and single-operation steps give the same
+    result however they are grouped, so they chain the per-operation keys. A shared-STFT result
+    differs slightly from running its stages one by one, so it is keyed as a step of its own.
+    parameters_of(operation) gives the parameters each operation runs with.
+    """
+    if kind == "spectral":
+        parameters = {op: parameters_of(op) for op in operations}
+        parameters["stft"] = negotiate_stft([OPERATIONS[op].spectral for op in operations])
+        return chain_key(previous_key, " + ".join(operations), parameters)
+    for op in operations:
+        previous_key = chain_key(previous_key, op, parameters_of(op))
+    return previous_key
+
+
+def _apply_to_channel(operation, audio_data, sample_rate, parameters):
+    # Runs one channel through an operation in a channel worker process.
+    return OPERATIONS[operation].apply(audio_data, sample_rate, **parameters)
+
 
 class AudioProcessor:
-    def __init__(self):
+    def __init__(self, keep_overview=False, cache=None, telemetry=None, parameters=None, channel_workers=None,
+                 arena=None, activity_gate=None):
+        """
+        Parameters:
+            keep_overview (bool): Maintain a WaveformPyramid of audio_data for plotting. Loaded files
+                get a sidecar overview so reopening them does not rescan the samples.
+            cache (ResultCache, optional): Store every stage result, and reuse stored results when the
+                same file is processed with the same operations and parameters again.
+            telemetry (Telemetry, optional): Record time, memory and throughput of decoding, every
+                processing step and encoding.
+            parameters (dict, optional): Parameters overriding operation defaults, by operation, e.g.
+                {"Noise Reduction": {"noise_profile": NoiseProfile.load("room.npz")}}.
+            channel_workers (int, optional): Channels of multichannel audio processed at once by
+                operations that treat them independently (default: CPU count). Whole-buffer
+                operations use that many worker processes, the others threads.
+            arena (BufferArena, optional): Run in buffer-arena mode: every step writes its float32
+                result into a buffer borrowed from the arena (operations taking out= write straight
+                into it, spectral steps also borrow their complex64 spectrogram), the buffer it
+                replaces goes back to the arena, and pointwise steps run in place. Peak memory is
+                then about two float32 copies of the audio plus the working memory of one step.
+                audio_data then belongs to the processor: copy it to keep it past the next step.
+            activity_gate (ActivityGate, optional): Run gated operations (Echo Reduction, Reverb
+                Reduction, Volume Compression) on the active segments of the audio only, treating
+                the silences between them cheaply (see operations.activity). Activity is detected
+                once, on the input of the first gated step, and the segmentation is reused by every
+                later step until other audio is loaded. Streaming runs are not gated.
+
+        audio_data is a float32 array, 1D for mono audio and (channels, samples) otherwise.
+        """
         self.audio_data = None
         self.sample_rate = None
+        self.keep_overview = keep_overview
+        self.pyramid = None
+        self.cache = cache
+        # Cache key of audio_data: the loaded file's hash chained with every operation applied since.
+        self.cache_key = None
+        self.telemetry = telemetry
+        self.parameters = parameters if parameters is not None else {}
+        self.channel_workers = channel_workers or os.cpu_count() or 1
+        self._channel_pool = None
+        self.arena = arena
+        self.activity_gate = activity_gate
+        # ActivityMap of the loaded audio, detected by the first gated step.
+        self.activity = None
+
+    def close(self):
+        """Shuts down the channel worker processes, if any were started."""
+        if self._channel_pool is not None:
+            self._channel_pool.shutdown(cancel_futures=True)
+            self._channel_pool = None
+
+    def operation_parameters(self, operation):
+        """The parameters an operation runs with here: its defaults updated with self.parameters."""
+        overrides = self.parameters.get(operation, {})
+        return dict(operation_parameters(operation),
+                    **{name: value for name, value in overrides.items() if name not in _EXECUTION_PARAMETERS})
+
+    def adapt(self, operations, analysis, skip=True, tune=True):
+        """
+        Fits operations to a file from its analysis (see operations.analysis): leaves out those
+        whose skip condition holds, and tunes the parameters of the rest. An operation measuring
+        its input (Volume Normalization) is only skipped or tuned when no operation runs before it,
+        since those change what it would measure.
+
+        Parameters:
+            operations (list): Operation names.
+            analysis (dict): FileAnalyzer measurements of the file.
+            skip (bool): Apply the skip conditions.
+            tune (bool): Tune parameters; the processor's own parameters are never overridden.
+
+        Returns:
+            tuple: (operations to run in OPERATION_ORDER, {skipped operation: reason},
+                {operation: tuned parameters}); see with_parameters for running with the latter.
+        """
+        run, skipped, tuned = [], {}, {}
+        for op in sort_operations(operations):
+            entry = OPERATIONS.get(op)
+            if entry is None:
+                # Left for plan_operations to report.
+                run.append(op)
+                continue
+            if entry.measures_input and run:
+                run.append(op)
+                continue
+            parameters = self.operation_parameters(op)
+            if skip and entry.skip is not None:
+                reason = entry.skip(analysis, **parameters)
+                if reason:
+                    skipped[op] = reason
+                    continue
+            if tune and entry.tune is not None:
+                values = {name: value for name, value in entry.tune(analysis, **parameters).items()
+                          if name not in self.parameters.get(op, {})}
+                if values:
+                    tuned[op] = values
+            run.append(op)
+        return run, skipped, tuned
+
+    @contextlib.contextmanager
+    def with_parameters(self, overrides):
+        """Runs the block with self.parameters updated by overrides ({operation: parameters})."""
+        parameters = self.parameters
+        self.parameters = {op: dict(values) for op, values in parameters.items()}
+        for op, values in overrides.items():
+            self.parameters.setdefault(op, {}).update(values)
+        try:
+            yield self
+        finally:
+            self.parameters = parameters
+
+    def plan(self, operations):
+        """plan_operations for this processor: with an activity gate, gated operations run on their own."""
+        return plan_operations(operations, gated=self.activity_gate is not None)
+
+    def _step_parameters(self, operation):
+        # Parameters identifying an operation's results: gated results also depend on the gate.
+        parameters = self.operation_parameters(operation)
+        if self.activity_gate is not None and OPERATIONS[operation].gated:
+            parameters["activity"] = self.activity_gate.settings()
+        return parameters
+
+    def settings(self, operations):
+        """
+        Returns:
+            dict: The parameters the given operations run with here, by operation, as identify
+                their results (gated ones with the activity gate's settings).
+        """
+        return {op: self._step_parameters(op) for op in sort_operations(operations) if op in OPERATIONS}
+
+    def activity_map(self):
+        """
+        Returns the ActivityMap of audio_data, detected with activity_gate when there is none yet
+        for audio of this length. With a cache, it is stored with the measurements of the audio
+        it was detected on, so processing that audio again does not detect it again.
+        """
+        from operations.activity import ActivityMap
+        length = frame_count(self.audio_data)
+        if self.activity is not None and (self.activity.length, self.activity.sample_rate) == (length,
+                                                                                           self.sample_rate):
+            return self.activity
+        settings = self.activity_gate.settings()
+        key = self.cache_key if self.cache is not None else None
+        if key is not None:
+            stored = self.cache.get_measurements(key).get("activity")
+            if stored is not None and stored.get("settings") == settings:
+                self.activity = ActivityMap.from_dict(stored)
+                return self.activity
+        self.activity = self.activity_gate.detect(self.audio_data, self.sample_rate)
+        if key is not None:
+            self.cache.put_measurements(key, activity=dict(self.activity.to_dict(), settings=settings))
+        return self.activity
+
+    def _spectral_stage(self, operation):
+        stage = OPERATIONS[operation].spectral
+        overrides = self._overrides(operation, stage.function)
+        return stage._replace(function=functools.partial(stage.function, **overrides)) if overrides else stage
+
+    def _overrides(self, operation, function):
+        # Parameters given to an operation's function: self.parameters, plus channel_workers as
+        # workers for a function that splits its work over processes itself.
+        overrides = self.parameters.get(operation, {})
+        if "workers" in inspect.signature(function).parameters and "workers" not in overrides:
+            overrides = dict(overrides, workers=self.channel_workers)
+        return overrides
+
+    def _apply_whole(self, operation, audio_data, progress, out=None):
+        """Runs an operation's whole-buffer function on audio_data, on every channel separately if it needs to."""
+        apply = OPERATIONS[operation].apply
+        overrides = self._overrides(operation, apply)
+        accepts = inspect.signature(apply).parameters
+        if out is not None and "out" in accepts:
+            overrides = dict(overrides, out=out)
+        if audio_data.ndim > 1 and not OPERATIONS[operation].multichannel:
+            return self._apply_per_channel(operation, audio_data, progress, self.parameters.get(operation, {}), out=out)
+        if "progress" in accepts:
+            return apply(audio_data, self.sample_rate, progress=progress, **overrides)
+        return apply(audio_data, self.sample_rate, **overrides)
+
+    def _apply_per_channel(self, operation, audio_data, progress, overrides, out=None):
+        """
+        Runs a whole-buffer operation on every channel of audio_data separately, into out (default:
+        a new float32 array). With more than one channel worker the channels run on worker
+        processes, since some operations (e.g. the echo canceller's block loop) hold the GIL;
+        progress is then reported per finished channel.
+        """
+        apply = OPERATIONS[operation].apply
+        channels = channel_count(audio_data)
+        if out is None:
+            out = np.empty(audio_data.shape, dtype=np.float32)
+        workers = min(self.channel_workers, channels)
+        if workers <= 1:
+            accepts = inspect.signature(apply).parameters
+            for c in range(channels):
+                parameters = dict(overrides)
+                if progress is not None and "progress" in accepts:
+                    parameters["progress"] = lambda done, total, c=c: progress(c * total + done, channels * total)
+                if "out" in accepts:
+                    apply(audio_data[c], self.sample_rate, out=out[c], **parameters)
+                else:
+                    out[c] = apply(audio_data[c], self.sample_rate, **parameters)
+            return out
+        if self._channel_pool is None:
+            # Spawned fresh, like the batch workers, so they do not inherit the GUI's threads.
+            self._channel_pool = ProcessPoolExecutor(max_workers=self.channel_workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            # A worker process (e.g. a batch worker) waits for its children as it exits, before the
+            # interpreter would stop the pool, so the pool is shut down first - ahead of the
+            # finalizers that close its queues (exit priority 10).
+            Finalize(self, self._channel_pool.shutdown, exitpriority=100)
+        futures = {self._channel_pool.submit(_apply_to_channel, operation, np.ascontiguousarray(audio_data[c]),
+                                             self.sample_rate, overrides): c
+                   for c in range(channels)}
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                out[futures[future]] = future.result()
+                if progress is not None:
+                    progress(done, channels)
+        finally:
+            for future in futures:
+                future.cancel()
+        return out
+
+    def _stage(self, name, samples=None):
+        """Telemetry stage around a block of work, or a no-op without telemetry."""
+        if self.telemetry is None:
+            return contextlib.nullcontext({})
+        return self.telemetry.stage(name, samples, self.sample_rate)
+
+    def _refresh_overview(self, filepath=None):
+        if not self.keep_overview:
+            return
+        if filepath is not None:
+            self.pyramid = WaveformPyramid.for_file(filepath, self.audio_data)
+        else:
+            self.pyramid = WaveformPyramid.from_array(self.audio_data)
 
     def load_audio(self, filepath):
         """
-        Loads an audio file (any format via pydub), converts it to mono,
-        and normalizes the samples to [-1, 1].
+        Loads an audio file, keeping its channels, and normalizes the samples to [-1, 1].
+
+        WAV, FLAC, OGG and other formats libsndfile reads are decoded natively (see
+        audio_io.read_audio); anything else, such as MP3, goes through pydub.
+
+        Raises:
+            ValueError: If the file has no audio.
         """
+        if self.telemetry is not None:
+            self.telemetry.current_file = filepath
+        with self._stage("decode") as record:
+            self._decode(filepath)
+            record.update(samples=frame_count(self.audio_data), sample_rate=self.sample_rate)
+        self.activity = None
+        self.cache_key = file_key(filepath) if self.cache is not None else None
+        self._refresh_overview(filepath)
+
+    def _decode(self, filepath):
+        decoded = read_audio(filepath)
+        if decoded is not None:
+            self.audio_data, self.sample_rate = decoded
+        else:
+            self._decode_pydub(filepath)
+        if not frame_count(self.audio_data):
+            raise ValueError(f"{filepath} has no audio")
+
+    def _decode_pydub(self, filepath):
+        # pydub (and the ffmpeg it looks for) is only needed for formats libsndfile cannot read.
+        from pydub import AudioSegment
         audio = AudioSegment.from_file(filepath)
-        audio = audio.set_channels(1)  # Force mono
-        data = np.array(audio.get_array_of_samples()).astype(np.float32)
-        self.audio_data = data / (2**15)
+        if audio.sample_width == 3:
+            audio = audio.set_sample_width(4)
+        # pydub holds signed samples of any width; scale by that width rather than assuming 16-bit.
+        data = np.frombuffer(audio.raw_data, dtype=f"<i{audio.sample_width}")
+        if audio.channels > 1:
+            # Interleaved frames to (channels, samples).
+            data = data.reshape(-1, audio.channels).T
+        self.audio_data = np.multiply(data, 1.0 / 2 ** (8 * audio.sample_width - 1), dtype=np.float32)
         self.sample_rate = audio.frame_rate
 
-    def save_audio(self, filepath):
+    def load_cached(self, filepath, operations):
         """
-        Saves the current audio_data as a 16-bit PCM WAV file.
+        Loads a file for processing with the given operations, skipping as much work as the cache allows.
+
+        When results of running a leading part of the operations on this file are cached, the
+        furthest one is loaded instead of decoding the file; otherwise this is load_audio.
+        Operations are grouped into steps as plan_operations does, and only whole steps are skipped.
+
+        Returns:
+            list: The operations still to apply.
+        """
+        operations = sort_operations(operations)
+        if self.cache is None:
+            self.load_audio(filepath)
+            return operations
+        self.activity = None
+        if self.telemetry is not None:
+            self.telemetry.current_file = filepath
+        with self._stage("decode") as record:
+            source_key = key = file_key(filepath)
+            done, done_key = 0, None
+            applied = 0
+            for step in self.plan(operations):
+                key = _step_key(key, *step, self._step_parameters)
+                applied += len(step[1])
+                if self.cache.contains(key):
+                    done, done_key = applied, key
+            cached = self.cache.get(done_key) if done_key is not None else None
+            if cached is None:
+                self._decode(filepath)
+            else:
+                self.audio_data, self.sample_rate = cached
+                record["stage"] = "decode (cached)"
+            record.update(samples=frame_count(self.audio_data), sample_rate=self.sample_rate)
+        if cached is None:
+            self.cache_key = source_key
+            self._refresh_overview(filepath)
+            return operations
+        self.cache_key = done_key
+        self._refresh_overview()
+        return operations[done:]
+
+    def save_audio(self, filepath, subtype="PCM_16"):
+        """
+        Saves the current audio_data with its channel count, in the container of filepath's
+        extension (see audio_io.output_format).
+
+        Parameters:
+            filepath (str): Output path.
+            subtype (str): "PCM_16", "PCM_24" or "FLOAT" (32-bit float).
         """
         if self.audio_data is None:
             raise ValueError("No audio loaded to save.")
-        out_data = (self.audio_data * (2**15)).astype(np.int16)
-        sf.write(filepath, out_data, self.sample_rate)
+        with self._stage("encode", frame_count(self.audio_data)):
+            write_audio(filepath, self.audio_data, self.sample_rate, subtype)
+        if self.keep_overview and self.pyramid is not None:
+            self.pyramid.save(filepath)
+
+    def input_loudness(self):
+        """
+        Returns the integrated loudness of audio_data in LUFS.
+
+        With a cache, the measurement is stored under the audio's cache key, so normalizing
+        the same audio again (e.g. with a different target) does not meter it again.
+        """
+        key = self.cache_key if self.cache is not None else None
+        if key is not None:
+            stored = self.cache.get_measurements(key).get("integrated_lufs")
+            if stored is not None:
+                return float(stored)
+        from operations.loudness import measure_loudness
+        loudness = measure_loudness(self.audio_data, self.sample_rate, true_peak=False).integrated_loudness()
+        if key is not None:
+            self.cache.put_measurements(key, integrated_lufs=loudness)
+        return loudness
 
-    def process_operation(self, operation):
+    def file_loudness(self, filepath, block_size=65536):
+        """
+        Returns the integrated loudness of a file in LUFS, metered block by block while decoding.
+        With a cache, it is stored under the file's hash and read back on later calls.
+        """
+        key = file_key(filepath) if self.cache is not None else None
+        if key is not None:
+            stored = self.cache.get_measurements(key).get("integrated_lufs")
+            if stored is not None:
+                return float(stored)
+        from operations.loudness import LoudnessMeter
+        meter = None
+        for sample_rate, block in _read_blocks(filepath, block_size):
+            if meter is None:
+                meter = LoudnessMeter(sample_rate, true_peak=False)
+            meter.update(block)
+        loudness = meter.integrated_loudness() if meter is not None else -np.inf
+        if key is not None:
+            self.cache.put_measurements(key, integrated_lufs=loudness)
+        return loudness
+
+    def file_analysis(self, filepath, index=None, block_size=65536):
+        """
+        Returns the analysis of a file (see operations.analysis), measured block by block while
+        decoding, or None for a file without samples. With an AnalysisIndex, it is read from the
+        index while the file is unchanged, and stored there otherwise.
+        """
+        if index is not None:
+            stored = index.get(filepath)
+            if stored is not None:
+                return stored
+        from operations.analysis import FileAnalyzer
+        with self._stage("analyze") as record:
+            analyzer = None
+            for sample_rate, block in _read_blocks(filepath, block_size):
+                if analyzer is None:
+                    analyzer = FileAnalyzer(sample_rate)
+                analyzer.update(block)
+            if analyzer is None:
+                return None
+            record.update(samples=analyzer.samples, sample_rate=analyzer.sample_rate)
+            analysis = analyzer.measurements()
+        if index is not None:
+            index.put(filepath, analysis)
+        return analysis
+
+    def process_operation(self, operation, progress=None):
         """
         Processes the audio data with the specified operation.
-        For now, only 'Noise Reduction' is implemented.
+
+        Parameters:
+            operation (str): Operation name.
+            progress (callable, optional): Called as progress(done, total) while the operation runs;
+                block-based operations call it after every block, others once at the end. It may raise
+                ProcessingCancelled to stop the operation.
+        """
+        for step in self.plan([operation]):
+            self.run_step(step, progress)
+
+    def process_operations(self, operations, progress=None, output_path=None, subtype="PCM_16"):
+        """
+        Applies several operations in OPERATION_ORDER, regardless of the order they are given in.
+
+        Operations are run in the passes chosen by plan(): consecutive spectral
+        operations share one STFT, and consecutive gain/clip/compression operations are fused
+        into one in-place pass. With output_path set, the result is also saved; when the last
+        pass is pointwise, quantizing and writing happen inside that same pass.
+
+        Parameters:
+            operations (list): Operation names.
+            progress (callable, optional): Called as progress(done, total) within each pass.
+            output_path (str, optional): Where to save the result.
+            subtype (str): Output sample format when saving.
+        """
+        steps = self.plan(operations)
+        if output_path is None:
+            for step in steps:
+                self.run_step(step, progress)
+            return
+        if not steps:
+            self.save_audio(output_path, subtype)
+            return
+        for step in steps[:-1]:
+            self.run_step(step, progress)
+        self.run_step_and_save(steps[-1], output_path, subtype, progress)
+
+    def run_step_and_save(self, step, output_path, subtype="PCM_16", progress=None):
+        """
+        Runs a plan step and saves the result. A pointwise step quantizes and writes each
+        block as soon as it is processed, instead of making a second pass to save.
+        """
+        if step[0] != "pointwise":
+            self.run_step(step, progress)
+            self.save_audio(output_path, subtype)
+            return
+        with AudioWriter(output_path, self.sample_rate, subtype, channels=channel_count(self.audio_data)) as writer:
+            self.run_step(step, progress, sink=writer)
+        if self.keep_overview and self.pyramid is not None:
+            self.pyramid.save(output_path)
+
+    def run_step(self, step, progress=None, sink=None):
+        """
+        Runs one (kind, operations) step from plan_operations on audio_data.
+
+        Parameters:
+            step (tuple): ("spectral" | "pointwise" | "whole", [operation names]).
+            progress (callable, optional): Called as progress(done, total) while the step runs.
+            sink (object, optional): Has write(block); receives the step's output.
         """
         if self.audio_data is None:
             raise ValueError("No audio loaded for processing.")
-        if operation == "Noise Reduction":
-            self.audio_data = apply_noise_reduction(self.audio_data, self.sample_rate)
-        # Future operations (e.g., echo reduction) can be added here.
+        # A step writing to a sink also encodes; it is timed as one stage.
+        name = " + ".join(step[1]) + (" + encode" if sink is not None else "")
+        with self._stage(name, frame_count(self.audio_data)) as record:
+            cached = self._run_step(step, progress, sink)
+            if cached:
+                record["stage"] = name + " (cached)"
+            elif self._gated(step):
+                record["active_fraction"] = self.activity.active_fraction()
+        self._refresh_overview()
+        if progress is not None:
+            progress(1, 1)
+
+    def _gated(self, step):
+        # True when a step runs on the active segments only.
+        return self.activity_gate is not None and any(OPERATIONS[op].gated for op in step[1])
+
+    def _run_step(self, step, progress, sink):
+        # Returns True when the step's result came from the cache.
+        kind, operations = step
+        previous = self.audio_data
+
+        key = None
+        if self.cache is not None and self.cache_key is not None:
+            key = _step_key(self.cache_key, kind, operations, self._step_parameters)
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.audio_data, self.sample_rate = cached
+                self.cache_key = key
+                if self.arena is not None:
+                    self.arena.give_back(previous)
+                if sink is not None:
+                    sink.write(self.audio_data)
+                return True
+
+        spans = None
+        if self._gated(step):
+            from operations.activity import ActiveSpans
+            spans = ActiveSpans(self.activity_map(), self.activity_gate, self.audio_data)
+
+        # In arena mode a step writes into a borrowed buffer (a pointwise step into audio_data itself).
+        out = None
+        if self.arena is not None and kind != "pointwise":
+            out = self.arena.borrow(self.audio_data.shape, np.float32)
+        if kind == "spectral":
+            stages = [self._spectral_stage(op) for op in operations]
+            self.audio_data = apply_spectral_stages(self.audio_data, self.sample_rate, stages,
+                                                    workers=self.channel_workers, out=out, arena=self.arena)
+        elif kind == "pointwise":
+            stages = []
+            for op in operations:
+                parameters = self.operation_parameters(op)
+                if OPERATIONS[op].measures_input and parameters.get("measured_lufs") is None:
+                    parameters["measured_lufs"] = self.input_loudness()
+                op_stages = OPERATIONS[op].pointwise(self.audio_data, self.sample_rate, **parameters)
+                if spans is not None and OPERATIONS[op].gated:
+                    from operations.activity import GatedStage
+                    op_stages = [GatedStage(stage, spans) for stage in op_stages]
+                stages += op_stages
+            in_place = self.audio_data if self.arena is not None and self.audio_data.dtype == np.float32 else None
+            self.audio_data = PointwiseChain(stages, POINTWISE_BLOCK).run(self.audio_data, out=in_place, sink=sink,
+                                                                          progress=progress)
+            sink = None
+        elif spans is not None:
+            # Each active segment is run through the operation on its own; the result goes into out.
+            (operation,) = operations
+
+            def process(segment, segment_progress):
+                return self._apply_whole(operation, segment, segment_progress)
+            self.audio_data = spans.run(self.audio_data, process, out=out, progress=progress)
+        else:
+            (operation,) = operations
+            self.audio_data = self._apply_whole(operation, self.audio_data, progress, out)
+        if self.arena is not None:
+            self._settle_arena(previous, out)
+        if sink is not None:
+            sink.write(self.audio_data)
+        if key is not None:
+            self.cache.put(key, self.audio_data, self.sample_rate)
+        self.cache_key = key
+        return False
+
+    def _settle_arena(self, previous, out):
+        # After a step in arena mode: keep the result in float32, and give back the step's input and
+        # any borrowed buffer the operation did not write into.
+        if out is not None and self.audio_data is not out:
+            if self.audio_data.dtype == np.float32:
+                self.arena.give_back(out)
+            else:
+                np.copyto(out, self.audio_data, casting="unsafe")
+                self.arena.give_back(self.audio_data)
+                self.audio_data = out
+        if previous is not self.audio_data:
+            self.arena.give_back(previous)
+
+    def process_file_streaming(self, input_path, output_path, operations, block_size=65536,
+                               target_lufs=-16.0, progress=None, subtype="PCM_16", normalization="exact",
+                               monitor=None):
+        """
+        Processes a file block by block without holding it in memory, writing the output as it goes.
+
+        Stateful stages carry their state from block to block and STFT-based stages overlap-add,
+        so peak memory depends on block_size (and the WPE segment length), not on the file length.
+
+        Volume Normalization needs the loudness of everything before it. In "exact" mode:
+        - when it is the first operation, the file's loudness is taken from the processor's
+          measured_lufs parameter, read from the cache or metered in a decode-only pass (no audio
+          is written), then the chain runs in one pass;
+        - otherwise the stages before it are run into a temporary float32 file while the
+          loudness is measured, and the rest of the chain is run from that file.
+        In "lookahead" mode the whole chain is one pass, and normalization follows the loudness
+        measured so far plus a 3 s lookahead (see StreamingLoudnessNormalizer).
+
+        Parameters:
+            input_path (str): Audio file to process.
+            output_path (str): Where the WAV result is written.
+            operations (list): Operation names; they are applied in OPERATION_ORDER.
+            block_size (int): Samples read and processed at a time.
+            target_lufs (float): Target loudness for Volume Normalization.
+            progress (callable, optional): Called as progress(samples_written) after every block.
+            subtype (str): Output sample format, "PCM_16", "PCM_24" or "FLOAT".
+            normalization (str): "exact" or "lookahead", as described above.
+            monitor (callable, optional): Called as monitor(block) with every block of output as it
+                is written (e.g. a live view, see operations.audio_visualization.PipelineTap). The
+                block may be reused after the call returns, so it must be copied to be kept.
+        """
+        from operations.volume_normalization import LinearGain
+        if normalization not in ("exact", "lookahead"):
+            raise ValueError(f"Unknown normalization mode: {normalization}")
+        operations = sort_operations(operations)
+        if self.telemetry is not None:
+            self.telemetry.current_file = input_path
+        if "Volume Normalization" not in operations or normalization == "lookahead":
+            self._stream(input_path, output_path, operations, block_size, subtype=subtype, progress=progress,
+                         overview=self.keep_overview, monitor=monitor,
+                         parameters={"Volume Normalization": {"target_lufs": target_lufs}})
+            return
+
+        split = operations.index("Volume Normalization")
+        before, after = operations[:split], operations[split + 1:]
+        if not before:
+            loudness = self.parameters.get("Volume Normalization", {}).get("measured_lufs")
+            if loudness is None:
+                with self._stage("measure loudness"):
+                    loudness = self.file_loudness(input_path, block_size)
+            gain = LinearGain(target_lufs - loudness if np.isfinite(loudness) else 0.0)
+            self._stream(input_path, output_path, after, block_size, subtype=subtype, first_stage=gain,
+                         progress=progress, overview=self.keep_overview, monitor=monitor)
+            return
+
+        fd, temp_path = tempfile.mkstemp(suffix=".wav", dir=os.path.dirname(os.path.abspath(output_path)))
+        os.close(fd)
+        try:
+            meter = self._stream(input_path, temp_path, before, block_size, subtype="FLOAT", measure=True)
+            loudness = meter.integrated_loudness()
+            gain = LinearGain(target_lufs - loudness if np.isfinite(loudness) else 0.0)
+            self._stream(temp_path, output_path, after, block_size, subtype=subtype, first_stage=gain,
+                         progress=progress, overview=self.keep_overview, monitor=monitor)
+        finally:
+            os.remove(temp_path)
+
+    def _stream(self, input_path, output_path, operations, block_size, subtype="PCM_16",
+                measure=False, first_stage=None, progress=None, overview=False, parameters=None, monitor=None):
+        """
+        Runs one streaming pass: read blocks, push them through the stages, write the result.
+        With overview set, a WaveformPyramid of the output is built as it is written and saved
+        as its sidecar. parameters maps operation names to parameters overriding their defaults.
+        monitor, if given, is called with every block written.
+
+        Returns:
+            LoudnessMeter: Loudness of the written output when measure is set, otherwise None.
+
+        Raises:
+            ValueError: If the input has no audio.
+        """
+        from operations.loudness import LoudnessMeter
+        # The whole pass (decoding, every stage and encoding) is one telemetry stage.
+        name = " + ".join(["decode"] + (["Volume Normalization"] if first_stage else []) + list(operations)
+                          + ["encode"])
+        with self._stage(f"stream: {name}") as record:
+            blocks = _read_blocks(input_path, block_size)
+            sample_rate, first_block = next(blocks, (None, None))
+            if first_block is None:
+                raise ValueError(f"{input_path} has no audio")
+            channels = channel_count(first_block)
+            stages = [first_stage] if first_stage else []
+            parameters = parameters or {}
+            stages += [make_streaming_stage(op, sample_rate, channels, self.channel_workers,
+                                            **dict(self.parameters.get(op, {}), **parameters.get(op, {})))
+                       for op in operations]
+            meter = LoudnessMeter(sample_rate, true_peak=False) if measure else None
+            pyramid = WaveformPyramid() if overview else None
+            latency = sum(stage.latency for stage in stages)
+            to_skip = latency
+            written = 0
+
+            # In the container of output_path's extension, like save_audio; written next to
+            # output_path and renamed over it once complete.
+            file_format, subtype = output_format(output_path, subtype)
+            with atomic_output(output_path) as temp_path, \
+                    sf.SoundFile(temp_path, "w", samplerate=sample_rate, channels=channels, subtype=subtype,
+                                 format=file_format) as sink:
+                def run(block):
+                    nonlocal to_skip, written
+                    for stage in stages:
+                        block = stage.process(block)
+                    # The first `latency` samples out of the chain precede the start of the file.
+                    skipped = min(to_skip, block.shape[-1])
+                    block = block[..., skipped:]
+                    to_skip -= skipped
+                    if block.shape[-1]:
+                        if meter is not None:
+                            meter.update(block)
+                        if pyramid is not None:
+                            pyramid.append(block)
+                        sink.write(block.T)
+                        if monitor is not None:
+                            monitor(block)
+                        written += block.shape[-1]
+                        if progress is not None:
+                            progress(written)
+
+                run(first_block)
+                for _, block in blocks:
+                    run(block)
+
+                # Push silence through the chain to drain the samples the stages are still holding.
+                remaining = latency
+                while remaining:
+                    size = min(block_size, remaining)
+                    run(np.zeros(first_block.shape[:-1] + (size,), dtype=np.float32))
+                    remaining -= size
+            record.update(samples=written, sample_rate=sample_rate)
+        if pyramid is not None:
+            pyramid.save(output_path)
+        return meter
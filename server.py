@@ -0,0 +1,406 @@
+"""
+Streaming processing server for live audio.
+
+Clients send raw PCM over a TCP or Unix socket (or a pipe, with --stdio) and get the
+processed audio back frame by frame. Every stream runs through its own copy of the
+streaming processing chain, configured for low latency (see live_parameters). A stream's
+latency is reported when it starts, and a stream whose chain would exceed the latency
+budget is refused. The processing time of every frame is recorded and exported as metrics.
+
+Protocol (sockets):
+    1. The client sends one line of JSON describing its stream:
+           {"sample_rate": 16000, "channels": 1, "format": "f32"}
+       format is "f32" (32-bit float) or "s16" (16-bit integer), little-endian and interleaved.
+    2. The server answers with one line of JSON: the stream's settings,
+           {"operations": [...], "frame_samples": 160, "delay_samples": 320, "latency_ms": 30.0, ...}
+       or {"error": "..."}, after which it closes the connection.
+    3. The client streams PCM. For every frame the server returns as many samples, delay_samples
+       behind: the first delay_samples returned precede the input.
+    4. Once the client shuts down its sending side, the server returns the delay_samples it still
+       holds and closes the connection.
+
+With --stdio there is no handshake: the stream format comes from the command line, PCM is
+read from stdin and the processed PCM written to stdout.
+
+Usage:
+    python server.py --tcp 127.0.0.1:8765 --noise --echo --compress --max-latency-ms 50
+    python server.py --unix /tmp/audiopolish.sock --noise --compress --metrics metrics.json
+    python server.py --stdio --sample-rate 16000 --noise --compress < input.raw > output.raw
+"""
+import argparse
+import itertools
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from processing import make_streaming_stage, sort_operations
+from telemetry import FrameMetrics
+
+DEFAULT_FRAME_MS = 10.0
+DEFAULT_MAX_LATENCY_MS = 100.0
+
+# Sample formats of the PCM stream.
+FORMATS = {"f32": np.dtype("<f4"), "s16": np.dtype("<i2")}
+
+# Longest normalization lookahead, as in file processing.
+_MAX_LOOKAHEAD = 3.0
+
+
+def live_parameters(operation, sample_rate, frame_samples):
+    """
+    Streaming-stage settings that keep an operation's latency low. The file defaults favour
+    quality instead (1024-sample echo blocks, 10 s WPE segments).
+    """
+    if operation == "Noise Reduction":
+        # An FFT of at most 32 ms, and one frame of mask lookahead.
+        n_fft = 1 << int(np.log2(0.032 * sample_rate))
+        return {"n_fft": n_fft, "time_mask_smooth_ms": 1000 * (n_fft // 4) / sample_rate}
+    if operation == "Echo Reduction":
+        # One adaptive-filter partition per frame.
+        return {"block_size": frame_samples}
+    if operation == "Reverb Reduction":
+        return {"segment_seconds": 0.25}
+    return {}
+
+
+class LiveChain:
+    """
+    The streaming processing chain of one live stream.
+
+    Frames are pushed through the stages in order, each stage keeping its state between
+    frames. The output lags the input by `delay` samples, the sum of the stage latencies;
+    `latency` adds the frame the server collects before processing it. Volume Normalization
+    looks ahead as far as the budget left by the other stages allows (up to 3 s); with no
+    budget left it follows the loudness measured so far.
+    """
+
+    def __init__(self, operations, sample_rate, channels=1, frame_samples=None,
+                 max_latency_ms=DEFAULT_MAX_LATENCY_MS, parameters=None):
+        """
+        Parameters:
+            operations (list): Operation names; they are applied in OPERATION_ORDER.
+            sample_rate (int): Sample rate of the stream.
+            channels (int): Channel count of the stream.
+            frame_samples (int, optional): Samples per frame (default: 10 ms).
+            max_latency_ms (float, optional): Latency budget; None for no budget.
+            parameters (dict, optional): Parameters overriding the live settings, by operation.
+
+        Raises:
+            ValueError: If the chain's latency exceeds the budget.
+        """
+        parameters = parameters or {}
+        self.operations = sort_operations(operations)
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frame_samples = frame_samples or int(sample_rate * DEFAULT_FRAME_MS / 1000)
+        budget = None if max_latency_ms is None else int(max_latency_ms * sample_rate / 1000)
+
+        def stage(operation, **settings):
+            settings.update(live_parameters(operation, sample_rate, self.frame_samples))
+            settings.update(parameters.get(operation, {}))
+            # One thread per stream: the server runs many streams side by side.
+            return make_streaming_stage(operation, sample_rate, channels, 1, **settings)
+
+        stages = {op: stage(op) for op in self.operations if op != "Volume Normalization"}
+        if "Volume Normalization" in self.operations:
+            used = self.frame_samples + sum(s.latency for s in stages.values())
+            lookahead = _MAX_LOOKAHEAD if budget is None else min(_MAX_LOOKAHEAD, max(0, budget - used) / sample_rate)
+            stages["Volume Normalization"] = stage("Volume Normalization", lookahead=lookahead)
+        self.stages = [stages[op] for op in self.operations]
+        self.stage_latency = {op: stages[op].latency for op in self.operations}
+        self.delay = sum(self.stage_latency.values())
+        self.latency = self.frame_samples + self.delay
+
+        if budget is not None and self.latency > budget:
+            parts = [f"{self._ms(self.frame_samples):.1f} ms frame"]
+            parts += [f"{self._ms(samples):.1f} ms {op}" for op, samples in self.stage_latency.items()]
+            raise ValueError(f"Latency of {self._ms(self.latency):.1f} ms exceeds the budget of "
+                             f"{max_latency_ms:g} ms ({', '.join(parts)})")
+
+    def _ms(self, samples):
+        return 1000 * samples / self.sample_rate
+
+    def settings(self):
+        """The stream's settings, as sent to the client."""
+        return {
+            "operations": self.operations,
+            "sample_rate": self.sample_rate,
+            "channels": self.channels,
+            "frame_samples": self.frame_samples,
+            "delay_samples": self.delay,
+            "latency_ms": self._ms(self.latency),
+            "stage_latency_ms": {op: self._ms(samples) for op, samples in self.stage_latency.items()},
+        }
+
+    def process(self, frame):
+        """Returns as many processed samples as given (1D, or (channels, samples)), `delay` behind."""
+        for stage in self.stages:
+            frame = stage.process(frame)
+        return frame
+
+    def flush(self):
+        """Returns the `delay` samples still held back at the end of the stream."""
+        leading = () if self.channels == 1 else (self.channels,)
+        return self.process(np.zeros(leading + (self.delay,), dtype=np.float32))
+
+
+def _to_float(pcm, channels):
+    # Interleaved PCM to a float32 1D or (channels, samples) array.
+    audio = pcm.reshape(-1, channels).T
+    if pcm.dtype.kind == "i":
+        audio = audio * np.float32(1 / 32768)
+    audio = np.ascontiguousarray(audio, dtype=np.float32)
+    return audio[0] if channels == 1 else audio
+
+
+def _to_pcm(audio, dtype):
+    # float32 1D or (channels, samples) array to interleaved PCM bytes.
+    interleaved = audio.T if audio.ndim > 1 else audio
+    if dtype.kind == "i":
+        interleaved = np.clip(interleaved * 32768.0, -32768, 32767)
+    return np.ascontiguousarray(interleaved, dtype=dtype).tobytes()
+
+
+def _read_frame(read_into, view):
+    # Fills view from the stream; returns the bytes read, fewer only at the end of the stream.
+    filled = 0
+    while filled < len(view):
+        count = read_into(view[filled:])
+        if not count:
+            break
+        filled += count
+    return filled
+
+
+def serve_stream(read_into, write, chain, sample_format, metrics=None):
+    """
+    Processes one stream until its end: reads PCM frames, writes the processed frames, then
+    the samples the chain still holds.
+
+    Parameters:
+        read_into (callable): Fills a writable buffer from the input, returning the bytes read
+            (0 at the end of the stream), like a binary file's readinto.
+        write (callable): Writes bytes to the output.
+        chain (LiveChain): The stream's processing chain.
+        sample_format (str): "f32" or "s16".
+        metrics (FrameMetrics, optional): Records the processing time of every frame.
+    """
+    dtype = FORMATS[sample_format]
+    sample_bytes = chain.channels * dtype.itemsize
+    buffer = bytearray(chain.frame_samples * sample_bytes)
+    view = memoryview(buffer)
+    while True:
+        filled = _read_frame(read_into, view)
+        samples = filled // sample_bytes
+        if samples:
+            started = time.perf_counter()
+            frame = _to_float(np.frombuffer(buffer, dtype, samples * chain.channels), chain.channels)
+            data = _to_pcm(chain.process(frame), dtype)
+            if metrics is not None:
+                metrics.record(time.perf_counter() - started, samples)
+            write(data)
+        if filled < len(buffer):
+            break
+    write(_to_pcm(chain.flush(), dtype))
+
+
+class StreamServer:
+    """
+    Serves live streams over a TCP or Unix socket, each on its own thread.
+
+    Metrics of the streams (current and finished) are kept by stream number and can be
+    written to a JSON file every few seconds.
+    """
+
+    def __init__(self, operations, frame_ms=DEFAULT_FRAME_MS, max_latency_ms=DEFAULT_MAX_LATENCY_MS,
+                 parameters=None, log=None):
+        """
+        Parameters:
+            operations (list): Operation names applied to every stream.
+            frame_ms (float): Length of the frames processed at a time.
+            max_latency_ms (float, optional): Latency budget of a stream; None for no budget.
+            parameters (dict, optional): Parameters overriding the live settings, by operation.
+            log (callable, optional): Called with a line of text for every stream started and finished.
+        """
+        self.operations = operations
+        self.frame_ms = frame_ms
+        self.max_latency_ms = max_latency_ms
+        self.parameters = parameters
+        self.log = log or (lambda line: None)
+        self.streams = {}
+        self._numbers = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = None
+
+    def open_chain(self, sample_rate, channels):
+        """Creates the chain of a new stream (raises ValueError if it exceeds the budget)."""
+        return LiveChain(self.operations, sample_rate, channels, int(sample_rate * self.frame_ms / 1000),
+                         self.max_latency_ms, self.parameters)
+
+    def metrics(self):
+        """
+        Returns:
+            dict: {"streams": [...]}, every stream's settings, state and FrameMetrics snapshot.
+        """
+        with self._lock:
+            streams = list(self.streams.items())
+        return {"streams": [dict(entry["settings"], stream=number, active=entry["active"],
+                                 **entry["metrics"].snapshot())
+                            for number, entry in streams]}
+
+    def handle(self, rfile, wfile):
+        """Runs one client connection: handshake, then the stream (see the module docstring)."""
+        try:
+            header = json.loads(rfile.readline() or b"{}")
+            sample_format = header.get("format", "f32")
+            if sample_format not in FORMATS:
+                raise ValueError(f"Unknown sample format: {sample_format}")
+            chain = self.open_chain(int(header["sample_rate"]), int(header.get("channels", 1)))
+        except (ValueError, KeyError, TypeError) as e:
+            wfile.write(json.dumps({"error": str(e)}).encode() + b"\n")
+            return
+        settings = dict(chain.settings(), format=sample_format)
+        wfile.write(json.dumps(settings).encode() + b"\n")
+
+        number = next(self._numbers)
+        metrics = FrameMetrics(chain.sample_rate, chain.latency)
+        with self._lock:
+            self.streams[number] = {"settings": settings, "metrics": metrics, "active": True}
+        self.log(f"Stream {number}: {chain.sample_rate} Hz, {chain.channels} channel(s), "
+                 f"{settings['latency_ms']:.1f} ms latency")
+        try:
+            serve_stream(rfile.readinto, wfile.write, chain, sample_format, metrics)
+        except OSError:
+            pass  # client went away
+        finally:
+            with self._lock:
+                self.streams[number]["active"] = False
+            s = metrics.snapshot()
+            self.log(f"Stream {number} finished: {s['audio_seconds']:.1f} s of audio, {s['frames']} frames, "
+                     f"{s['mean_ms'] or 0:.2f} ms mean / {s['max_ms']:.2f} ms max per frame, "
+                     f"{s['overruns']} overruns")
+
+    def serve(self, address, family=socket.AF_INET):
+        """Accepts connections at address (host, port), or a path for a Unix socket, until shutdown()."""
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def setup(self):
+                super().setup()
+                if family == socket.AF_INET:
+                    # Frames are small; send them at once rather than coalescing them.
+                    self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def handle(self):
+                server.handle(self.rfile, self.wfile)
+
+        base = socketserver.TCPServer if family == socket.AF_INET else socketserver.UnixStreamServer
+        server_class = type("ThreadingServer", (socketserver.ThreadingMixIn, base),
+                            {"daemon_threads": True, "allow_reuse_address": True})
+        with server_class(address, Handler) as self._server:
+            self._server.serve_forever()
+
+    def shutdown(self):
+        """Stops serve() (from another thread)."""
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def write_metrics(path, metrics):
+    """Writes metrics as JSON, replacing the file atomically so readers never see half of it."""
+    fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, "w") as f:
+        json.dump(metrics, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Process live audio streams over a socket or a pipe.")
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument("--tcp", metavar="HOST:PORT", help="Listen on this TCP address.")
+    where.add_argument("--unix", metavar="PATH", help="Listen on this Unix socket.")
+    where.add_argument("--stdio", action="store_true",
+                       help="Process one stream from stdin to stdout (no handshake; see --sample-rate).")
+    parser.add_argument("--noise", action="store_true", help="Apply Noise Reduction.")
+    parser.add_argument("--echo", action="store_true", help="Apply Echo Reduction.")
+    parser.add_argument("--reverb", action="store_true", help="Apply Reverb Reduction.")
+    parser.add_argument("--normalize", action="store_true", help="Apply Volume Normalization.")
+    parser.add_argument("--compress", action="store_true", help="Apply Volume Compression.")
+    parser.add_argument("--frame-ms", type=float, default=DEFAULT_FRAME_MS,
+                        help="Length of the frames processed at a time (default: 10).")
+    parser.add_argument("--max-latency-ms", type=float, default=DEFAULT_MAX_LATENCY_MS,
+                        help="Refuse streams whose latency (frame plus processing) would exceed this "
+                             "(default: 100; 0 for no limit).")
+    parser.add_argument("--metrics", default=None,
+                        help="Write every stream's per-frame processing times here as JSON.")
+    parser.add_argument("--metrics-interval", type=float, default=5.0,
+                        help="Seconds between metrics updates (default: 5).")
+    parser.add_argument("--sample-rate", type=int, default=16000, help="With --stdio: sample rate (default: 16000).")
+    parser.add_argument("--channels", type=int, default=1, help="With --stdio: channel count (default: 1).")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="f32",
+                        help="With --stdio: sample format (default: f32).")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    flags = [
+        (args.noise, "Noise Reduction"),
+        (args.echo, "Echo Reduction"),
+        (args.reverb, "Reverb Reduction"),
+        (args.normalize, "Volume Normalization"),
+        (args.compress, "Volume Compression"),
+    ]
+    operations = [name for selected, name in flags if selected]
+    server = StreamServer(operations, args.frame_ms, args.max_latency_ms or None,
+                          log=lambda line: print(line, file=sys.stderr, flush=True))
+
+    if args.stdio:
+        try:
+            chain = server.open_chain(args.sample_rate, args.channels)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+        metrics = FrameMetrics(args.sample_rate, chain.latency)
+        output = sys.stdout.buffer
+        serve_stream(sys.stdin.buffer.readinto, lambda data: (output.write(data), output.flush()), chain,
+                     args.format, metrics)
+        print(json.dumps(dict(chain.settings(), **metrics.snapshot())), file=sys.stderr)
+        if args.metrics:
+            write_metrics(args.metrics, {"streams": [dict(chain.settings(), **metrics.snapshot())]})
+        return 0
+
+    if args.metrics:
+        def export():
+            while True:
+                time.sleep(args.metrics_interval)
+                write_metrics(args.metrics, server.metrics())
+        threading.Thread(target=export, daemon=True).start()
+
+    if args.unix:
+        address, family = args.unix, socket.AF_UNIX
+        if os.path.exists(address):
+            os.remove(address)
+    else:
+        host, _, port = args.tcp.rpartition(":")
+        address, family = (host or "127.0.0.1", int(port)), socket.AF_INET
+    print(f"Serving {', '.join(operations) or 'no operations'} on {args.unix or args.tcp}", file=sys.stderr)
+    try:
+        server.serve(address, family)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.metrics:
+            write_metrics(args.metrics, server.metrics())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
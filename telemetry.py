@@ -0,0 +1,266 @@
+"""
+Per-stage measurements of processing runs.
+
+AudioProcessor opens a stage around decoding, every processing step and
+encoding. Each stage records wall time, CPU time, the number of samples it
+processed and the resulting realtime factor, and on request the peak memory
+allocated while it ran. Records can be shown as log lines and exported as JSON or CSV, and a
+single stage can be run under cProfile.
+
+Live streams (see server.py) are measured per frame instead, with FrameMetrics.
+"""
+import contextlib
+import cProfile
+import csv
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+# Columns of a stage record, in report order.
+FIELDS = ["file", "stage", "wall_seconds", "cpu_seconds", "peak_mb", "samples", "audio_seconds",
+          "realtime_factor", "profile"]
+
+
+class Telemetry:
+    """
+    Collects one record per stage.
+
+    Peak memory comes from tracemalloc, which NumPy reports its buffers to. Tracing slows
+    processing down about twofold, so it is off unless trace_memory is set; it is then
+    started by the first stage if nothing else started it, and stopped again once
+    trace_memory is turned off. Stages do not nest: a stage opened inside another is not
+    recorded separately.
+    """
+
+    def __init__(self, trace_memory=False, profile_stage=None, profile_dir=None, on_record=None):
+        """
+        Parameters:
+            trace_memory (bool): Measure peak allocated memory per stage, at a cost in speed.
+            profile_stage (str, optional): Run stages with this name (or containing this
+                operation, for fused steps) under cProfile.
+            profile_dir (str, optional): Where .prof files are written (default: current folder).
+            on_record (callable, optional): Called with every finished record.
+        """
+        self.trace_memory = trace_memory
+        self.profile_stage = profile_stage
+        self.profile_dir = profile_dir
+        self.on_record = on_record
+        self.current_file = None
+        self.records = []
+        self._active = False
+        # Whether tracemalloc was started here, and may be stopped here.
+        self._tracing = False
+
+    def clear(self):
+        self.records = []
+
+    def _profiles(self, name):
+        return self.profile_stage is not None and (
+            name == self.profile_stage or self.profile_stage in name.split(" + "))
+
+    @contextlib.contextmanager
+    def stage(self, name, samples=None, sample_rate=None):
+        """
+        Measures the enclosed block as one stage.
+
+        Yields the record, so samples and sample_rate can be filled in once they are known
+        (e.g. after decoding).
+        """
+        if self._active:
+            yield {}
+            return
+        self._active = True
+        record = {"file": self.current_file, "stage": name, "samples": samples, "sample_rate": sample_rate}
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._tracing = True
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        elif self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        profiler = cProfile.Profile() if self._profiles(name) else None
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record["wall_seconds"] = time.perf_counter() - wall
+            record["cpu_seconds"] = time.process_time() - cpu
+            record["peak_mb"] = ((tracemalloc.get_traced_memory()[1] - baseline) / 1024 ** 2
+                                 if self.trace_memory else None)
+            rate = record.pop("sample_rate")
+            record["audio_seconds"] = record["samples"] / rate if record["samples"] and rate else None
+            record["realtime_factor"] = (record["audio_seconds"] / record["wall_seconds"]
+                                         if record["audio_seconds"] and record["wall_seconds"] else None)
+            record["profile"] = self._save_profile(profiler, name) if profiler is not None else None
+            self._active = False
+            self.records.append(record)
+            if self.on_record is not None:
+                self.on_record(record)
+
+    def _save_profile(self, profiler, name):
+        folder = self.profile_dir or os.getcwd()
+        os.makedirs(folder, exist_ok=True)
+        base = os.path.basename(self.current_file) if self.current_file else "audio"
+        path = os.path.join(folder, f"{base}.{name.replace(' + ', '+').replace(' ', '_')}.prof")
+        profiler.dump_stats(path)
+        return path
+
+    def report(self):
+        """
+        Returns:
+            dict: The stage records and totals over them.
+        """
+        return {"stages": self.records, "totals": summarize(self.records)}
+
+    def save(self, path):
+        """Writes the records as JSON, or as CSV when path ends in .csv."""
+        write_report(path, self.records)
+
+
+class FrameMetrics:
+    """
+    Processing time of every frame of a live stream.
+
+    Counters cover the whole stream; percentiles are taken over the most recent `window`
+    frames, kept in a preallocated ring, so memory stays constant however long the stream
+    runs. A frame that took longer to process than it lasts is an overrun: the stream can
+    only keep up if overruns stay rare.
+    """
+
+    def __init__(self, sample_rate, latency_samples=0, window=10000):
+        """
+        Parameters:
+            sample_rate (int): Sample rate of the stream.
+            latency_samples (int): Latency of the stream, reported with the measurements.
+            window (int): Recent frames the percentiles are taken over.
+        """
+        self.sample_rate = sample_rate
+        self.latency_samples = latency_samples
+        self.frames = 0
+        self.samples = 0
+        self.busy_seconds = 0.0
+        self.max_seconds = 0.0
+        self.overruns = 0
+        self._recent = np.zeros(window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, samples):
+        """Adds a frame of `samples` samples that took `seconds` to process."""
+        with self._lock:
+            self._recent[self.frames % len(self._recent)] = seconds
+            self.frames += 1
+            self.samples += samples
+            self.busy_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            if seconds * self.sample_rate > samples:
+                self.overruns += 1
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: frames, audio_seconds, latency_ms, mean/p50/p95/p99/max processing time per
+                frame in ms, load (processing time over audio time; above 1 the stream falls
+                behind) and overruns.
+        """
+        with self._lock:
+            recent = self._recent[:min(self.frames, len(self._recent))] * 1000
+            audio_seconds = self.samples / self.sample_rate
+            p50, p95, p99 = np.percentile(recent, (50, 95, 99)) if len(recent) else (None, None, None)
+            return {
+                "frames": self.frames,
+                "audio_seconds": audio_seconds,
+                "latency_ms": 1000 * self.latency_samples / self.sample_rate,
+                "mean_ms": 1000 * self.busy_seconds / self.frames if self.frames else None,
+                "p50_ms": p50 if p50 is None else float(p50),
+                "p95_ms": p95 if p95 is None else float(p95),
+                "p99_ms": p99 if p99 is None else float(p99),
+                "max_ms": 1000 * self.max_seconds,
+                "load": self.busy_seconds / audio_seconds if audio_seconds else None,
+                "overruns": self.overruns,
+            }
+
+
+def summarize(records):
+    """Totals over stage records: wall and CPU time, the largest peak, audio length and realtime factor."""
+    wall = sum(r["wall_seconds"] for r in records)
+    peaks = [r["peak_mb"] for r in records if r.get("peak_mb") is not None]
+    # Audio length counted once per file, from its decode stage (or its longest stage).
+    audio = {}
+    for r in records:
+        if r.get("audio_seconds"):
+            audio[r["file"]] = max(audio.get(r["file"], 0.0), r["audio_seconds"])
+    audio_seconds = sum(audio.values())
+    return {
+        "wall_seconds": wall,
+        "cpu_seconds": sum(r["cpu_seconds"] for r in records),
+        "peak_mb": max(peaks) if peaks else None,
+        "audio_seconds": audio_seconds,
+        "realtime_factor": audio_seconds / wall if audio_seconds and wall else None,
+    }
+
+
+def stage_totals(records):
+    """
+    Per-stage totals over many files, to find the slowest stage.
+
+    Returns:
+        dict: {stage: {"files", "wall_seconds", "cpu_seconds", "peak_mb", "realtime_factor"}}, with
+            the largest peak over the files and the realtime factor of all of them together.
+    """
+    totals = {}
+    for r in records:
+        entry = totals.setdefault(r["stage"], {"files": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                               "peak_mb": None, "audio_seconds": 0.0})
+        entry["files"] += 1
+        entry["wall_seconds"] += r["wall_seconds"]
+        entry["cpu_seconds"] += r["cpu_seconds"]
+        if r.get("peak_mb") is not None:
+            entry["peak_mb"] = max(entry["peak_mb"] or 0.0, r["peak_mb"])
+        entry["audio_seconds"] += r.get("audio_seconds") or 0.0
+    for entry in totals.values():
+        audio_seconds = entry.pop("audio_seconds")
+        entry["realtime_factor"] = (audio_seconds / entry["wall_seconds"]
+                                    if audio_seconds and entry["wall_seconds"] else None)
+    return totals
+
+
+def write_report(path, records):
+    """Writes stage records (from one file or a whole batch) as JSON, or as CSV when path ends in .csv."""
+    with open(path, "w", newline="") as f:
+        if path.lower().endswith(".csv"):
+            writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(records)
+        else:
+            json.dump({"stages": records, "totals": summarize(records), "by_stage": stage_totals(records)},
+                      f, indent=2)
+
+
+def format_record(record):
+    """One log line for a stage record."""
+    parts = [f"{record['wall_seconds']:.2f} s", f"{record['cpu_seconds']:.2f} s CPU"]
+    if record.get("peak_mb") is not None:
+        parts.append(f"{record['peak_mb']:.1f} MB peak")
+    if record.get("realtime_factor"):
+        parts.append(f"{record['realtime_factor']:.1f}x realtime")
+    name = os.path.basename(record["file"]) if record.get("file") else "audio"
+    return f"{name}: {record['stage']}: " + ", ".join(parts)
+
+
+def profile_summary(path, limit=15):
+    """Text table of the functions with the most cumulative time in a .prof file."""
+    stream = io.StringIO()
+    pstats.Stats(path, stream=stream).sort_stats("cumulative").print_stats(limit)
+    return stream.getvalue()
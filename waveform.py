@@ -0,0 +1,196 @@
+import os
+import numpy as np
+
+SIDECAR_SUFFIX = ".peaks.npz"
+
+
+class WaveformPyramid:
+    """
+    Multi-resolution min/max overview of an audio buffer, like a DAW overview file.
+
+    Level 0 holds the minimum and maximum of every `base` samples; each level
+    above it merges `factor` buckets of the level below. Drawing a waveform
+    only needs the level whose bucket size matches one screen pixel, so the
+    cost of a redraw depends on the canvas width rather than the file length.
+
+    The pyramid can be built incrementally with append() as blocks arrive. For
+    multichannel audio ((channels, samples) arrays) it holds the envelope of all
+    channels together.
+    """
+
+    def __init__(self, base=256, factor=4):
+        """
+        Parameters:
+            base (int): Samples per bucket on level 0.
+            factor (int): Buckets of one level merged into one bucket of the next.
+        """
+        self.base = base
+        self.factor = factor
+        self.length = 0
+        self.mins = []   # per level: list of arrays while building, one array once finished
+        self.maxs = []
+        # Per-sample minimum and maximum over the channels, not yet summarized into a bucket.
+        self._pending = np.zeros((2, 0), dtype=np.float32)
+        self._finished = False
+
+    @classmethod
+    def from_array(cls, audio_data, base=256, factor=4, block_size=1 << 20):
+        """Builds a finished pyramid from an in-memory buffer, block by block."""
+        pyramid = cls(base, factor)
+        for start in range(0, audio_data.shape[-1], block_size):
+            pyramid.append(audio_data[..., start:start + block_size])
+        pyramid.finish()
+        return pyramid
+
+    def append(self, block):
+        """
+        Adds the next block of samples. Whole buckets are summarized immediately;
+        the remainder waits for the next block or for finish().
+        """
+        block = np.asarray(block, dtype=np.float32)
+        if block.ndim == 1:
+            extremes = np.stack((block, block))
+        else:
+            extremes = np.stack((block.min(axis=0), block.max(axis=0)))
+        samples = np.concatenate((self._pending, extremes), axis=1)
+        whole = samples.shape[1] - samples.shape[1] % self.base
+        self._pending = samples[:, whole:]
+        self.length += whole
+        if whole:
+            buckets = samples[:, :whole].reshape(2, -1, self.base)
+            self._add(0, buckets[0].min(axis=1), buckets[1].max(axis=1))
+
+    def _add(self, level, mins, maxs):
+        if level == len(self.mins):
+            self.mins.append([])
+            self.maxs.append([])
+        self.mins[level].append(mins)
+        self.maxs[level].append(maxs)
+
+    def finish(self):
+        """Summarizes the trailing partial bucket and builds every level above level 0."""
+        if self._pending.shape[1]:
+            self.length += self._pending.shape[1]
+            self._add(0, np.array([self._pending[0].min()]), np.array([self._pending[1].max()]))
+            self._pending = np.zeros((2, 0), dtype=np.float32)
+        if not self.mins:
+            self.mins, self.maxs = [np.zeros(0, np.float32)], [np.zeros(0, np.float32)]
+            self._finished = True
+            return self
+
+        self.mins = [np.concatenate(self.mins[0]).astype(np.float32)]
+        self.maxs = [np.concatenate(self.maxs[0]).astype(np.float32)]
+        while len(self.mins[-1]) > 1:
+            starts = np.arange(0, len(self.mins[-1]), self.factor)
+            self.mins.append(np.minimum.reduceat(self.mins[-1], starts))
+            self.maxs.append(np.maximum.reduceat(self.maxs[-1], starts))
+        self._finished = True
+        return self
+
+    def bucket_size(self, level):
+        """Number of samples summarized by one bucket of the given level."""
+        return self.base * self.factor ** level
+
+    def view(self, start, stop, width, audio_data=None):
+        """
+        Returns a min/max envelope of samples [start, stop) with about `width` columns.
+
+        Picks the coarsest cached level that still has at least one bucket per column.
+        When even level 0 is too coarse and audio_data is given, raw samples are returned
+        (as identical min and max curves).
+
+        Returns:
+            tuple: (sample positions, mins, maxs) as NumPy arrays.
+        """
+        if not self._finished:
+            self.finish()
+        start = max(0, int(start))
+        stop = min(self.length, int(np.ceil(stop)))
+        if stop <= start:
+            empty = np.zeros(0, dtype=np.float32)
+            return empty, empty, empty
+
+        samples_per_column = (stop - start) / max(1, width)
+        if samples_per_column < self.base and audio_data is not None:
+            positions = np.arange(start, stop)
+            segment = audio_data[..., start:stop]
+            if segment.ndim > 1:
+                return positions, segment.min(axis=0), segment.max(axis=0)
+            return positions, segment, segment
+
+        level = 0
+        while (level + 1 < len(self.mins)
+               and self.bucket_size(level + 1) <= samples_per_column):
+            level += 1
+        size = self.bucket_size(level)
+        first, last = start // size, -(-stop // size)
+        mins = self.mins[level][first:last]
+        maxs = self.maxs[level][first:last]
+
+        # Merge whatever is left over so the result is close to `width` columns.
+        group = max(1, len(mins) // max(1, width))
+        if group > 1:
+            starts = np.arange(0, len(mins), group)
+            mins = np.minimum.reduceat(mins, starts)
+            maxs = np.maximum.reduceat(maxs, starts)
+            size *= group
+        positions = first * self.bucket_size(level) + np.arange(len(mins)) * size + size / 2
+        return positions, mins, maxs
+
+    # --- Sidecar files ---
+
+    @staticmethod
+    def sidecar_path(audio_path):
+        return audio_path + SIDECAR_SUFFIX
+
+    def save(self, audio_path):
+        """
+        Writes the pyramid next to the audio file, tagged with the file's size and mtime.
+        Failing to write (e.g. a read-only folder) is not an error.
+        """
+        if not self._finished:
+            self.finish()
+        try:
+            stat = os.stat(audio_path)
+            arrays = {f"min{i}": m for i, m in enumerate(self.mins)}
+            arrays.update({f"max{i}": m for i, m in enumerate(self.maxs)})
+            with open(self.sidecar_path(audio_path), "wb") as f:
+                np.savez(f, meta=np.array([stat.st_size, stat.st_mtime_ns, self.length, self.base, self.factor],
+                                          dtype=np.int64), **arrays)
+        except OSError:
+            pass
+
+    @classmethod
+    def load(cls, audio_path):
+        """
+        Reads the sidecar of an audio file, or returns None if it is missing or stale.
+        """
+        path = cls.sidecar_path(audio_path)
+        try:
+            stat = os.stat(audio_path)
+            with np.load(path) as data:
+                size, mtime_ns, length, base, factor = (int(v) for v in data["meta"])
+                if size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+                    return None
+                levels = sum(1 for key in data.files if key.startswith("min"))
+                pyramid = cls(base, factor)
+                pyramid.length = length
+                pyramid.mins = [data[f"min{i}"] for i in range(levels)]
+                pyramid.maxs = [data[f"max{i}"] for i in range(levels)]
+        except (OSError, KeyError, ValueError):
+            return None
+        pyramid._finished = True
+        return pyramid
+
+    @classmethod
+    def for_file(cls, audio_path, audio_data):
+        """
+        Returns the pyramid of a loaded file, from its sidecar when that is current,
+        otherwise by scanning audio_data and writing a new sidecar.
+        """
+        pyramid = cls.load(audio_path)
+        if pyramid is not None and pyramid.length == audio_data.shape[-1]:
+            return pyramid
+        pyramid = cls.from_array(audio_data)
+        pyramid.save(audio_path)
+        return pyramid